@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Short-lived cache of user records plus the per-user auth epochs tokens must carry.
+
+    A user's auth epoch is bumped whenever their sessions are revoked or their
+    role changes; tokens issued with an older epoch are rejected without a
+    database read once the bump has been broadcast to this worker.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.claims = 0
+        self._entries = OrderedDict()  # user_id -> (expires_at, user)
+        self._min_epochs = {}  # user_id -> lowest epoch still accepted
+
+    def get(self, user_id: str):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user_id: str, user: dict):
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def revoke(self, user_id: str, epoch: int):
+        self._entries.pop(user_id, None)
+        self._min_epochs[user_id] = max(epoch, self._min_epochs.get(user_id, 0))
+
+    def is_revoked(self, user_id: str, token_epoch: int) -> bool:
+        return token_epoch < self._min_epochs.get(user_id, 0)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.claims
+        return {
+            "entries": len(self._entries),
+            "revoked_users": len(self._min_epochs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "claims": self.claims,
+            "hit_ratio": (self.hits + self.claims) / total if total else 0.0,
+        }
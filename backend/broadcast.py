@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBroadcast:
+    """In-process pub/sub. Enough for a single worker; MongoBroadcast fans out across workers."""
+
+    def __init__(self):
+        self.worker_id = str(uuid.uuid4())
+        self._handlers = defaultdict(list)
+
+    def subscribe(self, topic: str, handler):
+        self._handlers[topic].append(handler)
+
+    async def _dispatch(self, topic: str, message: dict):
+        for handler in self._handlers.get(topic, []):
+            try:
+                await handler(message)
+            except Exception:
+                logger.exception(f"Broadcast handler for {topic} failed")
+
+    async def publish(self, topic: str, message: dict):
+        await self._dispatch(topic, message)
+
+    async def start(self, db):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MongoBroadcast(LocalBroadcast):
+    """Fans messages out to every worker through a tailed capped collection."""
+
+    def __init__(self, collection_name: str = "broadcast_events", size_bytes: int = 16 * 1024 * 1024):
+        super().__init__()
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.collection = None
+        self._task = None
+
+    async def publish(self, topic: str, message: dict):
+        # Apply locally right away; other workers pick it up from the tail
+        await self._dispatch(topic, message)
+        await self.collection.insert_one({
+            "topic": topic,
+            "message": message,
+            "origin": self.worker_id,
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    async def start(self, db):
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+            # A tailable cursor on an empty capped collection dies immediately
+            await db[self.collection_name].insert_one({"topic": None, "origin": None})
+        except CollectionInvalid:
+            pass
+        self.collection = db[self.collection_name]
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _tail(self):
+        # Start from the newest entry: anything older was already applied or predates this worker
+        last = await self.collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+
+        while True:
+            try:
+                query = {"_id": {"$gt": last_id}} if last_id else {}
+                cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        if doc.get("topic") and doc.get("origin") != self.worker_id:
+                            await self._dispatch(doc["topic"], doc.get("message", {}))
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Broadcast tail on {self.collection_name} failed: {e}")
+            await asyncio.sleep(1)
+
+
+def create_broadcast(kind: str) -> LocalBroadcast:
+    if kind == "mongo":
+        return MongoBroadcast()
+    if kind == "local":
+        return LocalBroadcast()
+    raise ValueError(f"Unknown broadcast channel: {kind}")
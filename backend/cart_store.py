@@ -0,0 +1,417 @@
+import asyncio
+import copy
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import carts
+from carts import CART_PROJECTION
+from timestamps import parse, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Cart stores behind the cart endpoints:
+#   mongo   every mutation is one atomic write to db.carts (see carts.py)
+#   memory  per-worker hot tier; mutations are applied in memory and dirty
+#           carts are coalesced and flushed in batches. Only correct when a
+#           user's requests always reach the same worker (one worker, or
+#           sticky sessions)
+#   redis   the same write-behind scheme on a shared Redis for multi-worker
+#           deployments
+# create_order flushes the user's cart first, so it always reads db.carts.
+
+
+def _new_cart(user_id: str) -> dict:
+    return {"id": str(uuid.uuid4()), "user_id": user_id, "items": [], "updated_at": utcnow()}
+
+
+def _apply_add(cart: dict, item: dict, max_quantity: int):
+    for line in cart['items']:
+        if line['product_id'] == item['product_id']:
+            line['quantity'] = min(line['quantity'] + item['quantity'], max_quantity)
+            break
+    else:
+        cart['items'].append(dict(item))
+    cart['updated_at'] = utcnow()
+
+
+def _apply_set(cart: dict, product_id: str, quantity: int):
+    for line in cart['items']:
+        if line['product_id'] == product_id:
+            line['quantity'] = quantity
+    cart['updated_at'] = utcnow()
+
+
+def _apply_remove(cart: dict, product_id: str):
+    cart['items'] = [line for line in cart['items'] if line['product_id'] != product_id]
+    cart['updated_at'] = utcnow()
+
+
+def _flush_op(cart: dict, version: int = None) -> UpdateOne:
+    query = {"user_id": cart['user_id']}
+    fields = {"items": cart['items'], "updated_at": parse(cart['updated_at'])}
+    if version is not None:
+        # Flushes from different workers may land out of order; never let an
+        # older snapshot overwrite a newer one
+        query["$or"] = [{"store_version": {"$lt": version}}, {"store_version": {"$exists": False}}]
+        fields["store_version"] = version
+    return UpdateOne(query, {"$set": fields, "$setOnInsert": {"id": cart['id']}}, upsert=True)
+
+
+class MongoCartStore:
+    def __init__(self, collection, max_quantity: int = 100):
+        self.collection = collection
+        self.max_quantity = max_quantity
+
+    async def get(self, user_id: str):
+        return await self.collection.find_one({"user_id": user_id}, CART_PROJECTION)
+
+    async def add_item(self, user_id: str, item: dict) -> dict:
+        return await carts.add_item(self.collection, user_id, item, self.max_quantity)
+
+    async def set_item_quantity(self, user_id: str, product_id: str, quantity: int):
+        return await carts.set_item_quantity(self.collection, user_id, product_id, quantity)
+
+    async def remove_item(self, user_id: str, product_id: str):
+        return await carts.remove_item(self.collection, user_id, product_id)
+
+    async def flush(self, user_id: str = None):
+        pass
+
+    async def discard(self, user_id: str):
+        pass
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"store": "mongo"}
+
+
+class MemoryCartStore:
+    """Per-worker write-behind cart tier.
+
+    Carts are loaded from Mongo on first use and then served and mutated in
+    memory. Mutations only mark the cart dirty; a background task writes all
+    dirty carts in one unordered bulk every `flush_interval` seconds, or as
+    soon as `max_dirty` carts are waiting.
+    """
+
+    def __init__(self, collection, flush_interval: float = 2, max_entries: int = 50000, max_dirty: int = 1000,
+                 max_quantity: int = 100):
+        self.collection = collection
+        self.max_quantity = max_quantity
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.max_dirty = max_dirty
+        self.mutations = 0
+        self.flushes = 0
+        self.flushed_carts = 0
+        self._carts = OrderedDict()  # user_id -> cart, or None if the user has none
+        self._dirty = set()
+        self._loading = {}  # user_id -> task
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def _load(self, user_id: str):
+        if user_id in self._carts:
+            self._carts.move_to_end(user_id)
+            return self._carts[user_id]
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self.collection.find_one({"user_id": user_id}, CART_PROJECTION))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        cart = await task
+        # A concurrent caller may have loaded and already mutated it
+        if user_id not in self._carts:
+            self._carts[user_id] = cart
+            self._evict(keep=user_id)
+        return self._carts[user_id]
+
+    def _evict(self, keep: str = None):
+        excess = len(self._carts) - self.max_entries
+        if excess <= 0:
+            return
+        # Oldest clean entries go first; dirty carts stay until flushed, and
+        # the cart being loaded stays for the caller about to use it
+        victims = []
+        for user_id in self._carts:
+            if user_id not in self._dirty and user_id != keep:
+                victims.append(user_id)
+                if len(victims) >= excess:
+                    break
+        for user_id in victims:
+            del self._carts[user_id]
+
+    def _mark_dirty(self, user_id: str):
+        self.mutations += 1
+        self._dirty.add(user_id)
+        if len(self._dirty) >= self.max_dirty:
+            self._wakeup.set()
+
+    async def get(self, user_id: str):
+        return await self._load(user_id)
+
+    async def add_item(self, user_id: str, item: dict) -> dict:
+        cart = await self._load(user_id)
+        if cart is None:
+            cart = self._carts[user_id] = _new_cart(user_id)
+        _apply_add(cart, item, self.max_quantity)
+        self._mark_dirty(user_id)
+        return cart
+
+    async def set_item_quantity(self, user_id: str, product_id: str, quantity: int):
+        if quantity <= 0:
+            return await self.remove_item(user_id, product_id)
+        cart = await self._load(user_id)
+        if cart is None:
+            return None
+        _apply_set(cart, product_id, quantity)
+        self._mark_dirty(user_id)
+        return cart
+
+    async def remove_item(self, user_id: str, product_id: str):
+        cart = await self._load(user_id)
+        if cart is None:
+            return None
+        _apply_remove(cart, product_id)
+        self._mark_dirty(user_id)
+        return cart
+
+    async def flush(self, user_id: str = None):
+        async with self._flush_lock:
+            user_ids = [user_id] if user_id is not None else list(self._dirty)
+            user_ids = [u for u in user_ids if u in self._dirty]
+            if not user_ids:
+                return
+            self._dirty.difference_update(user_ids)
+            # Snapshot now: mutations made while the bulk is in flight mark the cart dirty again
+            snapshots = [copy.deepcopy(self._carts[u]) for u in user_ids]
+            try:
+                await self.collection.bulk_write([_flush_op(cart) for cart in snapshots], ordered=False)
+            except Exception:
+                self._dirty.update(u for u in user_ids if u in self._carts)
+                raise
+            self.flushes += 1
+            self.flushed_carts += len(snapshots)
+
+    async def discard(self, user_id: str):
+        # Waits out a flush that may be writing this cart, which could land
+        # after the order deleted it from Mongo
+        async with self._flush_lock:
+            await self.collection.delete_one({"user_id": user_id})
+            self._dirty.discard(user_id)
+            self._carts.pop(user_id, None)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Cart flush failed, will retry")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "store": "memory",
+            "entries": len(self._carts),
+            "dirty": len(self._dirty),
+            "mutations": self.mutations,
+            "flushes": self.flushes,
+            "flushed_carts": self.flushed_carts,
+        }
+
+
+class RedisCartStore:
+    """Write-behind cart tier shared by every worker through Redis.
+
+    Each cart is a JSON string under cart:<user_id> carrying a version that
+    increases with every mutation; dirty user ids sit in one set that any
+    worker's flusher drains. Mongo writes are conditional on the version, so
+    concurrent flushers can't regress a cart.
+    """
+
+    DIRTY_KEY = "carts:dirty"
+
+    def __init__(self, url: str, collection, flush_interval: float = 2, batch_size: int = 500,
+                 ttl_seconds: int = 7 * 24 * 3600, max_quantity: int = 100):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CART_STORE=redis needs the redis package (pip install redis)")
+        self._redis_errors = redis.WatchError
+        self.redis = redis.from_url(url)
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ttl_seconds = ttl_seconds
+        self.max_quantity = max_quantity
+        self.mutations = 0
+        self.flushes = 0
+        self.flushed_carts = 0
+        self._task = None
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"cart:{user_id}"
+
+    @staticmethod
+    def _decode(raw):
+        return json.loads(raw) if raw else None
+
+    async def _from_mongo(self, user_id: str):
+        cart = await self.collection.find_one({"user_id": user_id}, CART_PROJECTION)
+        if cart is not None:
+            cart = json.loads(json.dumps(cart, default=str))
+            cart['version'] = cart.pop('store_version', 0)
+        return cart
+
+    async def get(self, user_id: str):
+        cart = self._decode(await self.redis.get(self._key(user_id)))
+        if cart is None:
+            cart = await self._from_mongo(user_id)
+            if cart is not None:
+                await self.redis.set(self._key(user_id), json.dumps(cart), ex=self.ttl_seconds, nx=True)
+        return cart
+
+    async def _mutate(self, user_id: str, apply, create: bool = False):
+        key = self._key(user_id)
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    cart = self._decode(await pipe.get(key))
+                    if cart is None:
+                        cart = await self._from_mongo(user_id)
+                    if cart is None:
+                        if not create:
+                            await pipe.unwatch()
+                            return None
+                        cart = {**_new_cart(user_id), "version": 0}
+                    apply(cart)
+                    cart['version'] += 1
+                    pipe.multi()
+                    pipe.set(key, json.dumps(cart, default=str), ex=self.ttl_seconds)
+                    pipe.sadd(self.DIRTY_KEY, user_id)
+                    await pipe.execute()
+                    self.mutations += 1
+                    return cart
+                except self._redis_errors:
+                    # Another worker changed the cart between WATCH and EXEC
+                    continue
+
+    async def add_item(self, user_id: str, item: dict) -> dict:
+        return await self._mutate(user_id, lambda cart: _apply_add(cart, item, self.max_quantity), create=True)
+
+    async def set_item_quantity(self, user_id: str, product_id: str, quantity: int):
+        if quantity <= 0:
+            return await self.remove_item(user_id, product_id)
+        return await self._mutate(user_id, lambda cart: _apply_set(cart, product_id, quantity))
+
+    async def remove_item(self, user_id: str, product_id: str):
+        return await self._mutate(user_id, lambda cart: _apply_remove(cart, product_id))
+
+    async def _write(self, user_ids: list):
+        raw = await self.redis.mget([self._key(u) for u in user_ids])
+        snapshots = [cart for cart in map(self._decode, raw) if cart]
+        if not snapshots:
+            return
+        try:
+            await self.collection.bulk_write([_flush_op(c, c['version']) for c in snapshots], ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys are the upsert losing to a newer version already written
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                await self.redis.sadd(self.DIRTY_KEY, *user_ids)
+                raise
+        except Exception:
+            await self.redis.sadd(self.DIRTY_KEY, *user_ids)
+            raise
+        self.flushes += 1
+        self.flushed_carts += len(snapshots)
+
+    async def flush(self, user_id: str = None):
+        if user_id is not None:
+            # Written even if another worker's flusher already took it off the
+            # dirty set: that write may still be in flight, and the version
+            # check makes the duplicate harmless
+            await self.redis.srem(self.DIRTY_KEY, user_id)
+            await self._write([user_id])
+            return
+        while True:
+            user_ids = [u.decode() for u in await self.redis.spop(self.DIRTY_KEY, self.batch_size) or []]
+            if not user_ids:
+                return
+            await self._write(user_ids)
+
+    async def discard(self, user_id: str):
+        await self.redis.srem(self.DIRTY_KEY, user_id)
+        cart = self._decode(await self.redis.getdel(self._key(user_id)))
+        # Another worker's flusher may have read the cart before this and write
+        # it back after the order deleted it. An empty cart left at the
+        # discarded version makes that write lose the version check.
+        tombstone = {
+            "$set": {"items": [], "updated_at": utcnow()},
+            "$max": {"store_version": cart['version'] if cart else 0},
+            "$setOnInsert": {"id": str(uuid.uuid4())},
+        }
+        try:
+            await self.collection.update_one({"user_id": user_id}, tombstone, upsert=True)
+        except DuplicateKeyError:
+            # Lost the insert to that flush; the cart exists now
+            await self.collection.update_one({"user_id": user_id}, tombstone)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Cart flush failed, will retry")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        await self.redis.close()
+
+    def stats(self) -> dict:
+        return {
+            "store": "redis",
+            "mutations": self.mutations,
+            "flushes": self.flushes,
+            "flushed_carts": self.flushed_carts,
+        }
+
+
+def create_cart_store(kind: str, collection, flush_interval: float = 2, redis_url: str = None,
+                      max_quantity: int = 100):
+    if kind == "memory":
+        return MemoryCartStore(collection, flush_interval=flush_interval, max_quantity=max_quantity)
+    if kind == "redis":
+        return RedisCartStore(redis_url or "redis://localhost:6379/0", collection, flush_interval=flush_interval,
+                              max_quantity=max_quantity)
+    return MongoCartStore(collection, max_quantity=max_quantity)
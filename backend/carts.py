@@ -0,0 +1,75 @@
+import uuid
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from timestamps import utcnow
+
+# Every mutation is a single find_one_and_update against the cart document, so
+# concurrent tabs can't overwrite each other's changes and the caller gets the
+# updated cart back without a second read.
+
+CART_PROJECTION = {"_id": 0}
+
+
+def cart_summary(cart: dict) -> dict:
+    items = cart.get('items', []) if cart else []
+    total = sum(item['price'] * item['quantity'] for item in items)
+    return {"items": items, "total": total}
+
+
+async def add_item(carts, user_id: str, item: dict, max_quantity: int = 100, _retry: bool = True) -> dict:
+    # Ids are wrapped in $literal so one starting with "$" isn't read as a field path
+    product_id = {"$literal": item['product_id']}
+    # Update pipeline: bump the quantity if the product is already in the cart,
+    # append the line otherwise, and create the cart if it doesn't exist yet.
+    # Merged lines are capped at max_quantity, like a quantity set directly
+    existing = {"$ifNull": ["$items", []]}
+    pipeline = [{"$set": {
+        "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+        "user_id": {"$literal": user_id},
+        "items": {"$cond": [
+            {"$in": [product_id, {"$ifNull": ["$items.product_id", []]}]},
+            {"$map": {"input": existing, "in": {"$cond": [
+                {"$eq": ["$$this.product_id", product_id]},
+                {"$mergeObjects": ["$$this", {"quantity": {"$min": [
+                    {"$add": ["$$this.quantity", item['quantity']]}, max_quantity,
+                ]}}]},
+                "$$this",
+            ]}}},
+            {"$concatArrays": [existing, [{"$literal": item}]]},
+        ]},
+        "updated_at": utcnow(),
+    }}]
+    try:
+        return await carts.find_one_and_update(
+            {"user_id": user_id},
+            pipeline,
+            projection=CART_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Two first adds raced to create the cart; the loser now updates the winner's
+        if not _retry:
+            raise
+        return await add_item(carts, user_id, item, max_quantity, _retry=False)
+
+
+async def set_item_quantity(carts, user_id: str, product_id: str, quantity: int):
+    if quantity <= 0:
+        return await remove_item(carts, user_id, product_id)
+    return await carts.find_one_and_update(
+        {"user_id": user_id},
+        {"$set": {"items.$[line].quantity": quantity, "updated_at": utcnow()}},
+        array_filters=[{"line.product_id": product_id}],
+        projection=CART_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def remove_item(carts, user_id: str, product_id: str):
+    return await carts.find_one_and_update(
+        {"user_id": user_id},
+        {"$pull": {"items": {"product_id": product_id}}, "$set": {"updated_at": utcnow()}},
+        projection=CART_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
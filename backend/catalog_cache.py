@@ -0,0 +1,103 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+from fastapi import Request, Response
+from serialization import accepted_encoding, compress
+
+
+class CachedResponse:
+    """Encoded catalog response, kept with its compressed variants.
+
+    Each variant is compressed once, on the first request that accepts it,
+    and served as-is afterwards. Variants get their own strong ETag as
+    required for different representations of the same resource.
+    """
+
+    def __init__(self, body: bytes, headers: Optional[dict] = None, compress_min_size: int = 1024):
+        self.body = body
+        self.digest = hashlib.sha1(body).hexdigest()
+        self.etag = f'"{self.digest}"'
+        self.headers = headers or {}
+        self.compress_min_size = compress_min_size
+        self._variants = {}  # encoding -> compressed body
+
+    def not_modified(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Any representation's tag means the client has the current content
+        tags = (t.strip().removeprefix("W/").strip('"') for t in if_none_match.split(","))
+        return any(tag.split("-")[0] == self.digest for tag in tags)
+
+    def _variant(self, request: Request) -> tuple:
+        if len(self.body) < self.compress_min_size:
+            return None, self.body, self.etag
+        encoding = accepted_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is None:
+            return None, self.body, self.etag
+        body = self._variants.get(encoding)
+        if body is None:
+            body = self._variants[encoding] = compress(self.body, encoding)
+        return encoding, body, f'"{self.digest}-{encoding}"'
+
+    def to_response(self, request: Request, cache_control: str) -> Response:
+        encoding, body, etag = self._variant(request)
+        headers = {**self.headers, "ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+class CatalogCache:
+    """Bounded LRU + TTL cache for catalog reads.
+
+    Every product write bumps `version`; entries computed against an older
+    version are dropped instead of stored, so a read that raced a write never
+    repopulates the cache with stale data.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, version: int):
+        if version != self.version:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
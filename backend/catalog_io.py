@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+from fastapi import HTTPException
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import inventory
+from timestamps import utcnow
+
+# Streaming catalog import/export. Imports parse the request body line by line
+# and write in unordered batches, so memory stays bounded by the batch size
+# whatever the upload size; exports stream straight from a cursor. Stock is
+# the on-hand count both ways: imports subtract units reserved for unpaid
+# orders and exports add them back, so an export re-imports unchanged.
+#
+# A line (or CSV record) over MAX_LINE_BYTES, or one that isn't UTF-8, stops
+# the import with 413 or 400 naming the line. Every row before it is written,
+# and the error detail carries the report so far.
+
+EXPORT_FIELDS = ["id", "name", "description", "price", "category", "image", "stock", "created_at"]
+MAX_REPORTED_ERRORS = 100
+MAX_LINE_BYTES = 1024 * 1024
+
+
+def _line_too_long(line_number: int, max_line_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Line {line_number} is longer than {max_line_bytes} bytes")
+
+
+def _decode(line: bytes, line_number: int, max_line_bytes: int) -> str:
+    if len(line) > max_line_bytes:
+        raise _line_too_long(line_number, max_line_bytes)
+    try:
+        return line.decode("utf-8-sig").rstrip("\r")
+    except UnicodeDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Line {line_number} is not valid UTF-8 (byte {e.start + 1})")
+
+
+async def iter_lines(stream, max_line_bytes: int = MAX_LINE_BYTES):
+    buffer = b""
+    line_number = 0
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield _decode(line, line_number, max_line_bytes)
+        # Don't wait for a newline that may never come
+        if len(buffer) > max_line_bytes:
+            raise _line_too_long(line_number + 1, max_line_bytes)
+    if buffer:
+        yield _decode(buffer, line_number + 1, max_line_bytes)
+
+
+async def iter_ndjson_rows(stream):
+    row_number = 0
+    async for line in iter_lines(stream):
+        row_number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield row_number, None, "Expected a JSON object"
+            continue
+        yield row_number, row, None
+
+
+async def iter_csv_rows(stream, max_line_bytes: int = MAX_LINE_BYTES):
+    header = None
+    pending = ""
+    row_number = 0
+    line_number = record_start = 0
+    async for line in iter_lines(stream, max_line_bytes):
+        line_number += 1
+        if not pending:
+            record_start = line_number
+        # A quoted field may span lines; keep reading until the quotes balance
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            # An unbalanced quote would otherwise buffer the rest of the upload
+            if len(pending) > max_line_bytes:
+                raise _line_too_long(record_start, max_line_bytes)
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        row_number += 1
+        if len(values) != len(header):
+            yield row_number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # Empty cells mean "not provided" so model defaults and validation apply
+        yield row_number, {k: v for k, v in zip(header, values) if v != ""}, None
+
+
+def read_rows(stream, fmt: str):
+    return iter_csv_rows(stream) if fmt == "csv" else iter_ndjson_rows(stream)
+
+
+async def import_products(db, rows, model, batch_size: int = 500) -> dict:
+    report = {"processed": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def record_error(row_number, error):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": row_number, "error": error})
+
+    async def flush(ops, row_numbers):
+        try:
+            result = await db.products.bulk_write(ops, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                record_error(row_numbers[write_error['index']], write_error.get("errmsg"))
+        report["inserted"] += details.get("nUpserted", 0)
+        report["updated"] += details.get("nMatched", 0)
+
+    ops, row_numbers = [], []
+    now = utcnow()
+    try:
+        async for row_number, row, error in rows:
+            report["processed"] += 1
+            if error:
+                record_error(row_number, error)
+                continue
+            try:
+                product = model(**row)
+            except ValidationError as e:
+                record_error(row_number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+
+            fields = product.model_dump(exclude={"id"})
+            product_id = product.id or str(uuid.uuid4())
+            ops.append(UpdateOne(
+                {"id": product_id},
+                inventory.set_on_hand(fields) + [
+                    {"$set": {"id": {"$literal": product_id}, "created_at": {"$ifNull": ["$created_at", now]}}},
+                ],
+                upsert=True,
+            ))
+            row_numbers.append(row_number)
+            if len(ops) >= batch_size:
+                await flush(ops, row_numbers)
+                ops, row_numbers = [], []
+    except HTTPException as e:
+        if ops:
+            await flush(ops, row_numbers)
+        e.detail = {"message": e.detail, **report}
+        raise
+
+    if ops:
+        await flush(ops, row_numbers)
+    return report
+
+
+def _on_hand(product: dict) -> dict:
+    product['stock'] = inventory.on_hand(product)
+    product.pop('reservations', None)
+    return product
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_products(db, fmt: str):
+    cursor = db.products.find({}, {"_id": 0, "reservations": 1, **{f: 1 for f in EXPORT_FIELDS}}).sort("id", 1)
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        async for product in cursor:
+            product = _on_hand(product)
+            writer.writerow({k: _export_value(v) for k, v in product.items()})
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+    else:
+        chunk, size = [], 0
+        async for product in cursor:
+            product = _on_hand(product)
+            line = json.dumps({k: _export_value(v) for k, v in product.items()}, default=str) + "\n"
+            chunk.append(line)
+            size += len(line)
+            if size > 64 * 1024:
+                yield "".join(chunk).encode()
+                chunk, size = [], 0
+        yield "".join(chunk).encode()
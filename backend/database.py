@@ -0,0 +1,118 @@
+import os
+import time
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import Primary, Nearest, SecondaryPreferred
+
+# Connection settings and read routing. Writes, checkout and anything that
+# must read its own writes use `primary`; catalog and order-history reads use
+# `reads()`, which goes to secondaries when MONGO_READ_PREFERENCE allows it.
+# A catalog write pins reads to the primary for the staleness bound, so the
+# catalog cache is never refilled from a secondary that hasn't caught up.
+#
+# Clients are created with connect=False: no sockets or monitor threads exist
+# until the first operation, which runs inside the worker process. A client
+# built at import time is therefore safe to inherit across a fork.
+READ_PREFERENCES = {
+    "primary": Primary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+class DatabaseSettings:
+    def __init__(self, url: str, name: str, max_pool_size: int = 100, min_pool_size: int = 0,
+                 max_idle_time_ms: Optional[int] = None, wait_queue_timeout_ms: Optional[int] = None,
+                 server_selection_timeout_ms: int = 30000, compressors: str = "", read_preference: str = "primary",
+                 max_staleness_seconds: int = 90):
+        if read_preference not in READ_PREFERENCES:
+            raise ValueError(f"MONGO_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCES)}")
+        self.url = url
+        self.name = name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.server_selection_timeout_ms = server_selection_timeout_ms
+        self.compressors = compressors
+        self.read_preference = read_preference
+        # MongoDB requires at least 90 seconds
+        self.max_staleness_seconds = max_staleness_seconds
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> "DatabaseSettings":
+        def optional_int(name):
+            value = environ.get(name)
+            return int(value) if value else None
+
+        return cls(
+            url=environ['MONGO_URL'],
+            name=environ['DB_NAME'],
+            max_pool_size=int(environ.get('MONGO_MAX_POOL_SIZE', '100')),
+            min_pool_size=int(environ.get('MONGO_MIN_POOL_SIZE', '0')),
+            max_idle_time_ms=optional_int('MONGO_MAX_IDLE_TIME_MS'),
+            wait_queue_timeout_ms=optional_int('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+            server_selection_timeout_ms=int(environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000')),
+            compressors=environ.get('MONGO_COMPRESSORS', ''),
+            read_preference=environ.get('MONGO_READ_PREFERENCE', 'primary'),
+            max_staleness_seconds=int(environ.get('MONGO_MAX_STALENESS_SECONDS', '90')),
+        )
+
+    def client_options(self) -> dict:
+        options = {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+        }
+        if self.max_idle_time_ms is not None:
+            options["maxIdleTimeMS"] = self.max_idle_time_ms
+        if self.wait_queue_timeout_ms is not None:
+            # How long a request waits for a pooled connection before failing
+            options["waitQueueTimeoutMS"] = self.wait_queue_timeout_ms
+        if self.compressors:
+            options["compressors"] = self.compressors
+        return options
+
+    def read_preference_mode(self):
+        mode = READ_PREFERENCES[self.read_preference]
+        if mode is Primary:
+            return Primary()
+        return mode(max_staleness=self.max_staleness_seconds)
+
+
+class Database:
+    def __init__(self, client, settings: DatabaseSettings):
+        self.client = client
+        self.settings = settings
+        self.primary = client[settings.name]
+        self.secondary = client.get_database(settings.name, read_preference=settings.read_preference_mode())
+        self.routed = settings.read_preference != "primary"
+        self._primary_until = 0.0
+
+    @classmethod
+    def from_env(cls, **client_kwargs) -> "Database":
+        settings = DatabaseSettings.from_env()
+        # tz_aware: timestamps are stored as BSON dates and read back as aware UTC datetimes
+        client = AsyncIOMotorClient(settings.url, tz_aware=True, connect=False,
+                                    **settings.client_options(), **client_kwargs)
+        return cls(client, settings)
+
+    def reads(self):
+        """Database handle for reads that tolerate replication lag."""
+        if not self.routed or time.monotonic() < self._primary_until:
+            return self.primary
+        return self.secondary
+
+    def pin_primary(self, seconds: float = None):
+        """Sends reads() to the primary until secondaries have certainly caught up with a write."""
+        if self.routed:
+            self._primary_until = time.monotonic() + (seconds or self.settings.max_staleness_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "read_preference": self.settings.read_preference,
+            "max_staleness_seconds": self.settings.max_staleness_seconds,
+            "reads_pinned_to_primary": self.routed and time.monotonic() < self._primary_until,
+            "max_pool_size": self.settings.max_pool_size,
+            "min_pool_size": self.settings.min_pool_size,
+        }
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict, defaultdict, deque
+from fastapi import HTTPException
+
+# Server-sent event fan-out for order and payment status. Events are published
+# through the broadcast channel, so every worker delivers them to its own
+# subscribers and keeps the last few per channel for Last-Event-ID replay.
+# Event ids start with a zero-padded nanosecond timestamp, so they order the
+# same way on every worker.
+
+
+def new_event_id() -> str:
+    return f"{time.time_ns():020d}-{random.randrange(16 ** 4):04x}"
+
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+
+class EventHub:
+    """Per-worker SSE subscriptions with bounded replay and connection limits."""
+
+    def __init__(self, max_connections: int = 1000, heartbeat_seconds: float = 15, replay_size: int = 20,
+                 max_channels: int = 10000, queue_size: int = 100):
+        self.max_connections = max_connections
+        self.heartbeat_seconds = heartbeat_seconds
+        self.replay_size = replay_size
+        self.max_channels = max_channels
+        self.queue_size = queue_size
+        self.connections = 0
+        self.delivered = 0
+        self.rejected = 0
+        self._subscribers = defaultdict(set)  # channel -> queues
+        self._replay = OrderedDict()  # channel -> deque of recent events
+
+    def deliver(self, channel: str, event: dict):
+        buffer = self._replay.get(channel)
+        if buffer is None:
+            buffer = self._replay[channel] = deque(maxlen=self.replay_size)
+            while len(self._replay) > self.max_channels:
+                self._replay.popitem(last=False)
+        else:
+            self._replay.move_to_end(channel)
+        buffer.append(event)
+        for queue in self._subscribers.get(channel, ()):
+            try:
+                queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # A client this far behind is dropped; it reconnects and
+                # catches up through replay
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def replay(self, channel: str, last_event_id: str) -> list:
+        return [e for e in self._replay.get(channel, ()) if e['id'] > last_event_id]
+
+    async def admit(self, stream):
+        """Starts `stream` before the response does; raises 503 once this worker is at its connection limit.
+
+        Returns an iterator over the whole stream, first frame included.
+        """
+        first = await anext(stream)
+        return _Admitted(first, stream)
+
+    def open(self, channel: str) -> asyncio.Queue:
+        # Checked and counted in one step: concurrent requests can't all pass
+        # the check before any of them holds a slot
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many event streams, poll instead",
+                                headers={"Retry-After": "5"})
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers[channel].add(queue)
+        self.connections += 1
+        return queue
+
+    def close(self, channel: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[channel]
+        self.connections -= 1
+
+    async def stream(self, channel: str, initial: list, last_event_id: str = None,
+                     done=None, refresh=None, refresh_seconds: float = 0):
+        """Yields SSE frames: `initial` events, replay after `last_event_id`, then live events.
+
+        The subscription is opened on the first iteration, which raises 503 at
+        the connection limit (see admit), and closed when the generator
+        finishes, so a stream that is never started holds no slot. Lines
+        starting with ":" are heartbeats that keep proxies from closing an
+        idle stream. `refresh` is awaited every `refresh_seconds` while the
+        stream is open; it is expected to publish any change it finds. The
+        stream ends after an event for which `done(event)` is true.
+        """
+        queue = None
+        try:
+            queue = self.open(channel)
+            yield "retry: 3000\n\n"
+            pending = list(initial)
+            if last_event_id:
+                pending += self.replay(channel, last_event_id)
+            for event in pending:
+                yield format_event(event)
+                if done and done(event):
+                    return
+
+            next_refresh = time.monotonic() + refresh_seconds
+            while True:
+                timeout = self.heartbeat_seconds
+                if refresh:
+                    timeout = max(min(timeout, next_refresh - time.monotonic()), 0)
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    if refresh and time.monotonic() >= next_refresh:
+                        next_refresh = time.monotonic() + refresh_seconds
+                        await refresh()
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    # Dropped as a slow consumer
+                    return
+                yield format_event(event)
+                if done and done(event):
+                    return
+        finally:
+            if queue is not None:
+                self.close(channel, queue)
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "max_connections": self.max_connections,
+            "channels": len(self._subscribers),
+            "delivered": self.delivered,
+            "rejected": self.rejected,
+        }
+
+
+class _Admitted:
+    """An admitted stream with its first frame put back; closing it closes the stream."""
+
+    def __init__(self, first: str, stream):
+        self._first = first
+        self._stream = stream
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        if self._first is not None:
+            first, self._first = self._first, None
+            return first
+        return await anext(self._stream)
+
+    async def aclose(self):
+        await self._stream.aclose()
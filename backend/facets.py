@@ -0,0 +1,54 @@
+from typing import Optional
+
+# Facet counts for the product listing, computed by one $facet aggregation.
+# Category counts ignore the selected category so every category stays
+# selectable; the price histogram and stock counts honour it.
+PRICE_BOUNDARIES = [0, 25, 50, 100, 250, 500, 1000]
+
+
+def facet_pipeline(base_match: dict, category: Optional[str], boundaries: list = PRICE_BOUNDARIES) -> list:
+    in_category = [{"$match": {"category": category}}] if category else []
+    pipeline = [{"$match": base_match}] if base_match else []
+    pipeline.append({"$facet": {
+        "categories": [
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ],
+        "price": in_category + [
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": boundaries,
+                "default": "over",
+                "output": {"count": {"$sum": 1}},
+            }},
+        ],
+        "stock": in_category + [
+            {"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "in_stock": {"$sum": {"$cond": [{"$gt": ["$stock", 0]}, 1, 0]}},
+            }},
+        ],
+    }})
+    return pipeline
+
+
+def format_facets(result: dict, boundaries: list = PRICE_BOUNDARIES) -> dict:
+    counts = {bucket['_id']: bucket['count'] for bucket in result.get('price', [])}
+    price = [
+        {"min": low, "max": high, "count": counts.get(low, 0)}
+        for low, high in zip(boundaries, boundaries[1:])
+    ]
+    price.append({"min": boundaries[-1], "max": None, "count": counts.get("over", 0)})
+    stock = (result.get('stock') or [{}])[0]
+    return {
+        "categories": [{"category": c['_id'], "count": c['count']} for c in result.get('categories', []) if c['_id']],
+        "price": price,
+        "total": stock.get('total', 0),
+        "in_stock": stock.get('in_stock', 0),
+    }
+
+
+async def compute_facets(collection, base_match: dict, category: Optional[str]) -> dict:
+    results = await collection.aggregate(facet_pipeline(base_match, category)).to_list(1)
+    return format_facets(results[0] if results else {})
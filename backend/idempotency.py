@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from timestamps import utcnow
+
+# Idempotency-Key support for endpoints with side effects. The first request
+# for a key claims it with an insert into a unique collection, runs the
+# handler and stores the result; repeats within the TTL get the stored result
+# back without running the handler. A repeat that arrives while the first is
+# still running waits for it: on the same worker through a shared future, on
+# another worker by polling the claim. A claim whose worker died is taken over
+# once its lease lapses. Failed attempts release the claim, so a retry runs
+# the handler again.
+COLLECTION = "idempotency_keys"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(params: dict) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, db, ttl_seconds: float = 24 * 3600, max_entries: int = 10000, lease_seconds: float = 60,
+                 wait_seconds: float = 30):
+        self.collection = db[COLLECTION]
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.wait_seconds = wait_seconds
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+        self._entries = OrderedDict()  # record id -> (expires_at, fingerprint, result)
+        self._in_flight = {}  # record id -> future for the local first execution
+
+    @staticmethod
+    def record_id(scope: str, key: str) -> str:
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+        return f"{scope}:{key}"
+
+    async def run(self, scope: str, key: str, params: dict, handler) -> tuple:
+        """Returns (result, replayed). `scope` namespaces the key, e.g. per user and endpoint."""
+        record_id = self.record_id(scope, key)
+        digest = fingerprint(params)
+
+        cached = self._cached(record_id)
+        if cached is not None:
+            return self._replay(cached, digest), True
+
+        in_flight = self._in_flight.get(record_id)
+        if in_flight is not None:
+            self.waited += 1
+            await asyncio.shield(in_flight)
+            return await self.run(scope, key, params, handler)
+
+        future = self._in_flight[record_id] = asyncio.get_running_loop().create_future()
+        try:
+            return await self._claim_and_run(record_id, digest, handler)
+        finally:
+            del self._in_flight[record_id]
+            future.set_result(None)
+
+    async def _claim_and_run(self, record_id: str, digest: str, handler) -> tuple:
+        deadline = time.monotonic() + self.wait_seconds
+        delay = 0.05
+        while True:
+            record = await self._claim(record_id, digest)
+            if record is None:
+                break
+            if record['status'] == COMPLETED:
+                self._remember(record_id, record)
+                return self._replay((record['fingerprint'], record['result']), digest), True
+            if record['fingerprint'] != digest:
+                raise self._mismatch()
+            # Another worker is running it; wait for its result
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                                    headers={"Retry-After": "1"})
+            self.waited += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1)
+
+        try:
+            result = await handler()
+        except BaseException:
+            await self.collection.delete_one({"_id": record_id, "status": IN_PROGRESS})
+            raise
+        self.executed += 1
+        now = utcnow()
+        record = {"status": COMPLETED, "fingerprint": digest, "result": result,
+                  "expires_at": now + timedelta(seconds=self.ttl_seconds)}
+        await self.collection.update_one({"_id": record_id}, {"$set": record})
+        self._remember(record_id, record)
+        return result, False
+
+    async def _claim(self, record_id: str, digest: str):
+        """Claims the key; returns None when claimed, else the record holding it."""
+        now = utcnow()
+        claim = {"status": IN_PROGRESS, "fingerprint": digest, "created_at": now,
+                 "lease_until": now + timedelta(seconds=self.lease_seconds),
+                 "expires_at": now + timedelta(seconds=self.ttl_seconds)}
+        try:
+            await self.collection.insert_one({"_id": record_id, **claim})
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over a claim whose lease lapsed, i.e. its worker died mid-request
+        taken = await self.collection.find_one_and_update(
+            {"_id": record_id, "status": IN_PROGRESS, "lease_until": {"$lt": now}},
+            {"$set": claim},
+            return_document=ReturnDocument.AFTER,
+        )
+        if taken is not None:
+            return None
+        record = await self.collection.find_one({"_id": record_id})
+        if record is None:
+            # Released or expired in between
+            return await self._claim(record_id, digest)
+        return record
+
+    def _cached(self, record_id: str):
+        entry = self._entries.get(record_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[record_id]
+            return None
+        self._entries.move_to_end(record_id)
+        return entry[1:]
+
+    def _remember(self, record_id: str, record: dict):
+        ttl = (record['expires_at'] - utcnow()).total_seconds()
+        self._entries[record_id] = (time.monotonic() + ttl, record['fingerprint'], record['result'])
+        self._entries.move_to_end(record_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _replay(self, cached: tuple, digest: str):
+        stored_digest, result = cached
+        if stored_digest != digest:
+            raise self._mismatch()
+        self.replayed += 1
+        return result
+
+    @staticmethod
+    def _mismatch() -> HTTPException:
+        return HTTPException(status_code=422, detail="Idempotency-Key was already used with different parameters")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "waited": self.waited,
+        }
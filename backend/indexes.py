@@ -0,0 +1,138 @@
+import logging
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Index registry: every collection the API queries by a key lists the indexes
+# that back those lookups. startup_db applies them with create_indexes, which is
+# a no-op for indexes that already exist with the same spec. TTL indexes whose
+# lifetime is configurable are managed by lifecycle.py instead.
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("auth_epoch_changed_at", ASCENDING)], name="auth_epoch_changed_at", sparse=True),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("category", ASCENDING)], name="category"),
+        # Keyset pagination: sort key plus id as the tiebreaker
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("price", ASCENDING), ("id", ASCENDING)], name="price_id"),
+        IndexModel([("category", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="category_created_at_id"),
+        IndexModel([("category", ASCENDING), ("price", ASCENDING), ("id", ASCENDING)], name="category_price_id"),
+        # Fallback for /api/products?search= while the in-memory search index is loading
+        IndexModel(
+            [("name", TEXT), ("description", TEXT), ("category", TEXT)],
+            name="product_text",
+            weights={"name": 3, "category": 2, "description": 1},
+        ),
+    ],
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_id_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        # Lifecycle sweeper: finished orders past the retention window
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+    "orders_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Order history pages through the archive with the same keyset as orders
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_id_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "stock_reservations": [
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+    ],
+    "webhook_events": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+        # Processed events are kept a week so Stripe redeliveries are still recognised
+        IndexModel([("done_at", ASCENDING)], name="done_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "idempotency_keys": [
+        # Each record carries its own expiry
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "co_purchases": [
+        # Top-K neighbours of a product, in rank order
+        IndexModel([("product_id", ASCENDING), ("count", DESCENDING), ("other_id", ASCENDING)], name="product_id_count"),
+    ],
+    "stats_rollups": [
+        IndexModel([("kind", ASCENDING), ("day", ASCENDING)], name="kind_day"),
+        # Per-order markers expire once no rebuild can still replay them
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("payment_status", ASCENDING), ("created_at", ASCENDING)], name="payment_status_created_at"),
+    ],
+}
+
+# Query shapes the API issues on hot paths: (collection, filter, sort).
+# verify_indexes explains each one and warns when the winning plan still scans
+# the whole collection.
+QUERY_SHAPES = [
+    ("users", {"id": ""}, None),
+    ("users", {"email": ""}, None),
+    ("products", {"id": ""}, None),
+    ("products", {"category": ""}, None),
+    ("products", {}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("products", {}, [("price", DESCENDING), ("id", DESCENDING)]),
+    ("products", {"category": ""}, [("price", ASCENDING), ("id", ASCENDING)]),
+    ("carts", {"user_id": ""}, None),
+    ("orders", {"id": ""}, None),
+    ("orders", {"user_id": ""}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders_archive", {"user_id": ""}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders_archive", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("payment_transactions", {"session_id": ""}, None),
+]
+
+
+async def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # Usually duplicate data blocking a unique index or an index with the
+            # same name but different options; keep serving and surface it.
+            logger.error(f"Failed to create indexes on {collection}: {e}")
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def verify_indexes(db):
+    collscans = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = await cursor.explain()
+        except OperationFailure as e:
+            logger.warning(f"Could not explain {collection} {query}: {e}")
+            continue
+
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        # Slot-based engine wraps the classic plan under queryPlan
+        winning_plan = winning_plan.get("queryPlan", winning_plan)
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            collscans.append((collection, query, sort))
+            logger.warning(f"Query on {collection} {list(query)} sort={sort} uses COLLSCAN")
+
+    if not collscans:
+        logger.info(f"Index self-check passed for {len(QUERY_SHAPES)} query shapes")
+    return collscans
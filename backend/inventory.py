@@ -0,0 +1,141 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Stock is reserved with one unordered bulk of conditional $inc updates. Each
+# update also records the quantity under products.reservations.<order_id>, so
+# releasing or committing a reservation is an idempotent bulk keyed on that
+# marker, and a partially failed bulk can be undone exactly. The ledger in
+# stock_reservations is written first so the expiry sweeper can find
+# reservations whose order was never created or never paid. Stock written by
+# admins is an on-hand count and goes through set_on_hand(), so it never
+# overwrites units that are still reserved.
+RESERVATIONS = "stock_reservations"
+HELD = "held"
+RELEASING = "releasing"
+COMMITTING = "committing"
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids: list):
+        super().__init__(f"Insufficient stock for {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+def _merge_lines(items: list) -> OrderedDict:
+    lines = OrderedDict()
+    for item in items:
+        # A non-positive quantity would pass the stock filter and raise stock
+        if not isinstance(item['quantity'], int) or item['quantity'] <= 0:
+            raise ValueError(f"Invalid quantity {item['quantity']!r} for {item['product_id']}")
+        lines[item['product_id']] = lines.get(item['product_id'], 0) + item['quantity']
+    return lines
+
+
+async def reserve(db, order_id: str, items: list, ttl: timedelta):
+    lines = _merge_lines(items)
+    now = datetime.now(timezone.utc)
+    await db[RESERVATIONS].insert_one({
+        "_id": order_id,
+        "lines": [{"product_id": pid, "quantity": qty} for pid, qty in lines.items()],
+        "status": HELD,
+        "created_at": now,
+        "expires_at": now + ttl,
+    })
+
+    marker = f"reservations.{order_id}"
+    result = await db.products.bulk_write([
+        UpdateOne(
+            {"id": pid, "stock": {"$gte": qty}, marker: {"$exists": False}},
+            {"$inc": {"stock": -qty}, "$set": {marker: qty}},
+        )
+        for pid, qty in lines.items()
+    ], ordered=False)
+
+    if result.modified_count < len(lines):
+        cursor = db.products.find({"id": {"$in": list(lines)}, marker: {"$exists": True}}, {"_id": 0, "id": 1})
+        reserved = {p['id'] async for p in cursor}
+        await release(db, order_id)
+        raise InsufficientStock([pid for pid in lines if pid not in reserved])
+
+
+def reserved_units():
+    """Aggregation expression for the units of a product held by outstanding reservations."""
+    return {"$sum": {"$map": {"input": {"$objectToArray": {"$ifNull": ["$reservations", {}]}}, "in": "$$this.v"}}}
+
+
+def set_on_hand(fields: dict) -> list:
+    """Update pipeline writing `fields` with `stock` taken as the on-hand count.
+
+    Stored stock is what is left to sell, so the units held for unpaid
+    orders are subtracted in the same atomic update; releasing them later
+    adds them back. Values are wrapped in $literal so strings starting with
+    "$" aren't read as field paths.
+    """
+    values = {field: {"$literal": value} for field, value in fields.items()}
+    if "stock" in fields:
+        values["stock"] = {"$subtract": [{"$literal": fields["stock"]}, reserved_units()]}
+    return [{"$set": values}]
+
+
+def on_hand(product: dict) -> int:
+    """Stock plus the units reserved for unpaid orders, from a product with its reservations."""
+    return product.get('stock', 0) + sum((product.get('reservations') or {}).values())
+
+
+async def extend(db, order_id: str, expires_at: datetime) -> bool:
+    """Keeps a held reservation until at least `expires_at`; False once it was released or committed."""
+    result = await db[RESERVATIONS].update_one({"_id": order_id, "status": HELD}, {"$max": {"expires_at": expires_at}})
+    return result.matched_count == 1
+
+
+async def _claim(db, order_id: str, status: str):
+    # A reservation is either released or committed, never a mix of both; a
+    # claim in progress can be resumed after a crash
+    return await db[RESERVATIONS].find_one_and_update(
+        {"_id": order_id, "status": {"$in": [HELD, status]}},
+        {"$set": {"status": status}},
+    )
+
+
+async def release(db, order_id: str) -> bool:
+    """Returns reserved stock to the products, e.g. when payment never completes."""
+    ledger = await _claim(db, order_id, RELEASING)
+    if ledger is None:
+        return False
+    marker = f"reservations.{order_id}"
+    if ledger['lines']:
+        await db.products.bulk_write([
+            UpdateOne(
+                {"id": line['product_id'], marker: {"$exists": True}},
+                {"$inc": {"stock": line['quantity']}, "$unset": {marker: ""}},
+            )
+            for line in ledger['lines']
+        ], ordered=False)
+    await db[RESERVATIONS].delete_one({"_id": order_id})
+    return True
+
+
+async def commit(db, order_id: str) -> bool:
+    """Makes a reservation permanent once the order is paid or processed."""
+    ledger = await _claim(db, order_id, COMMITTING)
+    if ledger is None:
+        return False
+    product_ids = [line['product_id'] for line in ledger['lines']]
+    await db.products.update_many(
+        {"id": {"$in": product_ids}},
+        {"$unset": {f"reservations.{order_id}": ""}},
+    )
+    await db[RESERVATIONS].delete_one({"_id": order_id})
+    return True
+
+
+async def expired(db, limit: int = 100) -> list:
+    cursor = db[RESERVATIONS].find(
+        {"status": {"$in": [HELD, RELEASING, COMMITTING]}, "expires_at": {"$lt": datetime.now(timezone.utc)}},
+        {"status": 1},
+    ).limit(limit)
+    return [(ledger['_id'], ledger['status']) async for ledger in cursor]
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import OperationFailure
+import metrics
+from timestamps import range_filter, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Data lifecycle for collections that otherwise grow forever:
+#   carts                 TTL index on updated_at removes abandoned carts; the
+#                         sweeper deletes legacy carts whose updated_at is
+#                         still an ISO string, which TTL monitors skip
+#   payment_transactions  pending sessions older than Stripe's checkout
+#                         lifetime are marked expired
+#   orders                delivered/cancelled orders past the retention window
+#                         move to orders_archive
+# Every step is conditional and idempotent, so running the sweeper on several
+# workers at once only duplicates work, never data.
+ORDERS_ARCHIVE = "orders_archive"
+ARCHIVABLE_STATUSES = ("delivered", "cancelled")
+CART_TTL_INDEX = "updated_at_ttl"
+ID_ONLY = {"_id": 1}
+
+
+async def ensure_ttl_index(collection, field: str, seconds: int, name: str):
+    """Creates, retunes (collMod) or drops a TTL index so it matches `seconds`; 0 removes it."""
+    existing = (await collection.index_information()).get(name)
+    if not seconds:
+        if existing:
+            await collection.drop_index(name)
+        return
+    if existing is None:
+        await collection.create_index([(field, ASCENDING)], name=name, expireAfterSeconds=seconds)
+    elif existing.get("expireAfterSeconds") != seconds:
+        await collection.database.command(
+            "collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds},
+        )
+
+
+class LifecycleSweeper:
+    def __init__(self, db, cart_ttl_seconds: int = 30 * 24 * 3600, transaction_ttl_seconds: int = 24 * 3600,
+                 archive_after_days: int = 180, interval_seconds: float = 600, batch_size: int = 500,
+                 pause_seconds: float = 0.1):
+        self.db = db
+        self.cart_ttl_seconds = cart_ttl_seconds
+        self.transaction_ttl_seconds = transaction_ttl_seconds
+        self.archive_after_days = archive_after_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.runs = 0
+        self.last_run = None
+        self.reclaimed = {"carts": 0, "payment_transactions": 0, "orders": 0}
+        self._task = None
+
+    async def ensure_indexes(self):
+        try:
+            await ensure_ttl_index(self.db.carts, "updated_at", self.cart_ttl_seconds, CART_TTL_INDEX)
+        except OperationFailure as e:
+            logger.error(f"Failed to apply the cart TTL index: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        await self.ensure_indexes()
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lifecycle sweep failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> dict:
+        started = time.monotonic()
+        now = utcnow()
+        result = {"carts": 0, "payment_transactions": 0, "orders": 0}
+        if self.cart_ttl_seconds:
+            result["carts"] = await self.expire_legacy_carts(now - timedelta(seconds=self.cart_ttl_seconds))
+        if self.transaction_ttl_seconds:
+            result["payment_transactions"] = await self.expire_transactions(
+                now - timedelta(seconds=self.transaction_ttl_seconds))
+        if self.archive_after_days:
+            result["orders"] = await self.archive_orders(now - timedelta(days=self.archive_after_days))
+
+        elapsed = time.monotonic() - started
+        metrics.LIFECYCLE_DURATION.observe(elapsed)
+        metrics.LIFECYCLE_LAST_RUN.set(time.time())
+        self.runs += 1
+        self.last_run = now
+        for collection, count in result.items():
+            self.reclaimed[collection] += count
+        if any(result.values()):
+            logger.info(f"Lifecycle sweep in {elapsed:.1f}s: {result}")
+        return result
+
+    async def _batches(self, collection, query: dict, projection: dict = ID_ONLY):
+        # Re-queries after each batch; processed documents no longer match
+        while True:
+            batch = await collection.find(query, projection).limit(self.batch_size) \
+                .to_list(self.batch_size)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < self.batch_size:
+                return
+            if self.pause_seconds:
+                await asyncio.sleep(self.pause_seconds)
+
+    async def expire_legacy_carts(self, cutoff) -> int:
+        query = {"updated_at": {"$type": "string", "$lt": cutoff.isoformat()}}
+        deleted = 0
+        async for batch in self._batches(self.db.carts, query):
+            result = await self.db.carts.delete_many({"_id": {"$in": [c['_id'] for c in batch]}, **query})
+            deleted += result.deleted_count
+        metrics.LIFECYCLE_RECLAIMED.inc(deleted, collection="carts", action="deleted")
+        return deleted
+
+    async def expire_transactions(self, cutoff) -> int:
+        query = {"payment_status": "pending", **range_filter("created_at", end=cutoff)}
+        expired = 0
+        async for batch in self._batches(self.db.payment_transactions, query):
+            result = await self.db.payment_transactions.update_many(
+                {"_id": {"$in": [t['_id'] for t in batch]}, "payment_status": "pending"},
+                {"$set": {"payment_status": "expired", "expired_at": utcnow()}},
+            )
+            expired += result.modified_count
+        metrics.LIFECYCLE_RECLAIMED.inc(expired, collection="payment_transactions", action="expired")
+        return expired
+
+    async def archive_orders(self, cutoff) -> int:
+        query = {"status": {"$in": list(ARCHIVABLE_STATUSES)}, **range_filter("created_at", end=cutoff)}
+        archived = 0
+        async for batch in self._batches(self.db.orders, query, projection=None):
+            # Copy first, keyed by _id so a retried batch overwrites rather
+            # than duplicates, then delete only what is still archivable
+            archived_at = utcnow()
+            await self.db[ORDERS_ARCHIVE].bulk_write(
+                [ReplaceOne({"_id": o['_id']}, {**o, "archived_at": archived_at}, upsert=True) for o in batch],
+                ordered=False,
+            )
+            result = await self.db.orders.delete_many({
+                "_id": {"$in": [o['_id'] for o in batch]},
+                "status": {"$in": list(ARCHIVABLE_STATUSES)},
+            })
+            archived += result.deleted_count
+        metrics.LIFECYCLE_RECLAIMED.inc(archived, collection="orders", action="archived")
+        return archived
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "reclaimed": dict(self.reclaimed),
+            "cart_ttl_seconds": self.cart_ttl_seconds,
+            "transaction_ttl_seconds": self.transaction_ttl_seconds,
+            "archive_after_days": self.archive_after_days,
+        }
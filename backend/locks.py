@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pymongo.errors import DuplicateKeyError
+from timestamps import utcnow
+
+logger = logging.getLogger(__name__)
+
+# Leases for jobs that must run on one worker at a time, e.g. rebuilding
+# derived collections. A lease is one document per job name: taking it is an
+# upsert that only matches when the lease is ours or has lapsed, so a second
+# taker's upsert fails on the _id instead. The holder renews the lease while
+# it works; a worker that dies stops renewing and its lease lapses.
+COLLECTION = "job_locks"
+
+
+async def acquire(db, name: str, owner: str, lease_seconds: float) -> bool:
+    now = utcnow()
+    try:
+        await db[COLLECTION].update_one(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=lease_seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def release(db, name: str, owner: str):
+    await db[COLLECTION].delete_one({"_id": name, "owner": owner})
+
+
+@asynccontextmanager
+async def lease(db, name: str, lease_seconds: float = 60):
+    """Yields True while holding the lease for `name`, or False if another worker holds it."""
+    owner = str(uuid.uuid4())
+    if not await acquire(db, name, owner, lease_seconds):
+        yield False
+        return
+
+    async def renew():
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            if not await acquire(db, name, owner, lease_seconds):
+                logger.error(f"Lost the {name} lease to another worker")
+                return
+
+    renewer = asyncio.create_task(renew())
+    try:
+        yield True
+    finally:
+        renewer.cancel()
+        await asyncio.gather(renewer, return_exceptions=True)
+        await release(db, name, owner)
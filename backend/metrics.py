@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# A small Prometheus registry: counters, gauges and histograms with labels,
+# rendered in the text exposition format at /metrics. Time spent in Mongo,
+# bcrypt and Stripe is also added to a per-request breakdown carried in a
+# context variable, which the slow request log prints.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_breakdown: ContextVar = ContextVar("request_breakdown", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        # Mongo command events arrive on Motor's executor threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in sorted(items):
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {bucket_count}")
+            le = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",)))
+MONGO_DURATION = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection")))
+MONGO_FAILURES = REGISTRY.register(Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("command", "collection")))
+STRIPE_DURATION = REGISTRY.register(Histogram(
+    "stripe_call_duration_seconds", "Stripe API call latency, per attempt", ("call", "outcome")))
+BCRYPT_DURATION = REGISTRY.register(Histogram(
+    "bcrypt_duration_seconds", "bcrypt hash/verify latency including queueing", ("operation",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)))
+LOOP_LAG = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)))
+LOOP_LAG_LAST = REGISTRY.register(Gauge(
+    "event_loop_lag_last_seconds", "Most recent event loop lag sample"))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by the rate limiter", ("route_class",)))
+SHED_REQUESTS = REGISTRY.register(Counter(
+    "shed_requests_total", "Requests rejected with 503 under overload", ("route_class", "reason")))
+LIFECYCLE_RECLAIMED = REGISTRY.register(Counter(
+    "lifecycle_reclaimed_total", "Documents expired, deleted or archived by the lifecycle sweeper",
+    ("collection", "action")))
+LIFECYCLE_DURATION = REGISTRY.register(Histogram(
+    "lifecycle_sweep_duration_seconds", "Lifecycle sweep duration", buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300)))
+LIFECYCLE_LAST_RUN = REGISTRY.register(Gauge(
+    "lifecycle_last_run_timestamp_seconds", "Unix time the last lifecycle sweep finished"))
+
+
+def add_time(component: str, seconds: float):
+    """Adds time spent in a dependency to the current request's breakdown."""
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown[component] = breakdown.get(component, 0.0) + seconds
+
+
+class Timer:
+    """Times a block into a histogram and the request breakdown.
+
+        with Timer(BCRYPT_DURATION, "bcrypt", operation="hash"):
+            ...
+    """
+
+    def __init__(self, histogram: Histogram, component: str, **labels):
+        self.histogram = histogram
+        self.component = component
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, **self.labels)
+        add_time(self.component, elapsed)
+        return False
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Per-command and per-collection timings from pymongo command monitoring."""
+
+    def __init__(self):
+        self._started = {}  # (connection_id, request_id) -> (command, collection)
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # getMore names the collection separately; admin commands have none
+        value = event.command.get(event.command_name)
+        collection = event.command.get("collection") if event.command_name == "getMore" else value
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (event.command_name, collection)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            command, collection = self._started.pop((event.connection_id, event.request_id), (event.command_name, ""))
+        seconds = event.duration_micros / 1e6
+        MONGO_DURATION.observe(seconds, command=command, collection=collection)
+        if failed:
+            MONGO_FAILURES.inc(command=command, collection=collection)
+        # Motor runs commands on executor threads with a copy of the caller's
+        # context, so this lands in the breakdown of the request that issued it
+        add_time("mongo", seconds)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request by its route template.
+
+    Requests slower than `slow_request_seconds` are logged with the time
+    spent in Mongo, bcrypt and Stripe; 0 disables the log.
+    """
+
+    def __init__(self, app, slow_request_seconds: float = 0):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        breakdown = {}
+        token = _breakdown.set(breakdown)
+        HTTP_IN_FLIGHT.inc(method=method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec(method=method)
+            _breakdown.reset(token)
+            # FastAPI stores the matched route in the scope; unmatched paths
+            # share one label so scanners can't blow up the label set
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=method, route=route, status=status["code"])
+            HTTP_DURATION.observe(elapsed, method=method, route=route)
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                parts = ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in sorted(breakdown.items()))
+                other = elapsed - sum(breakdown.values())
+                logger.warning(
+                    f"Slow request {method} {route} {status['code']} took {elapsed * 1000:.1f}ms "
+                    f"({parts + ', ' if parts else ''}other={max(other, 0) * 1000:.1f}ms)"
+                )
+
+
+async def sample_loop_lag(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - scheduled, 0.0)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from pymongo import UpdateOne
+from timestamps import TIMESTAMP_FIELDS, parse, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Converts ISO-string timestamps to BSON dates in place, one collection at a
+# time in _id order. Progress is checkpointed in the migrations collection
+# after every batch, so an interrupted run resumes where it stopped. Each
+# update is conditional on the string it read, so a document rewritten by the
+# app in the meantime is left alone.
+MIGRATIONS = "migrations"
+
+
+def _migration_id(collection: str) -> str:
+    return f"timestamps:{collection}"
+
+
+async def migrate_collection(db, collection: str, fields: tuple, batch_size: int = 500,
+                             max_docs_per_second: float = 0):
+    progress = await db[MIGRATIONS].find_one({"_id": _migration_id(collection)}) or {}
+    if progress.get("done"):
+        logger.info(f"{collection}: already migrated")
+        return
+    last_id = progress.get("last_id")
+    scanned = progress.get("scanned", 0)
+    converted = progress.get("converted", 0)
+    pending = {"$or": [{field: {"$type": "string"}} for field in fields]}
+
+    while True:
+        started = time.monotonic()
+        query = {"$and": [{"_id": {"$gt": last_id}}, pending]} if last_id is not None else pending
+        batch = await db[collection].find(query, {field: 1 for field in fields}).sort("_id", 1) \
+            .limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        ops = []
+        for doc in batch:
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    ops.append(UpdateOne({"_id": doc['_id'], field: value}, {"$set": {field: parse(value)}}))
+                except ValueError:
+                    logger.warning(f"{collection} {doc['_id']}: unparseable {field} {value!r}, left as is")
+        if ops:
+            result = await db[collection].bulk_write(ops, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]['_id']
+        scanned += len(batch)
+        await db[MIGRATIONS].update_one(
+            {"_id": _migration_id(collection)},
+            {"$set": {"last_id": last_id, "scanned": scanned, "converted": converted, "updated_at": utcnow()}},
+            upsert=True,
+        )
+        logger.info(f"{collection}: {scanned} scanned, {converted} converted")
+
+        if max_docs_per_second:
+            # Throttle so the migration doesn't compete with live traffic
+            delay = len(batch) / max_docs_per_second - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    await db[MIGRATIONS].update_one(
+        {"_id": _migration_id(collection)},
+        {"$set": {"done": True, "scanned": scanned, "converted": converted, "updated_at": utcnow()}},
+        upsert=True,
+    )
+    logger.info(f"{collection}: done, {converted} timestamps converted")
+
+
+async def migrate(db, collections: list = None, batch_size: int = 500, max_docs_per_second: float = 0,
+                  reset: bool = False):
+    for collection in collections or list(TIMESTAMP_FIELDS):
+        if reset:
+            await db[MIGRATIONS].delete_one({"_id": _migration_id(collection)})
+        await migrate_collection(db, collection, TIMESTAMP_FIELDS[collection], batch_size, max_docs_per_second)
+
+
+if __name__ == "__main__":
+    # python migrate_timestamps.py [--batch-size 500] [--rate 2000] [--collection orders] [--reset]
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to BSON dates")
+    parser.add_argument("--collection", action="append", choices=sorted(TIMESTAMP_FIELDS),
+                        help="limit to these collections (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=0, help="max documents per second, 0 = unthrottled")
+    parser.add_argument("--reset", action="store_true", help="forget saved progress and rescan from the start")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        await migrate(client[os.environ['DB_NAME']], args.collection, args.batch_size, args.rate, args.reset)
+        client.close()
+
+    asyncio.run(main())
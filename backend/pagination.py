@@ -0,0 +1,170 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+
+MAX_PAGE_SIZE = 1000
+# Types a cursor may carry for each sort key; created_at may still be a
+# legacy ISO string. Cursor values end up inside $gt/$lt, so anything else,
+# an operator document above all, is rejected.
+SORT_VALUE_TYPES = {
+    "created_at": (datetime, str),
+    "price": (int, float),
+    "id": (str,),
+}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def _decode_value(obj: dict):
+    # Raises TypeError/ValueError for anything but {"$date": "<ISO 8601>"}
+    if set(obj) != {"$date"}:
+        raise ValueError("Unexpected object in cursor")
+    return datetime.fromisoformat(obj["$date"])
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=_encode_value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw, object_hook=_decode_value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def decode_offset(after: Optional[str]) -> int:
+    # Ranked results (search) page by offset rather than by key
+    if not after:
+        return 0
+    values = decode_cursor(after)
+    if len(values) != 1 or not isinstance(values[0], int) or isinstance(values[0], bool) or values[0] < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[0]
+
+
+def parse_sort(sort: str, allowed: set) -> tuple:
+    # "price" sorts ascending, "-price" descending
+    direction = DESCENDING if sort.startswith("-") else ASCENDING
+    field = sort.lstrip("-")
+    if field not in allowed:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {field}")
+    return field, direction
+
+
+def parse_fields(fields: Optional[str], allowed: set, required: set, hidden: tuple = ()) -> dict:
+    projection = {"_id": 0}
+    if not fields:
+        projection.update({field: 0 for field in hidden})
+        return projection
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # The cursor is built from the sort key and id, so those are always returned
+    for field in requested | required:
+        projection[field] = 1
+    return projection
+
+
+def _valid_value(field: str, value) -> bool:
+    # A page may end on a document without the sort key
+    if value is None:
+        return field != "id"
+    return isinstance(value, SORT_VALUE_TYPES.get(field, ())) and not isinstance(value, bool)
+
+
+def keyset_filter(field: str, direction: int, after: str) -> dict:
+    values = decode_cursor(after)
+    if len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    value, last_id = values
+    if not _valid_value(field, value) or not _valid_value("id", last_id):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    op = "$gt" if direction == ASCENDING else "$lt"
+    clauses = [{field: {op: value}}, {field: value, "id": {op: last_id}}]
+    # Range operators only match values of the same BSON type, and BSON sorts
+    # every string before every date. While timestamps are being migrated from
+    # ISO strings a page can end on either, so cross over to the other type.
+    if isinstance(value, str) and direction == ASCENDING:
+        clauses.append({field: {"$type": "date"}})
+    elif isinstance(value, datetime) and direction == DESCENDING:
+        clauses.append({field: {"$type": "string"}})
+    return {"$or": clauses}
+
+
+def _page_query(query: dict, field: str, direction: int, after: Optional[str]) -> dict:
+    if not after:
+        return query
+    return {"$and": [query, keyset_filter(field, direction, after)]} if query else keyset_filter(field, direction, after)
+
+
+def _trim(items: list, field: str, limit: int) -> tuple:
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor([last.get(field), last['id']])
+    return items, next_cursor
+
+
+async def _fetch(collection, query: dict, field: str, direction: int, limit: int,
+                 after: Optional[str], projection: Optional[dict]) -> list:
+    # One document past the page tells whether there is a next page
+    cursor = collection.find(_page_query(query, field, direction, after), projection or {"_id": 0})
+    cursor = cursor.sort([(field, direction), ("id", direction)]).limit(limit + 1)
+    return await cursor.to_list(limit + 1)
+
+
+async def fetch_page(collection, query: dict, field: str, direction: int, limit: int,
+                     after: Optional[str] = None, projection: Optional[dict] = None) -> tuple:
+    items = await _fetch(collection, query, field, direction, limit, after, projection)
+    return _trim(items, field, limit)
+
+
+def _bson_order(value) -> tuple:
+    # Mirrors how MongoDB orders the sort key types we store: missing/null,
+    # then numbers, then strings, then dates
+    if value is None:
+        return (0,)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, value)
+
+
+async def fetch_merged_page(collections: list, query: dict, field: str, direction: int, limit: int,
+                            after: Optional[str] = None, projection: Optional[dict] = None) -> tuple:
+    """fetch_page over several collections holding the same kind of document.
+
+    Each collection serves its next limit + 1 documents past the cursor;
+    merging them in sort order and keeping the first limit gives the page the
+    union would have returned, and the cursor stays valid for every collection.
+    """
+    items = []
+    for collection in collections:
+        items += await _fetch(collection, query, field, direction, limit, after, projection)
+    items.sort(key=lambda item: (_bson_order(item.get(field)), item['id']), reverse=direction == DESCENDING)
+    return _trim(items, field, limit)
+
+
+def page_response(items: list, next_cursor: Optional[str], limit: Optional[int]) -> tuple:
+    # Clients that don't ask for a page size get the bare list they always got;
+    # the continuation is still available in the X-Next-Cursor header.
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if limit is None:
+        return items, headers
+    return {"items": items, "next_cursor": next_cursor}, headers
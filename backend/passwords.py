@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from metrics import BCRYPT_DURATION, Timer
+
+
+def create_crypt_context(rounds: int) -> CryptContext:
+    # Pinning min and max to the configured cost makes passlib flag any hash made
+    # with a different cost for an upgrade, which login uses to rehash in place
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL, so `max_workers` threads hash in parallel. Calls
+    beyond `max_pending` (running plus queued) are refused with a 503 instead
+    of piling up behind a login storm.
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int = 4, max_pending: int = 64):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, operation: str, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many authentication requests, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            with Timer(BCRYPT_DURATION, "bcrypt", operation=operation):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple:
+        # Returns (valid, new_hash); new_hash is set when the stored hash uses an outdated cost
+        return await self._run("verify", self.context.verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
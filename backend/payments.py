@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+import stripe
+from metrics import STRIPE_DURATION, add_time
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_SESSION_STATUSES = ("expired",)
+TERMINAL_PAYMENT_STATUSES = ("paid",)
+
+
+def configure_stripe_sdk(timeout: float, api_base: str = None):
+    # One pooled HTTP client shared by every Stripe call in the process
+    stripe.default_http_client = stripe.new_default_http_client(timeout=timeout)
+    if api_base:
+        # e.g. a local stripe-mock server
+        stripe.api_base = api_base
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, stripe.APIConnectionError, stripe.RateLimitError)):
+        return True
+    return isinstance(error, stripe.APIError) and (error.http_status or 500) >= 500
+
+
+class PaymentClient:
+    """Application-scoped Stripe checkout client.
+
+    Wraps a single checkout backend (StripeCheckout in production, anything
+    with the same three coroutines in tests) with per-call timeouts, retries
+    with full-jitter backoff, and a session status cache: terminal statuses
+    are kept for good, pending ones for `pending_ttl` seconds, and concurrent
+    polls for the same session share one upstream call.
+    """
+
+    def __init__(self, backend_factory, timeout: float = 10, max_retries: int = 2,
+                 backoff: float = 0.25, pending_ttl: float = 2, max_cached: int = 10000):
+        self.backend_factory = backend_factory
+        self.backend = None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pending_ttl = pending_ttl
+        self.max_cached = max_cached
+        self.upstream_calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self._terminal = OrderedDict()  # session_id -> status
+        self._pending = {}  # session_id -> (expires_at, status)
+        self._inflight = {}  # session_id -> task
+
+    def _backend(self, base_url: str):
+        # Built on first use because the webhook URL defaults to the host the API is served from
+        if self.backend is None:
+            self.backend = self.backend_factory(base_url)
+        return self.backend
+
+    async def _call(self, name: str, fn, *args, retry: bool = True):
+        attempt = 0
+        while True:
+            self.upstream_calls += 1
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(fn(*args), self.timeout)
+                self._observe(name, started, "ok")
+                return result
+            except Exception as e:
+                self._observe(name, started, "timeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__)
+                if not retry or attempt >= self.max_retries or not _is_transient(e):
+                    raise
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logger.warning(f"Stripe {name} failed ({e!r}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _observe(name: str, started: float, outcome: str):
+        elapsed = time.perf_counter() - started
+        STRIPE_DURATION.observe(elapsed, call=name, outcome=outcome)
+        add_time("stripe", elapsed)
+
+    async def create_checkout_session(self, checkout_request, base_url: str):
+        # Only retried on rate limiting: a timed out create may still have created a session
+        backend = self._backend(base_url)
+        attempt = 0
+        while True:
+            try:
+                return await self._call("create_checkout_session", backend.create_checkout_session, checkout_request, retry=False)
+            except stripe.RateLimitError:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                attempt += 1
+
+    async def handle_webhook(self, body: bytes, signature: str, base_url: str):
+        return await self._backend(base_url).handle_webhook(body, signature)
+
+    def _cached_status(self, session_id: str):
+        status = self._terminal.get(session_id)
+        if status is not None:
+            self._terminal.move_to_end(session_id)
+            return status
+        entry = self._pending.get(session_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _store_status(self, session_id: str, status):
+        if status.payment_status in TERMINAL_PAYMENT_STATUSES or status.status in TERMINAL_SESSION_STATUSES:
+            self._pending.pop(session_id, None)
+            self._terminal[session_id] = status
+            while len(self._terminal) > self.max_cached:
+                self._terminal.popitem(last=False)
+        else:
+            self._pending[session_id] = (time.monotonic() + self.pending_ttl, status)
+            if len(self._pending) > self.max_cached:
+                now = time.monotonic()
+                self._pending = {k: v for k, v in self._pending.items() if v[0] > now}
+
+    async def _fetch_status(self, session_id: str, base_url: str):
+        backend = self._backend(base_url)
+        status = await self._call("get_checkout_status", backend.get_checkout_status, session_id)
+        self._store_status(session_id, status)
+        return status
+
+    async def get_checkout_status(self, session_id: str, base_url: str):
+        status = self._cached_status(session_id)
+        if status is not None:
+            self.cache_hits += 1
+            return status
+
+        task = self._inflight.get(session_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_status(session_id, base_url))
+            self._inflight[session_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(session_id, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one poller going away doesn't cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "status_cache_hits": self.cache_hits,
+            "coalesced_polls": self.coalesced,
+            "terminal_cached": len(self._terminal),
+            "pending_cached": len(self._pending),
+        }
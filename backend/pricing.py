@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+
+# Carts store the price a line was added at; what the customer pays is always
+# the catalog's current price. PriceBook resolves every line of a cart with one
+# $in query against products, fronted by a short-lived snapshot of price and
+# stock that catalog writes invalidate.
+SNAPSHOT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "price": 1, "stock": 1}
+
+
+class PriceBook:
+    def __init__(self, ttl_seconds: float = 10, max_entries: int = 50000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self._entries = OrderedDict()  # product_id -> (expires_at, snapshot or None if it doesn't exist)
+
+    async def resolve(self, db, product_ids, fresh: bool = False) -> dict:
+        """Returns {product_id: {id, name, price, stock}} for the products that exist."""
+        now = time.monotonic()
+        snapshots, missing = {}, []
+        for product_id in dict.fromkeys(product_ids):
+            entry = None if fresh else self._entries.get(product_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                if entry[1] is not None:
+                    snapshots[product_id] = entry[1]
+            else:
+                self.misses += 1
+                missing.append(product_id)
+
+        if missing:
+            self.queries += 1
+            found = {p['id']: p async for p in db.products.find({"id": {"$in": missing}}, SNAPSHOT_PROJECTION)}
+            expires_at = now + self.ttl_seconds
+            for product_id in missing:
+                snapshot = found.get(product_id)
+                self._entries[product_id] = (expires_at, snapshot)
+                self._entries.move_to_end(product_id)
+                if snapshot is not None:
+                    snapshots[product_id] = snapshot
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return snapshots
+
+    def invalidate(self, product_id: str = None):
+        if product_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(product_id, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "queries": self.queries}
+
+
+def price_lines(items: list, snapshots: dict) -> dict:
+    """Prices cart lines at current catalog prices.
+
+    Each line gets the current `price`, its `line_total`, `price_changed` with
+    the `previous_price` it was added at, and whether the quantity is
+    `available`. Lines whose product no longer exists are returned with
+    `available` false and excluded from the total.
+    """
+    lines = []
+    total = 0.0
+    for item in items:
+        snapshot = snapshots.get(item['product_id'])
+        line = dict(item)
+        if snapshot is None:
+            line.update(line_total=0.0, price_changed=False, available=False, stock=0)
+            lines.append(line)
+            continue
+        price = snapshot['price']
+        line_total = round(price * item['quantity'], 2)
+        changed = item.get('price') is not None and abs(item['price'] - price) >= 0.005
+        line.update(
+            name=snapshot.get('name'),
+            price=price,
+            line_total=line_total,
+            price_changed=changed,
+            available=snapshot.get('stock', 0) >= item['quantity'],
+            stock=snapshot.get('stock', 0),
+        )
+        if changed:
+            line['previous_price'] = item['price']
+        total += line_total
+        lines.append(line)
+
+    return {
+        "items": lines,
+        "total": round(total, 2),
+        "price_changed": any(line['price_changed'] for line in lines),
+        "all_available": all(line['available'] for line in lines),
+    }
@@ -0,0 +1,276 @@
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from starlette.responses import JSONResponse
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-client rate limiting and overload shedding for /api. Every request is
+# put in a route class; each class has a token bucket per client (user id when
+# the bearer token is valid, client IP otherwise), and a priority lane that
+# decides how early it is shed when the worker is overloaded. Lane factors
+# scale the in-flight and event loop lag thresholds: browsing is shed first,
+# checkout only well past them, webhooks never.
+ROUTE_CLASSES = [
+    # (class, method or None for any, path pattern)
+    ("webhook", None, re.compile(r"^/api/webhook/")),
+    ("stream", "GET", re.compile(r"^/api/(payments/stripe/events/[^/]+|orders/[^/]+/events)$")),
+    ("checkout", "POST", re.compile(r"^/api/(orders/create|payments/)")),
+    ("checkout", "GET", re.compile(r"^/api/payments/")),
+    ("auth", "POST", re.compile(r"^/api/auth/(login|register)$")),
+    ("admin", None, re.compile(r"^/api/admin/")),
+    ("browse", "GET", re.compile(r"^/api/products")),
+]
+LANES = {
+    "webhook": "critical",
+    "checkout": "high",
+    "stream": "normal",
+    "auth": "normal",
+    "admin": "normal",
+    "default": "normal",
+    "browse": "low",
+}
+LANE_FACTORS = {"critical": None, "high": 1.5, "normal": 1.0, "low": 0.75}
+# (tokens per second, burst); classes without an entry are not rate limited
+DEFAULT_LIMITS = {
+    "auth": (0.2, 10),
+    "checkout": (2, 10),
+    "stream": (1, 10),
+    "browse": (10, 50),
+    "admin": (20, 100),
+    "default": (10, 40),
+}
+# Streams are long-lived and capped by the event hub, so they don't count as in flight
+UNCOUNTED_CLASSES = {"stream"}
+# Classes whose clients are mostly keyed by IP: login and registration always,
+# browsing because it is largely anonymous. Without trusted proxy hops, every
+# client behind a proxy would share the proxy's bucket, so these classes have
+# no default limit then
+IP_KEYED_CLASSES = ("auth", "browse")
+
+
+def classify(method: str, path: str) -> str:
+    for route_class, route_method, pattern in ROUTE_CLASSES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return route_class
+    return "default"
+
+
+def parse_limits(spec: str, trusted_proxy_hops: int = 0) -> dict:
+    """Parses "auth=0.2:10,browse=10:50" over the defaults; "on" is just the defaults, "" or "off" none.
+
+    Without trusted proxy hops the IP-keyed classes are only limited when the spec names them.
+    """
+    if spec.strip().lower() in ("", "off"):
+        return {}
+    limits = dict(DEFAULT_LIMITS)
+    if not trusted_proxy_hops:
+        for route_class in IP_KEYED_CLASSES:
+            limits.pop(route_class, None)
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        if part.lower() == "on":
+            continue
+        route_class, _, value = part.partition("=")
+        if value.strip().lower() == "off":
+            limits.pop(route_class.strip(), None)
+            continue
+        rate, _, burst = value.partition(":")
+        limits[route_class.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class MemoryBuckets:
+    """Token buckets for this worker only, LRU-bounded by client."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def take(self, key: str, rate: float, burst: float) -> tuple:
+        """Returns (allowed, tokens left, seconds until the next token)."""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens, 0.0 if allowed else (1 - tokens) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Same refill arithmetic as MemoryBuckets, atomically on the Redis server
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - updated_at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker; falls back to local buckets while Redis is unreachable."""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_STORE=redis needs the redis package (pip install redis)")
+        self.redis = redis.from_url(url)
+        self.prefix = prefix
+        self.fallback = MemoryBuckets()
+        self._script = self.redis.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float) -> tuple:
+        try:
+            allowed, tokens = await self._script(keys=[self.prefix + key], args=[rate, burst])
+        except Exception:
+            logger.warning("Rate limit store unavailable, using local buckets", exc_info=True)
+            return await self.fallback.take(key, rate, burst)
+        tokens = float(tokens)
+        return bool(allowed), tokens, 0.0 if allowed else (1 - tokens) / rate
+
+    def __len__(self):
+        return len(self.fallback)
+
+
+def create_bucket_store(kind: str, redis_url: str = None):
+    if kind == "memory":
+        return MemoryBuckets()
+    if kind == "redis":
+        if not redis_url:
+            raise RuntimeError("RATE_LIMIT_STORE=redis needs REDIS_URL")
+        return RedisBuckets(redis_url)
+    raise ValueError(f"Unknown RATE_LIMIT_STORE {kind!r}")
+
+
+class RateLimiter:
+    """Rate limit and load shedding state shared by the middleware and cache-stats.
+
+    `identify(token)` returns the user id for a valid bearer token or None.
+    `max_in_flight` and `max_loop_lag` of 0 disable that shedding signal.
+    `trusted_proxy_hops` is the number of proxies in front of the app whose
+    X-Forwarded-For entries are trusted for the client IP.
+    """
+
+    def __init__(self, limits: dict, store, identify=None, max_in_flight: int = 0, max_loop_lag: float = 0,
+                 trusted_proxy_hops: int = 0):
+        self.limits = limits
+        self.store = store
+        self.identify = identify
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag
+        self.trusted_proxy_hops = trusted_proxy_hops
+        self.in_flight = 0
+        self.limited = 0
+        self.shed = 0
+
+    def client_ip(self, scope, headers: dict) -> str:
+        if self.trusted_proxy_hops:
+            forwarded = [h.strip() for h in headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")]
+            forwarded = [h for h in forwarded if h]
+            if forwarded:
+                # Entries left of the ones our proxies appended are client-controlled
+                return forwarded[max(len(forwarded) - self.trusted_proxy_hops, 0)]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def client_key(self, route_class: str, scope, headers: dict) -> str:
+        # Login and registration are keyed by IP: credential stuffing is anonymous
+        if route_class != "auth" and self.identify:
+            authorization = headers.get(b"authorization", b"").decode("latin-1")
+            scheme, _, token = authorization.partition(" ")
+            if scheme.lower() == "bearer" and token:
+                user_id = self.identify(token)
+                if user_id:
+                    return f"{route_class}:u:{user_id}"
+        return f"{route_class}:ip:{self.client_ip(scope, headers)}"
+
+    def overloaded(self, lane: str):
+        factor = LANE_FACTORS[lane]
+        if factor is None:
+            return None
+        if self.max_in_flight and self.in_flight >= self.max_in_flight * factor:
+            return "in_flight"
+        if self.max_loop_lag and metrics.LOOP_LAG_LAST.get() >= self.max_loop_lag * factor:
+            return "loop_lag"
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_loop_lag": self.max_loop_lag,
+            "limited": self.limited,
+            "shed": self.shed,
+            "clients": len(self.store),
+        }
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware applying a RateLimiter to /api requests."""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter
+        route_class = classify(scope["method"], scope["path"])
+        reason = limiter.overloaded(LANES.get(route_class, "normal"))
+        if reason:
+            limiter.shed += 1
+            metrics.SHED_REQUESTS.inc(route_class=route_class, reason=reason)
+            response = JSONResponse({"detail": "Server busy, retry shortly"}, status_code=503,
+                                    headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+
+        limit = limiter.limits.get(route_class)
+        if limit:
+            rate, burst = limit
+            headers = dict(scope["headers"])
+            allowed, remaining, retry_after = await limiter.store.take(
+                limiter.client_key(route_class, scope, headers), rate, burst)
+            if not allowed:
+                limiter.limited += 1
+                metrics.RATE_LIMITED.inc(route_class=route_class)
+                response = JSONResponse({"detail": "Too many requests"}, status_code=429, headers={
+                    "Retry-After": str(max(math.ceil(retry_after), 1)),
+                    "X-RateLimit-Limit": str(int(burst)),
+                    "X-RateLimit-Remaining": "0",
+                })
+                await response(scope, receive, send)
+                return
+
+        if route_class in UNCOUNTED_CLASSES:
+            await self.app(scope, receive, send)
+            return
+        limiter.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.in_flight -= 1
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+import locks
+from lifecycle import ORDERS_ARCHIVE
+from timestamps import range_filter, utcnow
+
+logger = logging.getLogger(__name__)
+
+# "Frequently bought together", precomputed so serving is one _id lookup:
+#   co_purchases       sparse co-purchase matrix, one document per ordered pair
+#                      {_id: "a|b", product_id: a, other_id: b, count}
+#   product_neighbors  {_id: product_id, neighbors: [{id, count}], updated_at},
+#                      the top K of each product's row
+# rebuild() recomputes both from every non-cancelled order, on one worker at a
+# time; record_order() keeps them current as orders come in. Cancellations
+# are only reflected by the next rebuild.
+PAIRS = "co_purchases"
+NEIGHBORS = "product_neighbors"
+PAIR_INDEX = [("product_id", ASCENDING), ("count", DESCENDING), ("other_id", ASCENDING)]
+# Bounds the pairs a single order adds: n products give n*(n-1) pairs
+MAX_PRODUCTS_PER_ORDER = 50
+REBUILD_LOCK = "recommendations_rebuild"
+
+
+def _pair_id(product_id: str, other_id: str) -> str:
+    return f"{product_id}|{other_id}"
+
+
+async def refresh_neighbors(db, product_ids: list, k: int):
+    """Recomputes the top-K row of each product from its co-purchase pairs."""
+    now = utcnow()
+    ops = []
+    for product_id in product_ids:
+        cursor = db[PAIRS].find({"product_id": product_id}, {"_id": 0, "other_id": 1, "count": 1}) \
+            .sort([("count", DESCENDING), ("other_id", ASCENDING)]).limit(k)
+        neighbors = [{"id": p['other_id'], "count": p['count']} async for p in cursor]
+        ops.append(UpdateOne({"_id": product_id}, {"$set": {"neighbors": neighbors, "updated_at": now}}, upsert=True))
+    if ops:
+        await db[NEIGHBORS].bulk_write(ops, ordered=False)
+
+
+async def record_order(db, items: list, k: int = 10):
+    product_ids = list(dict.fromkeys(item['product_id'] for item in items))[:MAX_PRODUCTS_PER_ORDER]
+    if len(product_ids) < 2:
+        return
+    await db[PAIRS].bulk_write([
+        UpdateOne(
+            {"_id": _pair_id(a, b)},
+            {"$inc": {"count": 1}, "$setOnInsert": {"product_id": a, "other_id": b}},
+            upsert=True,
+        )
+        for a in product_ids for b in product_ids if a != b
+    ], ordered=False)
+    await refresh_neighbors(db, product_ids, k)
+
+
+async def get_neighbors(db, product_id: str) -> list:
+    doc = await db[NEIGHBORS].find_one({"_id": product_id}, {"_id": 0, "neighbors": 1})
+    return [n['id'] for n in doc['neighbors']] if doc else []
+
+
+async def rebuild(db, k: int = 10) -> bool:
+    """Recomputes the matrix and every top-K row from orders, then swaps them in.
+
+    Runs on one worker at a time; returns False if another worker is already
+    rebuilding. Orders recorded while it runs go to the old collections and
+    are dropped with them, so they are replayed after the swap.
+    """
+    async with locks.lease(db, REBUILD_LOCK) as held:
+        if not held:
+            logger.info(f"{NEIGHBORS} rebuild already running on another worker")
+            return False
+        high_water = utcnow()
+        await _build_staging(db, k, high_water)
+        await db[f"{PAIRS}_rebuild"].rename(PAIRS, dropTarget=True)
+        if await db[f"{NEIGHBORS}_rebuild"].estimated_document_count():
+            await db[f"{NEIGHBORS}_rebuild"].rename(NEIGHBORS, dropTarget=True)
+        else:
+            await db[NEIGHBORS].delete_many({})
+        swapped_at = utcnow()
+
+        replayed = 0
+        orders = db.orders.find(
+            {**range_filter("created_at", high_water, swapped_at), "status": {"$ne": "cancelled"}},
+            {"_id": 0, "items.product_id": 1},
+        )
+        async for order in orders:
+            await record_order(db, order['items'], k)
+            replayed += 1
+        logger.info(f"Rebuilt {NEIGHBORS} for {await db[NEIGHBORS].estimated_document_count()} products, "
+                    f"replayed {replayed} orders placed during the rebuild")
+        return True
+
+
+async def _build_staging(db, k: int, high_water):
+    pairs_staging, neighbors_staging = f"{PAIRS}_rebuild", f"{NEIGHBORS}_rebuild"
+
+    await db.orders.aggregate([
+        {"$unionWith": ORDERS_ARCHIVE},
+        {"$match": {"status": {"$ne": "cancelled"}, "$expr": {"$lt": [{"$toDate": "$created_at"}, high_water]}}},
+        {"$project": {"_id": 0, "ids": {"$slice": [{"$setUnion": ["$items.product_id", []]}, MAX_PRODUCTS_PER_ORDER]}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+        {"$project": {"a": "$ids", "b": "$ids"}},
+        {"$unwind": "$a"},
+        {"$unwind": "$b"},
+        {"$match": {"$expr": {"$ne": ["$a", "$b"]}}},
+        {"$group": {"_id": {"$concat": ["$a", "|", "$b"]}, "product_id": {"$first": "$a"},
+                    "other_id": {"$first": "$b"}, "count": {"$sum": 1}}},
+        {"$out": pairs_staging},
+    ], allowDiskUse=True).to_list(None)
+    await db[pairs_staging].create_index(PAIR_INDEX, name="product_id_count")
+
+    await db[pairs_staging].aggregate([
+        {"$sort": {"product_id": 1, "count": -1, "other_id": 1}},
+        {"$group": {"_id": "$product_id", "neighbors": {"$push": {"id": "$other_id", "count": "$count"}}}},
+        {"$project": {"neighbors": {"$slice": ["$neighbors", k]}, "updated_at": "$$NOW"}},
+        {"$out": neighbors_staging},
+    ], allowDiskUse=True).to_list(None)
+
+
+if __name__ == "__main__":
+    # python recommendations.py rebuild
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python recommendations.py rebuild")
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        await rebuild(client[os.environ['DB_NAME']], int(os.environ.get('RECOMMENDATION_NEIGHBORS', '10')))
+        client.close()
+
+    asyncio.run(main())
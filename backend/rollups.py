@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import locks
+from lifecycle import ORDERS_ARCHIVE
+from timestamps import range_filter, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Dashboard statistics live in one small collection so the admin endpoints
+# read O(buckets) documents instead of scanning orders:
+#   {_id: "totals", orders, revenue, status_counts: {status: n}}
+#   {_id: "day:YYYY-MM-DD", kind: "day", day, orders, revenue}
+#   {_id: "day:YYYY-MM-DD:cat:<category>", kind: "day_category", day, category, revenue, units}
+#   {_id: "order:<id>", kind: "order", expires_at}
+# The order markers make counting an order idempotent: the marker is inserted
+# first in an ordered bulk, so a second attempt stops at its duplicate _id
+# before touching any counter. They only need to outlive a rebuild's replay.
+ROLLUPS = "stats_rollups"
+STAGING = f"{ROLLUPS}_rebuild"
+REBUILD_LOCK = "rollups_rebuild"
+ALL_ORDERS = [{"$unionWith": ORDERS_ARCHIVE}]
+TOTALS_ID = "totals"
+UNCATEGORIZED = "Uncategorized"
+GRANULARITIES = ("day", "week", "month")
+ORDER_MARKER_TTL = timedelta(days=1)
+
+
+def _day_key(created_at) -> str:
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return created_at.astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+
+async def record_order(db, order: dict, categories: dict = None, session=None) -> bool:
+    """Adds a newly created order to every rollup it belongs to; False if it was already counted."""
+    day = _day_key(order['created_at'])
+    if categories is None:
+        product_ids = [item['product_id'] for item in order['items']]
+        cursor = db.products.find({"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "category": 1}, session=session)
+        categories = {p['id']: p['category'] async for p in cursor}
+
+    by_category = defaultdict(lambda: [0.0, 0])
+    for item in order['items']:
+        bucket = by_category[categories.get(item['product_id'], UNCATEGORIZED)]
+        bucket[0] += item['price'] * item['quantity']
+        bucket[1] += item['quantity']
+
+    ops = [
+        InsertOne({"_id": f"order:{order['id']}", "kind": "order", "expires_at": utcnow() + ORDER_MARKER_TTL}),
+        UpdateOne(
+            {"_id": TOTALS_ID},
+            {"$inc": {"orders": 1, "revenue": order['total'], f"status_counts.{order['status']}": 1}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"_id": f"day:{day}"},
+            {"$inc": {"orders": 1, "revenue": order['total']}, "$setOnInsert": {"kind": "day", "day": day}},
+            upsert=True,
+        ),
+    ]
+    for category, (revenue, units) in by_category.items():
+        ops.append(UpdateOne(
+            {"_id": f"day:{day}:cat:{category}"},
+            {"$inc": {"revenue": revenue, "units": units},
+             "$setOnInsert": {"kind": "day_category", "day": day, "category": category}},
+            upsert=True,
+        ))
+    try:
+        await db[ROLLUPS].bulk_write(ops, session=session)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if len(errors) == 1 and errors[0].get("index") == 0 and errors[0].get("code") == 11000:
+            return False
+        raise
+    return True
+
+
+async def record_status_change(db, old_status: str, new_status: str, count: int = 1, session=None):
+    if old_status == new_status or not count:
+        return
+    await db[ROLLUPS].update_one(
+        {"_id": TOTALS_ID},
+        {"$inc": {f"status_counts.{old_status}": -count, f"status_counts.{new_status}": count}},
+        upsert=True,
+        session=session,
+    )
+
+
+async def get_totals(db) -> dict:
+    totals = await db[ROLLUPS].find_one({"_id": TOTALS_ID}) or {}
+    return {
+        "orders": totals.get("orders", 0),
+        "revenue": totals.get("revenue", 0),
+        "status_counts": {k: v for k, v in totals.get("status_counts", {}).items() if v},
+    }
+
+
+def _bucket_key(day: str, granularity: str) -> str:
+    if granularity == "month":
+        return day[:7]
+    if granularity == "week":
+        d = date.fromisoformat(day)
+        return (d - timedelta(days=d.weekday())).isoformat()
+    return day
+
+
+async def get_series(db, start: date, end: date, granularity: str = "day") -> dict:
+    day_range = {"$gte": start.isoformat(), "$lte": end.isoformat()}
+
+    series = {}
+    async for doc in db[ROLLUPS].find({"kind": "day", "day": day_range}).sort("day", 1):
+        key = _bucket_key(doc['day'], granularity)
+        bucket = series.setdefault(key, {"bucket": key, "orders": 0, "revenue": 0.0})
+        bucket["orders"] += doc.get("orders", 0)
+        bucket["revenue"] += doc.get("revenue", 0)
+
+    categories = defaultdict(lambda: {"revenue": 0.0, "units": 0})
+    async for doc in db[ROLLUPS].find({"kind": "day_category", "day": day_range}):
+        categories[doc['category']]["revenue"] += doc.get("revenue", 0)
+        categories[doc['category']]["units"] += doc.get("units", 0)
+
+    return {
+        "granularity": granularity,
+        "series": list(series.values()),
+        "categories": [{"category": c, **v} for c, v in sorted(categories.items())],
+    }
+
+
+async def rebuild_rollups(db) -> bool:
+    """Recomputes every rollup from orders and archived orders and swaps it in.
+
+    Runs on one worker at a time; returns False if another worker is already
+    rebuilding. Orders placed while it runs are counted into the old
+    collection and lost with it, so they are replayed after the swap; the
+    order markers skip the ones whose live write already landed in the new
+    collection.
+    """
+    async with locks.lease(db, REBUILD_LOCK) as held:
+        if not held:
+            logger.info(f"{ROLLUPS} rebuild already running on another worker")
+            return False
+        high_water = utcnow()
+        await _build_staging(db, high_water)
+        await db[STAGING].rename(ROLLUPS, dropTarget=True)
+        swapped_at = utcnow()
+
+        replayed = 0
+        async for order in db.orders.find(range_filter("created_at", high_water, swapped_at), {"_id": 0}):
+            if await record_order(db, order):
+                replayed += 1
+        # Status changes made during the rebuild are lost the same way; the
+        # counts are cheap to take again from the orders as they are now
+        by_status = await db.orders.aggregate(ALL_ORDERS + [{"$group": {"_id": "$status", "orders": {"$sum": 1}}}]).to_list(None)
+        await db[ROLLUPS].update_one({"_id": TOTALS_ID}, {"$set": {
+            "status_counts": {s['_id']: s['orders'] for s in by_status if s['_id']},
+        }}, upsert=True)
+        logger.info(f"Rebuilt {ROLLUPS}, replayed {replayed} orders placed during the rebuild")
+        return True
+
+
+async def _build_staging(db, high_water: datetime):
+    # $toDate accepts both ISO strings and BSON dates
+    created_at = {"$toDate": "$created_at"}
+    day = {"$dateToString": {"format": "%Y-%m-%d", "date": created_at}}
+    orders = ALL_ORDERS + [{"$match": {"$expr": {"$lt": [created_at, high_water]}}}]
+
+    await db.orders.aggregate(orders + [
+        {"$group": {"_id": day, "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}}},
+        {"$project": {"_id": {"$concat": ["day:", "$_id"]}, "kind": {"$literal": "day"}, "day": "$_id",
+                      "orders": 1, "revenue": 1}},
+        {"$out": STAGING},
+    ]).to_list(None)
+
+    await db.orders.aggregate(orders + [
+        {"$unwind": "$items"},
+        {"$lookup": {"from": "products", "localField": "items.product_id", "foreignField": "id", "as": "product"}},
+        {"$group": {
+            "_id": {"day": day, "category": {"$ifNull": [{"$arrayElemAt": ["$product.category", 0]}, UNCATEGORIZED]}},
+            "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}},
+            "units": {"$sum": "$items.quantity"},
+        }},
+        {"$project": {"_id": {"$concat": ["day:", "$_id.day", ":cat:", "$_id.category"]},
+                      "kind": {"$literal": "day_category"}, "day": "$_id.day", "category": "$_id.category",
+                      "revenue": 1, "units": 1}},
+        {"$merge": {"into": STAGING}},
+    ]).to_list(None)
+
+    by_status = await db.orders.aggregate(orders + [
+        {"$group": {"_id": "$status", "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}}},
+    ]).to_list(None)
+    await db[STAGING].replace_one({"_id": TOTALS_ID}, {
+        "orders": sum(s['orders'] for s in by_status),
+        "revenue": sum(s['revenue'] for s in by_status),
+        "status_counts": {s['_id']: s['orders'] for s in by_status if s['_id']},
+    }, upsert=True)
+
+    await db[STAGING].create_index([("kind", 1), ("day", 1)], name="kind_day")
+    await db[STAGING].create_index([("expires_at", 1)], name="expires_at_ttl", expireAfterSeconds=0)
+
+
+if __name__ == "__main__":
+    # python rollups.py rebuild
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python rollups.py rebuild")
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        await rebuild_rollups(client[os.environ['DB_NAME']])
+        client.close()
+
+    asyncio.run(main())
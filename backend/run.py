@@ -0,0 +1,67 @@
+import argparse
+import logging
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Multi-worker launcher: python run.py [--workers N] [--port 8001]
+#
+# Each worker is a separate process that imports server.py on its own, so
+# every worker builds its own Mongo client, caches and background tasks after
+# it starts. With MONGO_MAX_CONNECTIONS set, that per-host connection budget
+# is split evenly across workers as their MONGO_MAX_POOL_SIZE (and the
+# MONGO_MIN_POOL_SIZE warm floor is capped to match).
+ROOT_DIR = Path(__file__).parent
+
+
+def default_workers() -> int:
+    # The app is async: one worker per core keeps every core busy
+    if os.environ.get('WEB_CONCURRENCY'):
+        return int(os.environ['WEB_CONCURRENCY'])
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def size_pools(workers: int):
+    budget = os.environ.get('MONGO_MAX_CONNECTIONS')
+    if not budget:
+        return
+    per_worker = max(int(budget) // workers, 1)
+    os.environ['MONGO_MAX_POOL_SIZE'] = str(per_worker)
+    min_pool = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+    os.environ['MONGO_MIN_POOL_SIZE'] = str(min(min_pool, per_worker))
+    logger.info(f"{workers} workers x {per_worker} Mongo connections (budget {budget})")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(ROOT_DIR / '.env')
+    parser = argparse.ArgumentParser(description="Run the API with several uvicorn workers")
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument("--keep-alive", type=int, default=5, help="idle keep-alive timeout in seconds")
+    args = parser.parse_args()
+
+    # Workers inherit the environment, so pool sizes must be set before they start
+    size_pools(args.workers)
+    if args.workers > 1 and os.environ.get('BROADCAST_CHANNEL', 'local') == 'local':
+        logger.warning("BROADCAST_CHANNEL=local with several workers: cache invalidation and "
+                       "status events stay inside the worker that produced them; use mongo")
+
+    uvicorn.run(
+        "server:app",
+        app_dir=str(ROOT_DIR),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+    )
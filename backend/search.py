@@ -0,0 +1,207 @@
+import bisect
+import logging
+import math
+import re
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Matches in the name count more than matches in the category, which count
+# more than matches buried in the description.
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+
+# Expanded terms score a little lower than exact hits so that typing "head"
+# ranks "head" above "headphones", and a typo fix never beats a real match.
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+MAX_PREFIX_EXPANSIONS = 30
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _within_distance(a: str, b: str, max_distance: int) -> bool:
+    # Banded Levenshtein, bails out as soon as a row exceeds max_distance
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+class ProductSearchIndex:
+    """In-process inverted index over product name, description and category, ranked with BM25."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ready = False
+        self._reloads = []  # one change queue per load() in progress
+        self._reset()
+
+    def _reset(self):
+        self.postings = defaultdict(dict)  # term -> {product_id: weighted term frequency}
+        self.doc_terms = {}  # product_id -> {term: weighted term frequency}
+        self.doc_lengths = {}
+        self.categories = {}
+        self.total_length = 0.0
+        self.vocabulary = []  # sorted, for prefix lookups
+        self.by_initial = defaultdict(set)  # first character -> terms, for typo lookups
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def _add_term(self, term: str):
+        bisect.insort(self.vocabulary, term)
+        self.by_initial[term[0]].add(term)
+
+    def _drop_term(self, term: str):
+        i = bisect.bisect_left(self.vocabulary, term)
+        if i < len(self.vocabulary) and self.vocabulary[i] == term:
+            self.vocabulary.pop(i)
+        self.by_initial[term[0]].discard(term)
+        del self.postings[term]
+
+    def upsert(self, product: dict):
+        for queue in self._reloads:
+            queue.append(("upsert", product))
+        product_id = product['id']
+        self._remove(product_id)
+
+        terms = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(product.get(field, "")):
+                terms[token] += weight
+        if not terms:
+            return
+
+        for term, tf in terms.items():
+            if term not in self.postings:
+                self._add_term(term)
+            self.postings[term][product_id] = tf
+
+        length = sum(terms.values())
+        self.doc_terms[product_id] = dict(terms)
+        self.doc_lengths[product_id] = length
+        self.categories[product_id] = product.get("category")
+        self.total_length += length
+
+    def remove(self, product_id: str):
+        for queue in self._reloads:
+            queue.append(("remove", product_id))
+        self._remove(product_id)
+
+    def _remove(self, product_id: str):
+        terms = self.doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                self._drop_term(term)
+        self.total_length -= self.doc_lengths.pop(product_id)
+        self.categories.pop(product_id, None)
+
+    def build(self, products):
+        self._reset()
+        for product in products:
+            self.upsert(product)
+        self.ready = True
+
+    async def load(self, db):
+        # Changes made while the collection is read may or may not be in what
+        # the cursor returns, so they are queued and replayed on the fresh
+        # index before it is swapped in
+        queue = []
+        self._reloads.append(queue)
+        try:
+            fresh = ProductSearchIndex(self.k1, self.b)
+            cursor = db.products.find({}, {"_id": 0, "id": 1, "name": 1, "description": 1, "category": 1})
+            async for product in cursor:
+                fresh.upsert(product)
+        finally:
+            self._reloads.remove(queue)
+        for change, argument in queue:
+            getattr(fresh, change)(argument)
+        state = fresh.__dict__
+        del state['_reloads']  # other loads may still be queueing into ours
+        self.__dict__.update(state)
+        self.ready = True
+        logger.info(f"Search index loaded with {len(self)} products and {len(self.vocabulary)} terms")
+
+    def _expand(self, token: str, allow_prefix: bool) -> dict:
+        # Returns {term: weight} for every indexed term the query token should match
+        expansions = {}
+        if token in self.postings:
+            expansions[token] = 1.0
+
+        if allow_prefix and len(token) >= MIN_PREFIX_LENGTH:
+            i = bisect.bisect_left(self.vocabulary, token)
+            while i < len(self.vocabulary) and len(expansions) < MAX_PREFIX_EXPANSIONS:
+                term = self.vocabulary[i]
+                if not term.startswith(token):
+                    break
+                expansions.setdefault(term, PREFIX_WEIGHT)
+                i += 1
+
+        if not expansions and len(token) >= MIN_FUZZY_LENGTH:
+            max_distance = 1 if len(token) < 8 else 2
+            for term in self.by_initial.get(token[0], ()):
+                if _within_distance(token, term, max_distance):
+                    expansions[term] = FUZZY_WEIGHT
+
+        return expansions
+
+    def search(self, query: str, category: str = None, limit: int = None) -> list:
+        tokens = tokenize(query)
+        if not tokens or not self.doc_terms:
+            return []
+
+        doc_count = len(self.doc_terms)
+        avg_length = self.total_length / doc_count
+        scores = None
+
+        for position, token in enumerate(tokens):
+            # Only the token being typed is prefix-expanded; earlier ones are complete words
+            expansions = self._expand(token, allow_prefix=position == len(tokens) - 1)
+            token_scores = defaultdict(float)
+            for term, weight in expansions.items():
+                postings = self.postings[term]
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for product_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[product_id] / avg_length)
+                    score = weight * idf * tf * (self.k1 + 1) / (tf + norm)
+                    if score > token_scores[product_id]:
+                        token_scores[product_id] = score
+
+            # Every query token has to match something
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores}
+            if not scores:
+                return []
+
+        if category:
+            scores = {pid: s for pid, s in scores.items() if self.categories.get(pid) == category}
+
+        ranked = sorted(scores, key=lambda pid: (-scores[pid], pid))
+        return ranked[:limit] if limit else ranked
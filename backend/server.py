@@ -1,38 +1,222 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import StreamingResponse, PlainTextResponse
+from pymongo import ReturnDocument, UpdateOne
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict
 import uuid
-from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
+from datetime import date, datetime, timezone, timedelta
 from jose import JWTError, jwt
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 import json
+import asyncio
+from database import Database
+from indexes import ensure_indexes, verify_indexes
+from search import ProductSearchIndex
+from broadcast import create_broadcast
+from catalog_cache import CatalogCache, CachedResponse
+from auth_cache import UserCache
+from passwords import PasswordHasher, create_crypt_context
+from cart_store import create_cart_store
+import rollups
+import inventory
+from payments import PaymentClient, configure_stripe_sdk
+import webhooks
+import catalog_io
+import facets
+import lifecycle
+import recommendations
+from idempotency import IdempotencyStore
+from events import EventHub, new_event_id
+import metrics
+import ratelimit
+from serialization import CompressionMiddleware, dumps, json_response
+from timestamps import for_storage, range_filter, parse as parse_timestamp
+from pricing import PriceBook, price_lines
+from pagination import MAX_PAGE_SIZE, encode_cursor, decode_offset, parse_sort, parse_fields, fetch_page, fetch_merged_page, page_response
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection: pool sizing, compression and read routing come from the
+# MONGO_* settings in database.py. `db` is the primary; catalog and order
+# history reads go through database.reads()
+database = Database.from_env(event_listeners=[metrics.MongoCommandListener()])
+client = database.client
+db = database.primary
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing, off the event loop on a bounded thread pool
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = create_crypt_context(BCRYPT_ROUNDS)
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '4')),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '64')),
+)
 
 # JWT settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_DELTA = timedelta(days=7)
+# EventSource can't send headers, so event streams authenticate with a
+# short-lived token in the query string that is good for nothing else
+STREAM_TOKEN_TTL = timedelta(seconds=int(os.environ.get('STREAM_TOKEN_TTL_SECONDS', '60')))
+STREAM_TOKEN_SCOPE = "events"
+
+# Auth mode: "db" looks the user up on every request, "cached" serves user
+# records from a short-lived cache, "claims" trusts the signed token claims
+# for AUTH_CLAIMS_TRUST_SECONDS after issue and falls back to the cache
+AUTH_MODE = os.environ.get('AUTH_MODE', 'cached')
+AUTH_CLAIMS_TRUST_SECONDS = int(os.environ.get('AUTH_CLAIMS_TRUST_SECONDS', '300'))
+user_cache = UserCache(
+    ttl_seconds=float(os.environ.get('USER_CACHE_TTL_SECONDS', '60')),
+    max_entries=int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000')),
+)
 
 # Stripe setup
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', 'sk_test_emergent')
+STRIPE_WEBHOOK_URL = os.environ.get('STRIPE_WEBHOOK_URL')
+configure_stripe_sdk(
+    timeout=float(os.environ.get('STRIPE_HTTP_TIMEOUT_SECONDS', '10')),
+    api_base=os.environ.get('STRIPE_API_BASE'),
+)
+
+def create_stripe_checkout(base_url: str) -> StripeCheckout:
+    webhook_url = STRIPE_WEBHOOK_URL or f"{base_url.rstrip('/')}/api/webhook/stripe"
+    return StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+
+payment_client = PaymentClient(
+    create_stripe_checkout,
+    timeout=float(os.environ.get('STRIPE_CALL_TIMEOUT_SECONDS', '15')),
+    max_retries=int(os.environ.get('STRIPE_MAX_RETRIES', '2')),
+    pending_ttl=float(os.environ.get('STRIPE_PENDING_STATUS_TTL_SECONDS', '2')),
+)
+
+# Index bootstrap
+INDEX_SELF_CHECK = os.environ.get('INDEX_SELF_CHECK', 'true').lower() == 'true'
+
+# Product search
+SEARCH_RESULT_LIMIT = int(os.environ.get('SEARCH_RESULT_LIMIT', '1000'))
+search_index = ProductSearchIndex()
+
+# Per-order stock reservations live on the product document but are never served
+PRODUCT_PROJECTION = {"_id": 0, "reservations": 0}
+
+# Bulk catalog import
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+
+# Listing sort keys, each backed by a (field, id) index
+PRODUCT_SORT_FIELDS = {"created_at", "price"}
+ORDER_SORT_FIELDS = {"created_at"}
+
+# Catalog cache, invalidated on every product write and stock reservation or release
+catalog_cache = CatalogCache(
+    max_entries=int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '1024')),
+    ttl_seconds=float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '300')),
+)
+CATALOG_CACHE_CONTROL = os.environ.get('CATALOG_CACHE_CONTROL', 'public, max-age=0, must-revalidate')
+
+# Cross-worker invalidation: "local" for a single worker, "mongo" to fan out through a capped collection
+broadcast = create_broadcast(os.environ.get('BROADCAST_CHANNEL', 'local'))
+
+# Checkout: stock held for unpaid orders is released after the TTL, or once
+# the order's checkout session has expired (Stripe's default is 24h).
+# ORDER_TRANSACTIONS=auto writes the order and clears the cart in one
+# transaction when the deployment supports it (replica set or sharded)
+ORDER_RESERVATION_TTL = timedelta(minutes=int(os.environ.get('ORDER_RESERVATION_TTL_MINUTES', '30')))
+PAYMENT_SESSION_TTL = timedelta(hours=int(os.environ.get('PAYMENT_SESSION_TTL_HOURS', '24')))
+RESERVATION_SWEEP_SECONDS = int(os.environ.get('RESERVATION_SWEEP_SECONDS', '60'))
+# Largest quantity a single cart line may hold; repeated adds are capped at it
+MAX_LINE_QUANTITY = int(os.environ.get('MAX_LINE_QUANTITY', '100'))
+ORDER_TRANSACTIONS = os.environ.get('ORDER_TRANSACTIONS', 'auto')
+transactions_enabled = False
+
+# Stripe webhook queue workers
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '2'))
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '50'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+webhook_workers = None
+
+# Observability: requests slower than this are logged with their Mongo/bcrypt/Stripe breakdown (0 = off)
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '1'))
+LOOP_LAG_SAMPLE_SECONDS = float(os.environ.get('LOOP_LAG_SAMPLE_SECONDS', '0.5'))
+
+# Price/stock snapshot used to price carts
+price_book = PriceBook(ttl_seconds=float(os.environ.get('PRICE_SNAPSHOT_TTL_SECONDS', '10')))
+
+# Cart store: mongo (write-through), memory (per-worker write-behind) or redis (shared write-behind)
+cart_store = create_cart_store(
+    os.environ.get('CART_STORE', 'mongo'),
+    db.carts,
+    flush_interval=float(os.environ.get('CART_FLUSH_SECONDS', '2')),
+    redis_url=os.environ.get('REDIS_URL'),
+    max_quantity=MAX_LINE_QUANTITY,
+)
+
+# Data lifecycle: abandoned carts expire through a TTL index, pending payment
+# sessions are marked expired once Stripe has expired them (24h by default),
+# and finished orders move to orders_archive. 0 disables a step
+lifecycle_sweeper = lifecycle.LifecycleSweeper(
+    db,
+    cart_ttl_seconds=int(os.environ.get('CART_TTL_DAYS', '30')) * 24 * 3600,
+    transaction_ttl_seconds=int(PAYMENT_SESSION_TTL.total_seconds()),
+    archive_after_days=int(os.environ.get('ORDER_ARCHIVE_DAYS', '180')),
+    interval_seconds=float(os.environ.get('LIFECYCLE_SWEEP_SECONDS', '600')),
+    batch_size=int(os.environ.get('LIFECYCLE_BATCH_SIZE', '500')),
+)
+
+# "Frequently bought together": neighbours kept per product, topped up from the same category
+RECOMMENDATION_NEIGHBORS = int(os.environ.get('RECOMMENDATION_NEIGHBORS', '10'))
+
+# Idempotency-Key replay for order and checkout session creation
+idempotency_store = IdempotencyStore(
+    db,
+    ttl_seconds=float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24')) * 3600,
+    max_entries=int(os.environ.get('IDEMPOTENCY_CACHE_MAX_ENTRIES', '10000')),
+)
+
+# Rate limits per route class and client, off unless RATE_LIMITS is set: "on"
+# for the defaults, or overrides such as "auth=0.2:10,browse=off"
+# (tokens/s:burst). Overload shedding answers 503 once in-flight requests or
+# event loop lag pass the thresholds; browsing goes first, checkout later,
+# webhooks never. TRUSTED_PROXY_HOPS is how many proxies in front of the app
+# append to X-Forwarded-For. It defaults to 0, which keys anonymous clients by
+# the socket peer; behind a load balancer or ingress it must be set, or every
+# client shares the proxy's bucket, so at 0 the auth and browse classes are
+# only limited when RATE_LIMITS names them. Never set it higher than the real
+# number of proxies: the extra entries are client-controlled
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+RATE_LIMITS = ratelimit.parse_limits(os.environ.get('RATE_LIMITS', ''), TRUSTED_PROXY_HOPS)
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')
+SHED_MAX_IN_FLIGHT = int(os.environ.get('SHED_MAX_IN_FLIGHT', '256'))
+SHED_MAX_LOOP_LAG_SECONDS = float(os.environ.get('SHED_MAX_LOOP_LAG_SECONDS', '0.5'))
+
+# Server-sent order/payment status events
+event_hub = EventHub(
+    max_connections=int(os.environ.get('SSE_MAX_CONNECTIONS', '1000')),
+    heartbeat_seconds=float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15')),
+)
+# While a payment stream waits for a webhook, re-check Stripe this often
+SSE_PAYMENT_RECONCILE_SECONDS = float(os.environ.get('SSE_PAYMENT_RECONCILE_SECONDS', '10'))
+TERMINAL_ORDER_STATUSES = ("delivered", "cancelled")
+
+# Responses at least this large are sent gzip/brotli compressed when the client accepts it
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+
+# Tasks started on startup or off the request path, cancelled on shutdown
+background_tasks = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    # Finished tasks drop out, so the set only holds what is still running
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -76,12 +260,18 @@ class ProductCreate(BaseModel):
     price: float
     category: str
     image: str
-    stock: int
+    stock: int = Field(ge=0)  # on hand, including units reserved for unpaid orders
+
+class ProductImport(ProductCreate):
+    id: Optional[str] = None
 
 class CartItem(BaseModel):
     product_id: str
-    quantity: int
-    price: float
+    quantity: int = Field(gt=0, le=MAX_LINE_QUANTITY)
+    price: Optional[float] = None  # ignored on input, carts are priced from the catalog
+
+class CartItemUpdate(CartItem):
+    quantity: int = Field(ge=0, le=MAX_LINE_QUANTITY)  # 0 removes the line
 
 class Cart(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -90,6 +280,8 @@ class Cart(BaseModel):
     items: List[CartItem] = []
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+ORDER_STATUSES = ("pending", "processing", "shipped", "delivered", "cancelled")
+
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -106,6 +298,7 @@ class PaymentTransaction(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: str
+    order_id: Optional[str] = None
     user_id: str
     user_email: str
     amount: float
@@ -115,34 +308,66 @@ class PaymentTransaction(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> tuple:
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
 
-def create_access_token(data: dict) -> str:
+def create_access_token(data: dict, expires_delta: timedelta = JWT_EXPIRATION_DELTA) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + JWT_EXPIRATION_DELTA
-    to_encode.update({"exp": expire})
+    now = datetime.now(timezone.utc)
+    expire = now + expires_delta
+    to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+def token_claims(user: dict) -> dict:
+    return {"sub": user['id'], "email": user['email'], "role": user['role'], "ep": user.get('auth_epoch', 0)}
+
+def token_subject(token: str) -> Optional[str]:
+    # Rate limiting keys signed-in clients by user; revocation is checked later by get_current_user
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    return await authenticate(credentials.credentials)
+
+async def authenticate(token: str, scope: Optional[str] = None) -> dict:
+    """Resolves a token to its user; scoped tokens are only accepted where that scope is asked for."""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("scope") != scope:
             raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    token_epoch = payload.get("ep", 0)
+    if user_cache.is_revoked(user_id, token_epoch):
+        raise HTTPException(status_code=401, detail="Token revoked")
+
+    if AUTH_MODE == "claims":
+        # Recently issued tokens are trusted as-is; the epoch check above catches revocations
+        issued_at = payload.get("iat")
+        if issued_at and datetime.now(timezone.utc).timestamp() - issued_at < AUTH_CLAIMS_TRUST_SECONDS:
+            user_cache.claims += 1
+            return {"id": user_id, "email": payload.get("email"), "role": payload.get("role"), "auth_epoch": token_epoch}
+
+    user = user_cache.get(user_id) if AUTH_MODE != "db" else None
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        if AUTH_MODE != "db":
+            user_cache.set(user_id, user)
+
+    if user.get("auth_epoch", 0) > token_epoch:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return user
+
 async def get_admin_user(user: dict = Depends(get_current_user)) -> dict:
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -157,24 +382,29 @@ async def register(user_data: UserRegister):
     
     user = User(
         email=user_data.email,
-        password_hash=hash_password(user_data.password),
+        password_hash=await hash_password(user_data.password),
         role="customer"
     )
     
-    doc = user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc = for_storage(user.model_dump())
     await db.users.insert_one(doc)
     
-    token = create_access_token({"sub": user.id, "email": user.email, "role": user.role})
+    token = create_access_token(token_claims(doc))
     return {"token": token, "user": {"id": user.id, "email": user.email, "role": user.role}}
 
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_password(credentials.password, user['password_hash'])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this password was hashed
+        await db.users.update_one({"id": user['id']}, {"$set": {"password_hash": new_hash}})
     
-    token = create_access_token({"sub": user['id'], "email": user['email'], "role": user['role']})
+    token = create_access_token(token_claims(user))
     return {"token": token, "user": {"id": user['id'], "email": user['email'], "role": user['role']}}
 
 @api_router.get("/auth/me")
@@ -182,40 +412,174 @@ async def get_me(user: dict = Depends(get_current_user)):
     return {"id": user['id'], "email": user['email'], "role": user['role']}
 
 # Product endpoints
-@api_router.get("/products")
-async def get_products(category: Optional[str] = None, search: Optional[str] = None):
+async def cached_catalog_response(request: Request, key: tuple, loader) -> Response:
+    entry = catalog_cache.get(key)
+    if entry is None:
+        version = catalog_cache.version
+        payload, headers = await loader()
+        entry = CachedResponse(dumps(payload), headers, compress_min_size=COMPRESS_MIN_SIZE)
+        catalog_cache.set(key, entry, version)
+    return entry.to_response(request, CATALOG_CACHE_CONTROL)
+
+async def list_products(category, search, sort, limit, after, fields) -> tuple:
     query = {}
     if category:
         query["category"] = category
+
+    sort_field, direction = parse_sort(sort, PRODUCT_SORT_FIELDS)
+    projection = parse_fields(fields, set(Product.model_fields), {"id", sort_field}, hidden=("reservations",))
+    page_size = limit or MAX_PAGE_SIZE
+
+    if search and search_index.ready:
+        # Search results are ranked, so the cursor is an offset into the ranking
+        offset = decode_offset(after)
+        product_ids = search_index.search(search, category=category, limit=SEARCH_RESULT_LIMIT)
+        page_ids = product_ids[offset:offset + page_size]
+        if not page_ids:
+            return page_response([], None, limit)
+        products = await database.reads().products.find({"id": {"$in": page_ids}}, projection).to_list(len(page_ids))
+        rank = {product_id: i for i, product_id in enumerate(page_ids)}
+        products.sort(key=lambda p: rank[p['id']])
+        next_offset = offset + page_size
+        next_cursor = encode_cursor([next_offset]) if next_offset < len(product_ids) else None
+        return page_response(products, next_cursor, limit)
+
     if search:
-        query["name"] = {"$regex": search, "$options": "i"}
-    
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    return products
+        # Search index still loading, fall back to the Mongo text index
+        query["$text"] = {"$search": search}
+        offset = decode_offset(after)
+        cursor = database.reads().products.find(query, projection).sort([("score", {"$meta": "textScore"})])
+        products = await cursor.skip(offset).limit(page_size + 1).to_list(page_size + 1)
+        next_cursor = encode_cursor([offset + page_size]) if len(products) > page_size else None
+        return page_response(products[:page_size], next_cursor, limit)
+
+    products, next_cursor = await fetch_page(database.reads().products, query, sort_field, direction, page_size, after, projection)
+    return page_response(products, next_cursor, limit)
+
+@api_router.get("/products")
+async def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: str = "created_at",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_facets: bool = False,
+):
+    async def load():
+        if not include_facets:
+            return await list_products(category, search, sort, limit, after, fields)
+        # Products and facets in one round trip for the listing page
+        (payload, headers), (product_facets, _) = await asyncio.gather(
+            list_products(category, search, sort, limit, after, fields),
+            load_facets(category, search),
+        )
+        if limit is None:
+            payload = {"items": payload, "next_cursor": headers.get("X-Next-Cursor")}
+        return {**payload, "facets": product_facets}, headers
+
+    key = ("products", category, search, sort, limit, after, fields, include_facets)
+    return await cached_catalog_response(request, key, load)
+
+async def load_facets(category: Optional[str], search: Optional[str]) -> tuple:
+    if search and search_index.ready:
+        match = {"id": {"$in": search_index.search(search, limit=SEARCH_RESULT_LIMIT)}}
+    elif search:
+        match = {"$text": {"$search": search}}
+    else:
+        match = {}
+    return await facets.compute_facets(database.reads().products, match, category), {}
+
+# Declared before /products/{product_id} so "facets" isn't taken for an id
+@api_router.get("/products/facets")
+async def get_product_facets(request: Request, category: Optional[str] = None, search: Optional[str] = None):
+    return await cached_catalog_response(request, ("facets", category, search), lambda: load_facets(category, search))
+
+async def load_product(product_id: str) -> tuple:
+    product = await database.reads().products.find_one({"id": product_id}, PRODUCT_PROJECTION)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product, {}
 
 @api_router.get("/products/{product_id}")
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product(product_id: str, request: Request):
+    return await cached_catalog_response(request, ("product", product_id), lambda: load_product(product_id))
+
+async def load_related(product_id: str, limit: int) -> tuple:
+    reads = database.reads()
+    product = await reads.products.find_one({"id": product_id}, {"_id": 0, "id": 1, "category": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    neighbor_ids = (await recommendations.get_neighbors(reads, product_id))[:limit]
+    related = []
+    if neighbor_ids:
+        found = {p['id']: p async for p in reads.products.find({"id": {"$in": neighbor_ids}}, PRODUCT_PROJECTION)}
+        related = [{**found[i], "reason": "bought_together"} for i in neighbor_ids if i in found]
+    if len(related) < limit and product.get('category'):
+        exclude = [product_id] + [p['id'] for p in related]
+        fallback = reads.products.find(
+            {"category": product['category'], "id": {"$nin": exclude}}, PRODUCT_PROJECTION
+        ).sort([("created_at", -1), ("id", -1)]).limit(limit - len(related))
+        related += [{**p, "reason": "same_category"} async for p in fallback]
+    return {"product_id": product_id, "items": related}, {}
+
+@api_router.get("/products/{product_id}/related")
+async def get_related_products(product_id: str, request: Request,
+                               limit: int = Query(RECOMMENDATION_NEIGHBORS, ge=1, le=RECOMMENDATION_NEIGHBORS)):
+    return await cached_catalog_response(request, ("related", product_id, limit), lambda: load_related(product_id, limit))
+
+async def update_recommendations(items: list):
+    try:
+        await recommendations.record_order(db, items, RECOMMENDATION_NEIGHBORS)
+    except Exception:
+        logger.exception("Updating co-purchase counts failed")
+
+async def publish_catalog_change(product_id: str, op: str):
+    await broadcast.publish("catalog", {"product_id": product_id, "op": op})
+
+async def publish_stock_change(product_ids: list = None):
+    # Catalog pages show stock, so reserving or releasing it is a catalog write
+    await broadcast.publish("catalog", {"product_ids": product_ids, "op": "stock"})
+
+async def on_catalog_change(message: dict):
+    # Runs in every worker, including the one that made the write
+    database.pin_primary()
+    catalog_cache.invalidate()
+    if message.get("op") == "stock":
+        # None when the caller didn't know which products moved
+        for product_id in message.get("product_ids") or [None]:
+            price_book.invalidate(product_id)
+        return
+    product_id = message.get("product_id")
+    price_book.invalidate(product_id)
+    if message.get("op") == "import":
+        run_in_background(search_index.load(db))
+    elif message.get("op") == "delete":
+        search_index.remove(product_id)
+    elif product_id:
+        product = await db.products.find_one({"id": product_id}, PRODUCT_PROJECTION)
+        if product:
+            search_index.upsert(product)
 
 @api_router.post("/products")
 async def create_product(product_data: ProductCreate, admin: dict = Depends(get_admin_user)):
     product = Product(**product_data.model_dump())
-    doc = product.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc = for_storage(product.model_dump())
     await db.products.insert_one(doc)
-    return product
+    doc.pop('_id')
+    await publish_catalog_change(product.id, "create")
+    return json_response(doc)
 
 @api_router.put("/products/{product_id}")
 async def update_product(product_id: str, product_data: ProductCreate, admin: dict = Depends(get_admin_user)):
     result = await db.products.update_one(
         {"id": product_id},
-        {"$set": product_data.model_dump()}
+        inventory.set_on_hand(product_data.model_dump())
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await publish_catalog_change(product_id, "update")
     return {"message": "Product updated"}
 
 @api_router.delete("/products/{product_id}")
@@ -223,199 +587,316 @@ async def delete_product(product_id: str, admin: dict = Depends(get_admin_user))
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await publish_catalog_change(product_id, "delete")
     return {"message": "Product deleted"}
 
+@api_router.post("/admin/products/import")
+async def import_products(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    admin: dict = Depends(get_admin_user),
+):
+    rows = catalog_io.read_rows(request.stream(), format)
+    report = {}
+    try:
+        report = await catalog_io.import_products(db, rows, ProductImport, batch_size=IMPORT_BATCH_SIZE)
+    except HTTPException as e:
+        # Rejected part way through; the rows before the bad line are written
+        report = e.detail
+        raise
+    finally:
+        if report.get('inserted') or report.get('updated'):
+            await publish_catalog_change(None, "import")
+    return report
+
+@api_router.get("/admin/products/export")
+async def export_products(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    admin: dict = Depends(get_admin_user),
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        catalog_io.export_products(db, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+@api_router.get("/admin/products/{product_id}")
+async def get_admin_product(product_id: str, admin: dict = Depends(get_admin_user)):
+    # The edit form works in on-hand stock; the catalog serves what is left to sell
+    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    product['stock'] = inventory.on_hand(product)
+    product['reserved'] = sum((product.pop('reservations', None) or {}).values())
+    return json_response(product)
+
 # Cart endpoints
 @api_router.get("/cart")
 async def get_cart(user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user['id']}, {"_id": 0})
-    if not cart:
-        return {"items": [], "total": 0}
-    
-    total = sum(item['price'] * item['quantity'] for item in cart.get('items', []))
-    return {"items": cart.get('items', []), "total": total}
+    cart = await cart_store.get(user['id'])
+    return await priced_cart(cart)
+
+async def priced_cart(cart: dict) -> dict:
+    # One $in query for every line that isn't in the price snapshot
+    items = cart.get('items', []) if cart else []
+    snapshots = await price_book.resolve(db, [item['product_id'] for item in items])
+    return price_lines(items, snapshots)
 
 @api_router.post("/cart/add")
 async def add_to_cart(item: CartItem, user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user['id']})
-    
-    if not cart:
-        cart = Cart(user_id=user['id'], items=[item.model_dump()])
-        doc = cart.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.carts.insert_one(doc)
-    else:
-        items = cart.get('items', [])
-        found = False
-        for i, existing_item in enumerate(items):
-            if existing_item['product_id'] == item.product_id:
-                items[i]['quantity'] += item.quantity
-                found = True
-                break
-        
-        if not found:
-            items.append(item.model_dump())
-        
-        await db.carts.update_one(
-            {"user_id": user['id']},
-            {"$set": {"items": items, "updated_at": datetime.now(timezone.utc).isoformat()}}
-        )
-    
-    return {"message": "Item added to cart"}
+    snapshot = (await price_book.resolve(db, [item.product_id])).get(item.product_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    line = {"product_id": item.product_id, "quantity": item.quantity, "price": snapshot['price']}
+    cart = await cart_store.add_item(user['id'], line)
+    return {"message": "Item added to cart", **await priced_cart(cart)}
 
 @api_router.put("/cart/update")
-async def update_cart_item(item: CartItem, user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user['id']})
+async def update_cart_item(item: CartItemUpdate, user: dict = Depends(get_current_user)):
+    cart = await cart_store.set_item_quantity(user['id'], item.product_id, item.quantity)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    
-    items = cart.get('items', [])
-    for i, existing_item in enumerate(items):
-        if existing_item['product_id'] == item.product_id:
-            if item.quantity <= 0:
-                items.pop(i)
-            else:
-                items[i]['quantity'] = item.quantity
-            break
-    
-    await db.carts.update_one(
-        {"user_id": user['id']},
-        {"$set": {"items": items, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
-    
-    return {"message": "Cart updated"}
+    return {"message": "Cart updated", **await priced_cart(cart)}
 
 @api_router.delete("/cart/remove/{product_id}")
 async def remove_from_cart(product_id: str, user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user['id']})
+    cart = await cart_store.remove_item(user['id'], product_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    
-    items = [item for item in cart.get('items', []) if item['product_id'] != product_id]
-    
-    await db.carts.update_one(
-        {"user_id": user['id']},
-        {"$set": {"items": items, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
-    
-    return {"message": "Item removed from cart"}
+    return {"message": "Item removed from cart", **await priced_cart(cart)}
 
 # Order endpoints
 @api_router.get("/orders")
-async def get_orders(user: dict = Depends(get_current_user)):
-    if user['role'] == 'admin':
-        orders = await db.orders.find({}, {"_id": 0}).to_list(1000)
-    else:
-        orders = await db.orders.find({"user_id": user['id']}, {"_id": 0}).to_list(1000)
-    return orders
+async def get_orders(
+    sort: str = "-created_at",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    created_from: Optional[datetime] = Query(None, alias="from"),
+    created_to: Optional[datetime] = Query(None, alias="to"),
+    user: dict = Depends(get_current_user),
+):
+    query = {} if user['role'] == 'admin' else {"user_id": user['id']}
+    if created_from or created_to:
+        # [from, to); served by the created_at indexes for both stored formats
+        query.update(range_filter("created_at", parse_timestamp(created_from), parse_timestamp(created_to)))
+    sort_field, direction = parse_sort(sort, ORDER_SORT_FIELDS)
+    projection = parse_fields(fields, set(Order.model_fields), {"id", sort_field}, hidden=("archived_at",))
+    # Finished orders the lifecycle sweeper archived are still part of the history
+    reads = database.reads()
+    orders, next_cursor = await fetch_merged_page(
+        [reads.orders, reads[lifecycle.ORDERS_ARCHIVE]], query, sort_field, direction, limit or MAX_PAGE_SIZE, after, projection,
+    )
+    payload, headers = page_response(orders, next_cursor, limit)
+    return json_response(payload, headers)
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str, user: dict = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    order = await database.reads().orders.find_one({"id": order_id}, {"_id": 0})
+    if not order and database.routed:
+        # A just-created order may not have replicated yet
+        order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        order = await db[lifecycle.ORDERS_ARCHIVE].find_one({"id": order_id}, {"_id": 0, "archived_at": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     if user['role'] != 'admin' and order['user_id'] != user['id']:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return order
+    return json_response(order)
+
+async def insert_order_and_clear_cart(doc: dict, user_id: str):
+    async def write(session):
+        await db.orders.insert_one(doc, session=session)
+        await db.carts.delete_one({"user_id": user_id}, session=session)
+        # In the same transaction, so the statistics gain the order exactly when it exists
+        await rollups.record_order(db, doc, session=session)
+
+    async with await client.start_session() as session:
+        if transactions_enabled:
+            await session.with_transaction(write)
+        else:
+            await write(session)
+
+async def finalize_order_reservation(order_id: str, status: str):
+    if status == "cancelled":
+        if await inventory.release(db, order_id):
+            await publish_stock_change()
+    elif status != "pending":
+        await inventory.commit(db, order_id)
+
+async def expire_reservations():
+    # Gives stock back for orders whose payment never completed
+    while True:
+        try:
+            for order_id, state in await inventory.expired(db):
+                if state == inventory.COMMITTING:
+                    await inventory.commit(db, order_id)
+                    continue
+                if await inventory.release(db, order_id):
+                    await publish_stock_change()
+                result = await db.orders.update_one({"id": order_id, "status": "pending"}, {"$set": {"status": "cancelled"}})
+                if result.modified_count:
+                    await rollups.record_status_change(db, "pending", "cancelled")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Reservation expiry sweep failed")
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+
+async def idempotent(request: Request, user: dict, endpoint: str, params: dict, handler):
+    """Runs `handler` once per Idempotency-Key; without the header it just runs it."""
+    key = request.headers.get("idempotency-key")
+    if key is None:
+        return json_response(await handler())
+    result, replayed = await idempotency_store.run(f"{user['id']}:{endpoint}", key, params, handler)
+    return json_response(result, headers={"Idempotent-Replayed": "true" if replayed else "false"})
 
 @api_router.post("/orders/create")
-async def create_order(payment_method: str, user: dict = Depends(get_current_user)):
+async def create_order(payment_method: str, request: Request, user: dict = Depends(get_current_user)):
+    return await idempotent(
+        request, user, "orders.create", {"payment_method": payment_method},
+        lambda: place_order(payment_method, user),
+    )
+
+async def place_order(payment_method: str, user: dict) -> dict:
+    # Write-behind stores may hold newer cart contents than db.carts
+    await cart_store.flush(user['id'])
     cart = await db.carts.find_one({"user_id": user['id']}, {"_id": 0})
     if not cart or not cart.get('items'):
         raise HTTPException(status_code=400, detail="Cart is empty")
     
-    total = sum(item['price'] * item['quantity'] for item in cart['items'])
+    # Charge current catalog prices, read fresh rather than from the snapshot
+    snapshots = await price_book.resolve(db, [item['product_id'] for item in cart['items']], fresh=True)
+    missing = [item['product_id'] for item in cart['items'] if item['product_id'] not in snapshots]
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Products no longer available", "product_ids": missing})
+    priced = price_lines(cart['items'], snapshots)
+    items = [
+        {"product_id": line['product_id'], "quantity": line['quantity'], "price": line['price']}
+        for line in priced['items']
+    ]
+    invalid = [item['product_id'] for item in items if not 0 < item['quantity'] <= MAX_LINE_QUANTITY]
+    if invalid:
+        raise HTTPException(status_code=400, detail={"message": "Invalid quantity", "product_ids": invalid})
     
     order = Order(
         user_id=user['id'],
         user_email=user['email'],
-        items=cart['items'],
-        total=total,
+        items=items,
+        total=priced['total'],
         payment_method=payment_method,
         status="pending"
     )
     
-    doc = order.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.orders.insert_one(doc)
-    
-    # Clear cart
-    await db.carts.delete_one({"user_id": user['id']})
+    doc = for_storage(order.model_dump())
+
+    try:
+        await inventory.reserve(db, order.id, items, ORDER_RESERVATION_TTL)
+    except inventory.InsufficientStock as e:
+        raise HTTPException(status_code=409, detail={"message": "Insufficient stock", "product_ids": e.product_ids})
+
+    try:
+        await insert_order_and_clear_cart(doc, user['id'])
+    except Exception:
+        await inventory.release(db, order.id)
+        raise
+    finally:
+        await publish_stock_change([item['product_id'] for item in items])
+    await cart_store.discard(user['id'])
+    # Off the request path; the related cache picks it up within its TTL
+    run_in_background(update_recommendations(items))
+    doc.pop('_id', None)
     
-    return order
+    return doc
 
 # Stripe Payment endpoints
 @api_router.post("/payments/stripe/create-session")
-async def create_stripe_session(request: Request, amount: float, origin_url: str, user: dict = Depends(get_current_user)):
+async def create_stripe_session(request: Request, order_id: str, origin_url: str, user: dict = Depends(get_current_user)):
+    return await idempotent(
+        request, user, "payments.create-session", {"order_id": order_id, "origin_url": origin_url},
+        lambda: start_checkout_session(order_id, origin_url, str(request.base_url), user),
+    )
+
+async def start_checkout_session(order_id: str, origin_url: str, base_url: str, user: dict) -> dict:
+    # The amount comes from the stored order, never from the client
+    order = await db.orders.find_one({"id": order_id, "user_id": user['id']}, {"_id": 0, "total": 1, "status": 1, "payment_id": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order['status'] != "pending" or order.get('payment_id'):
+        raise HTTPException(status_code=409, detail="Order is not awaiting payment")
+
     try:
         host_url = origin_url
-        webhook_url = f"{str(request.base_url).rstrip('/')}/api/webhook/stripe"
-        
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
         
         success_url = f"{host_url}/order-success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{host_url}/cart"
         
         checkout_request = CheckoutSessionRequest(
-            amount=float(amount),
+            amount=float(order['total']),
             currency="usd",
             success_url=success_url,
             cancel_url=cancel_url,
             metadata={
                 "user_id": user['id'],
-                "user_email": user['email']
+                "user_email": user['email'],
+                "order_id": order_id
             }
         )
         
-        session = await stripe_checkout.create_checkout_session(checkout_request)
+        session = await payment_client.create_checkout_session(checkout_request, base_url)
+        # The session stays payable until Stripe expires it, so the stock must stay held as long
+        if not await inventory.extend(db, order_id, datetime.now(timezone.utc) + PAYMENT_SESSION_TTL):
+            raise HTTPException(status_code=409, detail="Order reservation has expired")
         
         # Create payment transaction record
         transaction = PaymentTransaction(
             session_id=session.session_id,
+            order_id=order_id,
             user_id=user['id'],
             user_email=user['email'],
-            amount=amount,
+            amount=order['total'],
             currency="usd",
             payment_status="pending",
             metadata={"payment_method": "stripe"}
         )
         
-        doc = transaction.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
+        doc = for_storage(transaction.model_dump())
         await db.payment_transactions.insert_one(doc)
         
         return {"url": session.url, "session_id": session.session_id}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def sync_payment_status(session_id: str, user_id: str, base_url: str):
+    transaction = await db.payment_transactions.find_one(
+        {"session_id": session_id, "user_id": user_id}, {"_id": 0, "payment_status": 1}
+    )
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Payment session not found")
+    checkout_status = await payment_client.get_checkout_status(session_id, base_url)
+    
+    if transaction['payment_status'] != 'paid':
+        if checkout_status.payment_status == 'paid':
+            await settle_paid_sessions([session_id])
+        elif checkout_status.status == 'expired':
+            await publish_event(f"session:{session_id}", "payment", {
+                "session_id": session_id, "status": "expired", "payment_status": checkout_status.payment_status,
+            })
+    return checkout_status
+
+# Polling endpoint, kept for clients without EventSource
 @api_router.get("/payments/stripe/status/{session_id}")
 async def get_stripe_payment_status(session_id: str, request: Request, user: dict = Depends(get_current_user)):
     try:
-        host_url = str(request.base_url).rstrip('/')
-        webhook_url = f"{host_url}/api/webhook/stripe"
-        
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
-        checkout_status = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update transaction status
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
-        if transaction and transaction['payment_status'] != 'paid':
-            if checkout_status.payment_status == 'paid':
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {"$set": {"payment_status": "paid"}}
-                )
-                
-                # Update order status
-                await db.orders.update_one(
-                    {"user_id": user['id'], "payment_id": None},
-                    {"$set": {"payment_id": session_id, "status": "processing"}}
-                )
-        
+        checkout_status = await sync_payment_status(session_id, user['id'], str(request.base_url))
         return checkout_status.model_dump()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -424,53 +905,262 @@ async def stripe_webhook(request: Request):
     try:
         body = await request.body()
         signature = request.headers.get("Stripe-Signature")
-        
-        host_url = str(request.base_url).rstrip('/')
-        webhook_url = f"{host_url}/api/webhook/stripe"
-        
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        # Update payment transaction
-        if webhook_response.payment_status == 'paid':
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {"payment_status": "paid"}}
-            )
-        
-        return {"status": "success"}
+        webhook_response = await payment_client.handle_webhook(body, signature, str(request.base_url))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    # Acknowledge as soon as the event is durable; the worker pool applies it.
+    # Redeliveries of an event we already have are acknowledged the same way.
+    if await webhooks.enqueue(db, webhook_response, body):
+        webhook_workers.notify()
+    return {"status": "success"}
+
+async def apply_webhook_events(events: list):
+    session_ids = webhooks.paid_sessions(events)
+    if session_ids:
+        await settle_paid_sessions(session_ids)
+
+async def settle_paid_sessions(session_ids: list):
+    """Marks the sessions paid and moves the order each one was created for to processing."""
+    await db.payment_transactions.bulk_write([
+        UpdateOne({"session_id": sid, "payment_status": {"$ne": "paid"}}, {"$set": {"payment_status": "paid"}})
+        for sid in session_ids
+    ], ordered=False)
+
+    transactions = db.payment_transactions.find({"session_id": {"$in": session_ids}}, {"session_id": 1, "order_id": 1})
+    order_by_session = {t['session_id']: t.get('order_id') async for t in transactions}
+    unlinked = [sid for sid in session_ids if not order_by_session.get(sid)]
+    if unlinked:
+        logger.error(f"Paid sessions without an order: {', '.join(unlinked)}")
+
+    # A status poll may have linked some of these already; the filter makes that a no-op
+    linked = {sid: order_id for sid, order_id in order_by_session.items() if order_id}
+    refunds = {}
+    if linked:
+        result = await db.orders.bulk_write([
+            UpdateOne(
+                {"id": order_id, "payment_id": None, "status": "pending"},
+                {"$set": {"payment_id": sid, "status": "processing"}},
+            )
+            for sid, order_id in linked.items()
+        ], ordered=False)
+        await rollups.record_status_change(db, "pending", "processing", count=result.modified_count)
+        await asyncio.gather(*(inventory.commit(db, order_id) for order_id in linked.values()))
+
+        # Money arrived for an order that was cancelled (or paid through another
+        # session) first: it can't be fulfilled, so flag the payment for a refund
+        orders = db.orders.find({"id": {"$in": list(linked.values())}}, {"_id": 0, "id": 1, "status": 1, "payment_id": 1})
+        order_by_id = {o['id']: o async for o in orders}
+        refunds = {sid: order_by_id.get(order_id) for sid, order_id in linked.items()
+                   if order_by_id.get(order_id, {}).get('payment_id') != sid}
+        for sid, order in refunds.items():
+            logger.error(f"Payment {sid} for order {linked[sid]} "
+                         f"({order['status'] if order else 'missing'}) was not applied and needs a refund")
+        if refunds:
+            await db.payment_transactions.update_many(
+                {"session_id": {"$in": list(refunds)}}, {"$set": {"refund_required": True}}
+            )
+
+    await publish_payment_events({sid: order_by_session.get(sid) for sid in session_ids}, refunds=list(refunds))
+
+# Status events
+async def publish_event(channel: str, event_type: str, data: dict):
+    event = {"id": new_event_id(), "type": event_type, "data": data}
+    await broadcast.publish("events", {"channel": channel, "event": event})
+
+async def on_event(message: dict):
+    event_hub.deliver(message['channel'], message['event'])
+
+async def publish_payment_events(order_by_session: dict, refunds: list = ()):
+    for session_id, order_id in order_by_session.items():
+        refund_required = session_id in refunds
+        await publish_event(f"session:{session_id}", "payment", {
+            "session_id": session_id, "status": "complete", "payment_status": "paid", "order_id": order_id,
+            "refund_required": refund_required,
+        })
+        if order_id and not refund_required:
+            await publish_event(f"order:{order_id}", "status", {"order_id": order_id, "status": "processing"})
+
+@api_router.post("/events/token")
+async def create_stream_token(user: dict = Depends(get_current_user)):
+    token = create_access_token({**token_claims(user), "scope": STREAM_TOKEN_SCOPE}, STREAM_TOKEN_TTL)
+    return {"token": token, "expires_in": int(STREAM_TOKEN_TTL.total_seconds())}
+
+async def get_stream_user(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+) -> dict:
+    # ?token= only takes a stream token from /events/token, never the session token
+    if credentials is not None:
+        return await authenticate(credentials.credentials)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await authenticate(token, scope=STREAM_TOKEN_SCOPE)
+
+def event_stream_response(stream) -> StreamingResponse:
+    return StreamingResponse(stream, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # nginx: flush every event
+    })
+
+@api_router.get("/payments/stripe/events/{session_id}")
+async def stream_payment_events(session_id: str, request: Request, user: dict = Depends(get_stream_user)):
+    transaction = await db.payment_transactions.find_one(
+        {"session_id": session_id, "user_id": user['id']}, {"_id": 0, "payment_status": 1, "order_id": 1}
+    )
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Payment session not found")
+    snapshot = {
+        "id": new_event_id(), "type": "payment",
+        "data": {"session_id": session_id, "payment_status": transaction['payment_status'],
+                 "order_id": transaction.get('order_id')},
+    }
+    base_url = str(request.base_url)
+
+    async def reconcile():
+        # Covers deployments where the webhook is late or not configured
+        try:
+            await sync_payment_status(session_id, user['id'], base_url)
+        except Exception:
+            logger.warning(f"Payment status check for {session_id} failed", exc_info=True)
+
+    return event_stream_response(await event_hub.admit(event_hub.stream(
+        f"session:{session_id}", [snapshot],
+        last_event_id=request.headers.get("last-event-id"),
+        done=lambda e: e['data'].get('payment_status') == 'paid' or e['data'].get('status') == 'expired',
+        refresh=reconcile if transaction['payment_status'] != 'paid' else None,
+        refresh_seconds=SSE_PAYMENT_RECONCILE_SECONDS,
+    )))
+
+@api_router.get("/orders/{order_id}/events")
+async def stream_order_events(order_id: str, request: Request, user: dict = Depends(get_stream_user)):
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0, "id": 1, "user_id": 1, "status": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if user['role'] != 'admin' and order['user_id'] != user['id']:
+        raise HTTPException(status_code=403, detail="Access denied")
+    snapshot = {"id": new_event_id(), "type": "status", "data": {"order_id": order_id, "status": order['status']}}
+
+    return event_stream_response(await event_hub.admit(event_hub.stream(
+        f"order:{order_id}", [snapshot],
+        last_event_id=request.headers.get("last-event-id"),
+        done=lambda e: e['data'].get('status') in TERMINAL_ORDER_STATUSES,
+    )))
+
 # Admin endpoints
 @api_router.get("/admin/stats")
-async def get_admin_stats(admin: dict = Depends(get_admin_user)):
-    total_products = await db.products.count_documents({})
-    total_orders = await db.orders.count_documents({})
-    
-    orders = await db.orders.find({}, {"_id": 0}).to_list(1000)
-    total_revenue = sum(order['total'] for order in orders)
-    
-    return {
-        "total_products": total_products,
-        "total_orders": total_orders,
-        "total_revenue": total_revenue
+async def get_admin_stats(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    granularity: str = "day",
+    admin: dict = Depends(get_admin_user),
+):
+    totals = await rollups.get_totals(db)
+    stats = {
+        "total_products": await db.products.estimated_document_count(),
+        "total_orders": totals['orders'],
+        "total_revenue": totals['revenue'],
+        "orders_by_status": totals['status_counts'],
     }
 
+    if date_from or date_to:
+        if granularity not in rollups.GRANULARITIES:
+            raise HTTPException(status_code=400, detail="Invalid granularity")
+        date_to = date_to or datetime.now(timezone.utc).date()
+        date_from = date_from or date_to - timedelta(days=30)
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="from must not be after to")
+        stats.update(await rollups.get_series(db, date_from, date_to, granularity))
+
+    return stats
+
 @api_router.put("/admin/orders/{order_id}/status")
 async def update_order_status(order_id: str, status: str, admin: dict = Depends(get_admin_user)):
-    result = await db.orders.update_one(
+    if status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid order status")
+    previous = await db.orders.find_one_and_update(
         {"id": order_id},
-        {"$set": {"status": status}}
+        {"$set": {"status": status}},
+        projection={"_id": 0, "status": 1},
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    await rollups.record_status_change(db, previous['status'], status)
+    await finalize_order_reservation(order_id, status)
+    await publish_event(f"order:{order_id}", "status", {"order_id": order_id, "status": status})
     return {"message": "Order status updated"}
 
+async def bump_auth_epoch(user_id: str, update: dict = None) -> dict:
+    # Invalidates every token issued to the user so far, on every worker
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"auth_epoch": 1}, "$set": {**(update or {}), "auth_epoch_changed_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "password_hash": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    await broadcast.publish("auth", {"user_id": user_id, "epoch": user['auth_epoch']})
+    return user
+
+async def on_auth_change(message: dict):
+    user_cache.revoke(message['user_id'], message['epoch'])
+
+async def load_recent_revocations():
+    # Tokens trusted on claims alone may be up to AUTH_CLAIMS_TRUST_SECONDS old, so
+    # a fresh worker needs every revocation from that window
+    since = datetime.now(timezone.utc) - timedelta(seconds=AUTH_CLAIMS_TRUST_SECONDS)
+    async for user in db.users.find({"auth_epoch_changed_at": {"$gte": since}}, {"id": 1, "auth_epoch": 1}):
+        user_cache.revoke(user['id'], user['auth_epoch'])
+
+@api_router.post("/admin/users/{user_id}/revoke-sessions")
+async def revoke_user_sessions(user_id: str, admin: dict = Depends(get_admin_user)):
+    await bump_auth_epoch(user_id)
+    return {"message": "Sessions revoked"}
+
+@api_router.put("/admin/users/{user_id}/role")
+async def update_user_role(user_id: str, role: str, admin: dict = Depends(get_admin_user)):
+    if role not in ("admin", "customer"):
+        raise HTTPException(status_code=400, detail="Invalid role")
+    await bump_auth_epoch(user_id, {"role": role})
+    return {"message": "User role updated"}
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(admin: dict = Depends(get_admin_user)):
+    return {
+        "catalog": catalog_cache.stats(),
+        "auth": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "payments": payment_client.stats(),
+        "webhooks": webhook_workers.stats(),
+        "carts": cart_store.stats(),
+        "pricing": price_book.stats(),
+        "events": event_hub.stats(),
+        "lifecycle": lifecycle_sweeper.stats(),
+        "idempotency": idempotency_store.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "database": database.stats(),
+    }
+
+# Prometheus scrape endpoint, outside /api so it isn't exposed through the public ingress
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+rate_limiter = ratelimit.RateLimiter(
+    RATE_LIMITS,
+    ratelimit.create_bucket_store(RATE_LIMIT_STORE, os.environ.get('REDIS_URL')),
+    identify=token_subject,
+    max_in_flight=SHED_MAX_IN_FLIGHT,
+    max_loop_lag=SHED_MAX_LOOP_LAG_SECONDS,
+    trusted_proxy_hops=TRUSTED_PROXY_HOPS,
+)
+# Inside CORS so rejected requests still carry CORS headers
+app.add_middleware(ratelimit.RateLimitMiddleware, limiter=rate_limiter)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -478,6 +1168,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+app.add_middleware(metrics.MetricsMiddleware, slow_request_seconds=SLOW_REQUEST_SECONDS)
 
 # Configure logging
 logging.basicConfig(
@@ -488,19 +1180,66 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_db():
+    global transactions_enabled, webhook_workers
+    await ensure_indexes(db)
+    if INDEX_SELF_CHECK:
+        await verify_indexes(db)
+
+    if ORDER_TRANSACTIONS != 'off':
+        hello = await client.admin.command("hello")
+        transactions_enabled = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        if not transactions_enabled:
+            logger.warning("MongoDB is standalone, orders are written without a transaction")
+
+    if RATE_LIMITS and not TRUSTED_PROXY_HOPS:
+        logger.warning(
+            "TRUSTED_PROXY_HOPS is 0: anonymous clients are rate limited by the socket peer, so behind a "
+            "proxy they all share one bucket. Set it to the number of proxies in front of the app; until "
+            "then auth and browse are only limited where RATE_LIMITS names them"
+        )
+
+    broadcast.subscribe("catalog", on_catalog_change)
+    broadcast.subscribe("auth", on_auth_change)
+    broadcast.subscribe("events", on_event)
+    await broadcast.start(db)
+    run_in_background(search_index.load(db))
+    run_in_background(expire_reservations())
+    run_in_background(metrics.sample_loop_lag(LOOP_LAG_SAMPLE_SECONDS))
+    webhook_workers = webhooks.WebhookWorkerPool(
+        db, apply_webhook_events,
+        workers=WEBHOOK_WORKERS, batch_size=WEBHOOK_BATCH_SIZE, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+    )
+    webhook_workers.start()
+    cart_store.start()
+    lifecycle_sweeper.start()
+    await load_recent_revocations()
+    if not await db.stats_rollups.find_one({"_id": rollups.TOTALS_ID}):
+        # First start with rollups: backfill them from existing orders
+        run_in_background(rollups.rebuild_rollups(db))
+    if not await db[recommendations.NEIGHBORS].find_one({}, {"_id": 1}):
+        run_in_background(recommendations.rebuild(db, RECOMMENDATION_NEIGHBORS))
+
     # Create demo admin account if not exists
     admin = await db.users.find_one({"email": "admin@shop.com"})
     if not admin:
         admin_user = User(
             email="admin@shop.com",
-            password_hash=hash_password("admin123"),
+            password_hash=await hash_password("admin123"),
             role="admin"
         )
-        doc = admin_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
+        doc = for_storage(admin_user.model_dump())
         await db.users.insert_one(doc)
         logger.info("Demo admin created: admin@shop.com / admin123")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await webhook_workers.stop()
+    await lifecycle_sweeper.stop()
+    await cart_store.stop()
+    await broadcast.stop()
+    password_hasher.shutdown()
     client.close()
\ No newline at end of file
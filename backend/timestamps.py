@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+# Timestamps are stored as native BSON dates. Documents written before that
+# hold ISO-8601 strings until migrate_timestamps.py has converted them, so
+# read paths go through parse() and range_filter() to accept both.
+TIMESTAMP_FIELDS = {
+    "users": ("created_at",),
+    "products": ("created_at",),
+    "carts": ("updated_at",),
+    "orders": ("created_at",),
+    "payment_transactions": ("created_at",),
+}
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def parse(value) -> Optional[datetime]:
+    """Returns an aware UTC datetime for a stored timestamp in either format."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def for_storage(doc: dict, fields: tuple = ("created_at", "updated_at")) -> dict:
+    """Prepares a document for insert/update: timestamp fields become aware UTC datetimes."""
+    for field in fields:
+        if doc.get(field) is not None:
+            doc[field] = parse(doc[field])
+    return doc
+
+
+def range_filter(field: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """Half-open [start, end) filter on a timestamp field.
+
+    Legacy ISO strings all share the "+00:00" isoformat layout, so they
+    compare correctly as strings; both branches can use the field's index.
+    """
+    as_date, as_string = {}, {}
+    if start is not None:
+        as_date["$gte"], as_string["$gte"] = start, start.isoformat()
+    if end is not None:
+        as_date["$lt"], as_string["$lt"] = end, end.isoformat()
+    if not as_date:
+        return {}
+    return {"$or": [{field: as_date}, {field: as_string}]}
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Verified webhook events are appended here keyed by Stripe's event id, which
+# makes redeliveries no-ops. Workers claim queued events in batches under a
+# lease, so a crashed worker's batch is picked up again once the lease lapses.
+QUEUE = "webhook_events"
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+
+async def enqueue(db, event, body: bytes) -> bool:
+    """Stores a verified event; returns False if it was already received."""
+    now = datetime.now(timezone.utc)
+    event_id = getattr(event, "event_id", None) or hashlib.sha256(body).hexdigest()
+    try:
+        await db[QUEUE].insert_one({
+            "_id": event_id,
+            "event_type": getattr(event, "event_type", None),
+            "session_id": getattr(event, "session_id", None),
+            "payment_status": getattr(event, "payment_status", None),
+            "metadata": getattr(event, "metadata", None) or {},
+            "raw": body.decode("utf-8", errors="replace"),
+            "status": QUEUED,
+            "attempts": 0,
+            "received_at": now,
+            "next_attempt_at": now,
+        })
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+class WebhookWorkerPool:
+    def __init__(self, db, apply_batch, workers: int = 2, batch_size: int = 50, max_attempts: int = 8,
+                 backoff_seconds: float = 5, lease_seconds: float = 60, poll_seconds: float = 1):
+        self.db = db
+        self.apply_batch = apply_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _claim(self) -> list:
+        now = datetime.now(timezone.utc)
+        claimable = {"$or": [
+            {"status": QUEUED, "next_attempt_at": {"$lte": now}},
+            {"status": PROCESSING, "lease_until": {"$lt": now}},
+        ]}
+        cursor = self.db[QUEUE].find(claimable, {"_id": 1}).sort("next_attempt_at", 1).limit(self.batch_size)
+        ids = [doc['_id'] async for doc in cursor]
+        if not ids:
+            return []
+
+        token = str(uuid.uuid4())
+        await self.db[QUEUE].update_many(
+            {"$and": [{"_id": {"$in": ids}}, claimable]},
+            {"$set": {"status": PROCESSING, "claim": token, "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+        )
+        return await self.db[QUEUE].find({"claim": token}).to_list(self.batch_size)
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await self._claim()
+                if not batch:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Webhook worker iteration failed")
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _process(self, batch: list):
+        try:
+            await self.apply_batch(batch)
+            await self._finish(batch)
+            return
+        except Exception:
+            if len(batch) == 1:
+                await self._fail(batch[0])
+                return
+            logger.warning(f"Webhook batch of {len(batch)} failed, retrying events one by one")
+
+        # Isolate the poison event(s) so the rest of the batch still goes through
+        for event in batch:
+            try:
+                await self.apply_batch([event])
+                await self._finish([event])
+            except Exception:
+                await self._fail(event)
+
+    async def _finish(self, events: list):
+        await self.db[QUEUE].update_many(
+            {"_id": {"$in": [e['_id'] for e in events]}},
+            {"$set": {"status": DONE, "done_at": datetime.now(timezone.utc)}, "$unset": {"claim": "", "lease_until": ""}},
+        )
+        self.processed += len(events)
+
+    async def _fail(self, event: dict):
+        attempts = event.get("attempts", 0) + 1
+        logger.exception(f"Webhook event {event['_id']} failed (attempt {attempts})")
+        update = {"attempts": attempts, "last_error_at": datetime.now(timezone.utc)}
+        if attempts >= self.max_attempts:
+            update["status"] = DEAD
+            self.dead_lettered += 1
+        else:
+            delay = self.backoff_seconds * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+            update["status"] = QUEUED
+            update["next_attempt_at"] = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            self.retried += 1
+        await self.db[QUEUE].update_one(
+            {"_id": event['_id']},
+            {"$set": update, "$unset": {"claim": "", "lease_until": ""}},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+        }
+
+
+def paid_sessions(events: list) -> list:
+    return sorted({e['session_id'] for e in events if e.get('payment_status') == 'paid' and e.get('session_id')})
@@ -18,11 +18,14 @@ import { toast } from 'sonner';
 import api from '@/utils/api';
 import { isAdmin } from '@/utils/auth';
 
+const ORDERS_PAGE_SIZE = 50;
+
 const AdminDashboard = () => {
   const navigate = useNavigate();
   const [stats, setStats] = useState({ total_products: 0, total_orders: 0, total_revenue: 0 });
   const [products, setProducts] = useState([]);
   const [orders, setOrders] = useState([]);
+  const [ordersCursor, setOrdersCursor] = useState(null);
   const [editingProduct, setEditingProduct] = useState(null);
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [formData, setFormData] = useState({
@@ -48,16 +51,29 @@ const AdminDashboard = () => {
       const [statsRes, productsRes, ordersRes] = await Promise.all([
         api.get('/admin/stats'),
         api.get('/products'),
-        api.get('/orders'),
+        api.get('/orders', { params: { limit: ORDERS_PAGE_SIZE } }),
       ]);
       setStats(statsRes.data);
       setProducts(productsRes.data);
-      setOrders(ordersRes.data);
+      setOrders(ordersRes.data.items);
+      setOrdersCursor(ordersRes.data.next_cursor);
     } catch (error) {
       toast.error('Failed to load dashboard data');
     }
   };
 
+  const loadMoreOrders = async () => {
+    try {
+      const response = await api.get('/orders', {
+        params: { limit: ORDERS_PAGE_SIZE, after: ordersCursor },
+      });
+      setOrders([...orders, ...response.data.items]);
+      setOrdersCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error('Failed to load orders');
+    }
+  };
+
   const handleCreateProduct = async (e) => {
     e.preventDefault();
     try {
@@ -105,7 +121,15 @@ const AdminDashboard = () => {
     }
   };
 
-  const handleEditProduct = (product) => {
+  const handleEditProduct = async (listed) => {
+    // Stock is edited as the on-hand count, which includes units held for unpaid orders
+    let product;
+    try {
+      product = (await api.get(`/admin/products/${listed.id}`)).data;
+    } catch (error) {
+      toast.error('Failed to load product');
+      return;
+    }
     setEditingProduct(product);
     setFormData({
       name: product.name,
@@ -253,6 +277,11 @@ const AdminDashboard = () => {
                             required
                             data-testid="product-stock-input"
                           />
+                          {editingProduct?.reserved > 0 && (
+                            <p className="text-xs text-gray-500 mt-1">
+                              {editingProduct.reserved} held for unpaid orders
+                            </p>
+                          )}
                         </div>
                       </div>
                       <div>
@@ -383,6 +412,19 @@ const AdminDashboard = () => {
                   </div>
                 ))}
               </div>
+              
+              {ordersCursor && (
+                <div className="mt-8 text-center">
+                  <Button
+                    variant="outline"
+                    onClick={loadMoreOrders}
+                    className="border-white/20 text-gray-300 hover:border-amber-500/50"
+                    data-testid="load-more-orders"
+                  >
+                    Load more orders
+                  </Button>
+                </div>
+              )}
             </TabsContent>
           </Tabs>
         </div>
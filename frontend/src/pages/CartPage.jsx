@@ -35,12 +35,12 @@ const CartPage = () => {
     if (newQuantity < 1) return;
     
     try {
-      await api.put('/cart/update', {
+      const response = await api.put('/cart/update', {
         product_id: productId,
         quantity: newQuantity,
         price,
       });
-      await loadCart();
+      setCart(response.data);
     } catch (error) {
       toast.error('Failed to update cart');
     }
@@ -48,8 +48,8 @@ const CartPage = () => {
 
   const removeItem = async (productId) => {
     try {
-      await api.delete(`/cart/remove/${productId}`);
-      await loadCart();
+      const response = await api.delete(`/cart/remove/${productId}`);
+      setCart(response.data);
       toast.success('Item removed from cart');
     } catch (error) {
       toast.error('Failed to remove item');
@@ -101,11 +101,21 @@ const CartPage = () => {
                   >
                     <div className="flex-1">
                       <h3 className="text-lg font-semibold text-white mb-2">
-                        Product #{item.product_id.slice(0, 8)}
+                        {item.name || `Product #${item.product_id.slice(0, 8)}`}
                       </h3>
                       <p className="text-2xl font-bold text-amber-400">
                         ${item.price.toFixed(2)}
                       </p>
+                      {item.price_changed && (
+                        <p className="text-sm text-gray-400" data-testid={`price-changed-${index}`}>
+                          Price changed from ${item.previous_price.toFixed(2)}
+                        </p>
+                      )}
+                      {!item.available && (
+                        <p className="text-sm text-red-400" data-testid={`unavailable-${index}`}>
+                          {item.stock > 0 ? `Only ${item.stock} left in stock` : 'Out of stock'}
+                        </p>
+                      )}
                     </div>
                     
                     <div className="flex items-center space-x-3">
@@ -134,7 +144,7 @@ const CartPage = () => {
                     
                     <div className="text-right">
                       <p className="text-lg font-semibold text-white mb-2">
-                        ${(item.price * item.quantity).toFixed(2)}
+                        ${(item.line_total ?? item.price * item.quantity).toFixed(2)}
                       </p>
                       <Button
                         variant="ghost"
@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Header } from '@/components/Header';
 import { Button } from '@/components/ui/button';
@@ -14,6 +14,9 @@ const CheckoutPage = () => {
   const [loading, setLoading] = useState(true);
   const [paymentMethod, setPaymentMethod] = useState('stripe');
   const [processingPayment, setProcessingPayment] = useState(false);
+  // One key per checkout attempt: double clicks and retries replay the
+  // server's first response instead of creating another order or session
+  const checkoutKey = useRef(crypto.randomUUID());
 
   useEffect(() => {
     if (!isAuthenticated()) {
@@ -40,30 +43,36 @@ const CheckoutPage = () => {
   };
 
   const createOrder = async () => {
-    try {
-      await api.post('/orders/create', null, {
-        params: { payment_method: paymentMethod }
-      });
-    } catch (error) {
-      console.error('Failed to create order', error);
-    }
+    const response = await api.post('/orders/create', null, {
+      params: { payment_method: paymentMethod },
+      headers: { 'Idempotency-Key': `${checkoutKey.current}:order` }
+    });
+    return response.data;
   };
 
   const handleStripePayment = async () => {
     setProcessingPayment(true);
     try {
+      // Reserve stock before sending the customer to Stripe; the server
+      // charges the order's stored total
+      const order = await createOrder();
+      
       const originUrl = window.location.origin;
       const response = await api.post('/payments/stripe/create-session', null, {
         params: {
-          amount: cart.total,
+          order_id: order.id,
           origin_url: originUrl
-        }
+        },
+        headers: { 'Idempotency-Key': `${checkoutKey.current}:session` }
       });
       
-      await createOrder();
       window.location.href = response.data.url;
     } catch (error) {
-      toast.error('Payment failed. Please try again.');
+      if (error.response?.status === 409) {
+        toast.error('Some items are out of stock');
+      } else {
+        toast.error('Payment failed. Please try again.');
+      }
       setProcessingPayment(false);
     }
   };
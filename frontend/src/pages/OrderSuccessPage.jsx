@@ -14,15 +14,62 @@ const OrderSuccessPage = () => {
   const sessionId = searchParams.get('session_id');
 
   useEffect(() => {
-    if (sessionId) {
-      verifyPayment();
-    } else {
+    if (!sessionId) {
       setVerifying(false);
+      return;
     }
+    if (typeof window.EventSource === 'undefined') {
+      return pollPayment();
+    }
+
+    // The server pushes the payment status as soon as the webhook lands;
+    // fall back to polling if the stream can't be opened. EventSource can't
+    // send headers, so it authenticates with a short-lived stream token
+    let stopPolling = null;
+    let source = null;
+    let cancelled = false;
+
+    const openStream = async () => {
+      let token;
+      try {
+        token = (await api.post('/events/token')).data.token;
+      } catch (error) {
+        if (!cancelled) stopPolling = pollPayment();
+        return;
+      }
+      if (cancelled) return;
+      const url = `${process.env.REACT_APP_BACKEND_URL}/api/payments/stripe/events/${sessionId}`
+        + `?token=${encodeURIComponent(token)}`;
+      source = new EventSource(url);
+      source.addEventListener('payment', (event) => {
+        const data = JSON.parse(event.data);
+        if (data.payment_status === 'paid' || data.status === 'expired') {
+          source.close();
+          if (data.refund_required) {
+            toast.error('This order was cancelled before your payment arrived; the payment will be refunded');
+          }
+          setPaymentVerified(data.payment_status === 'paid');
+          setVerifying(false);
+        }
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED && !stopPolling) {
+          stopPolling = pollPayment();
+        }
+      };
+    };
+    openStream();
+
+    return () => {
+      cancelled = true;
+      if (source) source.close();
+      if (stopPolling) stopPolling();
+    };
   }, [sessionId]);
 
-  const verifyPayment = async () => {
+  const pollPayment = () => {
     let attempts = 0;
+    let timer = null;
     const maxAttempts = 5;
     
     const poll = async () => {
@@ -42,14 +89,15 @@ const OrderSuccessPage = () => {
         }
         
         attempts++;
-        setTimeout(poll, 2000);
+        timer = setTimeout(poll, 2000);
       } catch (error) {
         attempts++;
-        setTimeout(poll, 2000);
+        timer = setTimeout(poll, 2000);
       }
     };
     
     poll();
+    return () => clearTimeout(timer);
   };
 
   return (
@@ -1,6 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { Header } from '@/components/Header';
+import { ProductCard } from '@/components/ProductCard';
 import { Button } from '@/components/ui/button';
 import { ShoppingCart, ArrowLeft } from 'lucide-react';
 import { toast } from 'sonner';
@@ -13,11 +14,22 @@ const ProductDetailPage = () => {
   const [product, setProduct] = useState(null);
   const [loading, setLoading] = useState(true);
   const [quantity, setQuantity] = useState(1);
+  const [related, setRelated] = useState([]);
 
   useEffect(() => {
     loadProduct();
+    loadRelated();
   }, [id]);
 
+  const loadRelated = async () => {
+    try {
+      const response = await api.get(`/products/${id}/related`, { params: { limit: 4 } });
+      setRelated(response.data.items);
+    } catch (error) {
+      setRelated([]);
+    }
+  };
+
   const loadProduct = async () => {
     try {
       const response = await api.get(`/products/${id}`);
@@ -144,6 +156,17 @@ const ProductDetailPage = () => {
               </Button>
             </div>
           </div>
+
+          {related.length > 0 && (
+            <div className="mt-20" data-testid="related-products">
+              <h2 className="text-2xl font-semibold text-white mb-6">Frequently Bought Together</h2>
+              <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-4 gap-6">
+                {related.map((item) => (
+                  <ProductCard key={item.id} product={item} />
+                ))}
+              </div>
+            </div>
+          )}
         </div>
       </div>
     </div>
@@ -24,11 +24,9 @@ const ProductsPage = () => {
 
   const loadProducts = async () => {
     try {
-      const response = await api.get('/products');
-      setProducts(response.data);
-      
-      const uniqueCategories = [...new Set(response.data.map(p => p.category))];
-      setCategories(uniqueCategories);
+      const response = await api.get('/products', { params: { include_facets: true } });
+      setProducts(response.data.items);
+      setCategories(response.data.facets.categories.map(c => c.category));
     } catch (error) {
       console.error('Failed to load products', error);
     } finally {
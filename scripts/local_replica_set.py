@@ -0,0 +1,78 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+
+# Starts a throwaway local replica set for exercising secondary reads,
+# transactions and change-driven features:
+#   python scripts/local_replica_set.py --dir /tmp/rs --members 3
+# then run the backend with the printed MONGO_URL and, for example,
+# MONGO_READ_PREFERENCE=secondaryPreferred. Ctrl-C stops every member.
+
+
+def start_member(mongod: str, dbpath: str, port: int, name: str) -> subprocess.Popen:
+    os.makedirs(dbpath, exist_ok=True)
+    log = open(os.path.join(dbpath, "mongod.log"), "a")
+    return subprocess.Popen(
+        [mongod, "--replSet", name, "--port", str(port), "--dbpath", dbpath, "--bind_ip", "127.0.0.1"],
+        stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def initiate(ports: list, name: str, timeout: float = 60):
+    seed = MongoClient("127.0.0.1", ports[0], directConnection=True, serverSelectionTimeoutMS=timeout * 1000)
+    config = {
+        "_id": name,
+        "members": [{"_id": i, "host": f"127.0.0.1:{port}", "priority": 2 if i == 0 else 1}
+                    for i, port in enumerate(ports)],
+    }
+    try:
+        seed.admin.command("replSetInitiate", config)
+    except OperationFailure as e:
+        if e.code != 23:  # AlreadyInitialized: reusing a data directory
+            raise
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = seed.admin.command("replSetGetStatus")
+        states = [m["stateStr"] for m in status["members"]]
+        if states.count("PRIMARY") == 1 and states.count("SECONDARY") == len(ports) - 1:
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"replica set did not settle: {states}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local MongoDB replica set")
+    parser.add_argument("--dir", default="/tmp/mongo-rs", help="parent directory for member data")
+    parser.add_argument("--members", type=int, default=3)
+    parser.add_argument("--port", type=int, default=27117, help="port of the first member")
+    parser.add_argument("--name", default="rs0")
+    parser.add_argument("--mongod", default="mongod", help="path to the mongod binary")
+    args = parser.parse_args()
+
+    ports = [args.port + i for i in range(args.members)]
+    members = [start_member(args.mongod, os.path.join(args.dir, f"member{i}"), port, args.name)
+               for i, port in enumerate(ports)]
+    try:
+        initiate(ports, args.name)
+    except (OperationFailure, ServerSelectionTimeoutError, TimeoutError) as e:
+        for member in members:
+            member.terminate()
+        sys.exit(f"Could not start the replica set: {e}")
+
+    hosts = ",".join(f"127.0.0.1:{port}" for port in ports)
+    print(f"MONGO_URL=mongodb://{hosts}/?replicaSet={args.name}", flush=True)
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for member in members:
+            member.terminate()
+        for member in members:
+            member.wait()
@@ -1,7 +1,11 @@
+import argparse
 import asyncio
+import os
+import random
+import time
 from motor.motor_asyncio import AsyncIOMotorClient
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 
 # Sample products data
 SAMPLE_PRODUCTS = [
@@ -13,7 +17,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=500&h=500&fit=crop",
         "stock": 50,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -23,7 +27,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1523275335684-37898b6baf30?w=500&h=500&fit=crop",
         "stock": 75,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -33,7 +37,7 @@ SAMPLE_PRODUCTS = [
         "category": "Fashion",
         "image": "https://images.unsplash.com/photo-1551028719-00167b16eac5?w=500&h=500&fit=crop",
         "stock": 25,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -43,7 +47,7 @@ SAMPLE_PRODUCTS = [
         "category": "Fashion",
         "image": "https://images.unsplash.com/photo-1572635196237-14b3f281503f?w=500&h=500&fit=crop",
         "stock": 100,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -53,7 +57,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1502920917128-1aa500764cbd?w=500&h=500&fit=crop",
         "stock": 20,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -63,7 +67,7 @@ SAMPLE_PRODUCTS = [
         "category": "Fitness",
         "image": "https://images.unsplash.com/photo-1601925260368-ae2f83cf8b7f?w=500&h=500&fit=crop",
         "stock": 150,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -73,7 +77,7 @@ SAMPLE_PRODUCTS = [
         "category": "Home",
         "image": "https://images.unsplash.com/photo-1517668808822-9ebb02f2a0e6?w=500&h=500&fit=crop",
         "stock": 80,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -83,7 +87,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1603302576837-37561b2e2302?w=500&h=500&fit=crop",
         "stock": 30,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -93,7 +97,7 @@ SAMPLE_PRODUCTS = [
         "category": "Fashion",
         "image": "https://images.unsplash.com/photo-1584917865442-de89df76afd3?w=500&h=500&fit=crop",
         "stock": 40,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -103,7 +107,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1543512214-318c7553f230?w=500&h=500&fit=crop",
         "stock": 120,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -113,7 +117,7 @@ SAMPLE_PRODUCTS = [
         "category": "Fitness",
         "image": "https://images.unsplash.com/photo-1542291026-7eec264c27ff?w=500&h=500&fit=crop",
         "stock": 200,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -123,7 +127,7 @@ SAMPLE_PRODUCTS = [
         "category": "Home",
         "image": "https://images.unsplash.com/photo-1588516903720-8ceb67f9ef84?w=500&h=500&fit=crop",
         "stock": 180,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -133,7 +137,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1609091839311-d5365f9ff1c5?w=500&h=500&fit=crop",
         "stock": 300,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -143,7 +147,7 @@ SAMPLE_PRODUCTS = [
         "category": "Fashion",
         "image": "https://images.unsplash.com/photo-1601924994987-69e26d50dc26?w=500&h=500&fit=crop",
         "stock": 90,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -153,7 +157,7 @@ SAMPLE_PRODUCTS = [
         "category": "Electronics",
         "image": "https://images.unsplash.com/photo-1590658268037-6bf12165a8df?w=500&h=500&fit=crop",
         "stock": 250,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
     {
         "id": str(uuid.uuid4()),
@@ -163,10 +167,161 @@ SAMPLE_PRODUCTS = [
         "category": "Home",
         "image": "https://images.unsplash.com/photo-1578500494198-246f612d3b3d?w=500&h=500&fit=crop",
         "stock": 60,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     },
 ]
 
+# Synthetic data generator. Every record is derived from its index, so orders
+# and carts can reference any product or user without keeping millions of
+# ids in memory, and the same --seed always produces the same data.
+NAMESPACE = uuid.UUID("4f1c1a52-7d3b-4a5e-9f0e-2b8c6d1e9a47")
+
+CATALOG = {
+    "Electronics": (
+        ["Wireless", "Smart", "Portable", "Noise-Cancelling", "4K", "Bluetooth", "Compact", "Pro"],
+        ["Headphones", "Speaker", "Watch", "Camera", "Earbuds", "Monitor", "Keyboard", "Charger", "Tablet"],
+        (19.99, 1499.99),
+    ),
+    "Fashion": (
+        ["Leather", "Classic", "Designer", "Vintage", "Slim-Fit", "Linen", "Wool", "Luxury"],
+        ["Jacket", "Sunglasses", "Handbag", "Sneakers", "Scarf", "Belt", "Boots", "Wallet", "Dress"],
+        (14.99, 899.99),
+    ),
+    "Fitness": (
+        ["Adjustable", "Premium", "Non-Slip", "Foldable", "Eco", "Heavy-Duty", "Lightweight"],
+        ["Yoga Mat", "Dumbbells", "Resistance Bands", "Kettlebell", "Jump Rope", "Foam Roller", "Bench"],
+        (9.99, 499.99),
+    ),
+    "Home": (
+        ["Ceramic", "Scented", "Minimalist", "Handmade", "Modern", "Rustic", "Smart"],
+        ["Dinnerware Set", "Candle", "Lamp", "Vase", "Throw Blanket", "Coffee Maker", "Planter", "Rug"],
+        (7.99, 699.99),
+    ),
+}
+CATEGORIES = sorted(CATALOG)
+IMAGES = {}
+for sample in SAMPLE_PRODUCTS:
+    IMAGES.setdefault(sample["category"], []).append(sample["image"])
+
+ORDER_STATUSES = ["pending", "processing", "shipped", "delivered", "delivered", "delivered", "cancelled"]
+HISTORY = timedelta(days=730)
+
+
+def product_id(i: int) -> str:
+    return str(uuid.uuid5(NAMESPACE, f"product-{i}"))
+
+
+def user_id(i: int) -> str:
+    return str(uuid.uuid5(NAMESPACE, f"user-{i}"))
+
+
+def synthetic_product(i: int, seed: int, now: datetime) -> dict:
+    rng = random.Random(seed * 1_000_003 + i)
+    category = CATEGORIES[rng.randrange(len(CATEGORIES))]
+    adjectives, nouns, (low, high) = CATALOG[category]
+    adjective, noun = rng.choice(adjectives), rng.choice(nouns)
+    # Prices cluster at the low end like a real catalog
+    price = round(low + (high - low) * rng.random() ** 3, 2)
+    return {
+        "id": product_id(i),
+        "name": f"{adjective} {noun} {i}",
+        "description": f"{adjective} {noun.lower()} from our {category.lower()} range, "
+                       f"{rng.choice(['best seller', 'new arrival', 'limited edition', 'customer favourite'])}",
+        "price": price,
+        "category": category,
+        "image": rng.choice(IMAGES.get(category) or IMAGES["Electronics"]),
+        "stock": rng.randint(0, 500),
+        "created_at": now - HISTORY * rng.random(),
+    }
+
+
+def popular_index(rng: random.Random, count: int) -> int:
+    # Skewed popularity: a small share of products gets most of the orders
+    return min(int(count * rng.random() ** 4), count - 1)
+
+
+def synthetic_items(rng: random.Random, products: int, seed: int, now: datetime) -> list:
+    items = {}
+    for _ in range(rng.randint(1, 5)):
+        product = synthetic_product(popular_index(rng, products), seed, now)
+        line = items.setdefault(product["id"], {"product_id": product["id"], "quantity": 0, "price": product["price"]})
+        line["quantity"] += rng.randint(1, 3)
+    return list(items.values())
+
+
+async def insert_batches(collection, count: int, build, batch_size: int):
+    started = time.monotonic()
+    batch = []
+    for i in range(count):
+        batch.append(build(i))
+        if len(batch) >= batch_size:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+            if (i + 1) % (batch_size * 20) == 0:
+                rate = (i + 1) / (time.monotonic() - started)
+                print(f"  {collection.name}: {i + 1}/{count} ({rate:.0f} docs/s)")
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+    print(f"Generated {count} {collection.name} in {time.monotonic() - started:.1f}s")
+
+
+async def generate(db, args):
+    from passlib.context import CryptContext
+
+    now = datetime.now(timezone.utc)
+    if args.drop:
+        for name in ("products", "users", "carts", "orders"):
+            await db[name].drop()
+
+    # One hash shared by every synthetic user: bcrypt per user would dominate the run
+    password_hash = CryptContext(schemes=["bcrypt"]).hash(args.password)
+
+    await insert_batches(db.products, args.products, lambda i: synthetic_product(i, args.seed, now), args.batch_size)
+
+    def user(i):
+        return {
+            "id": user_id(i),
+            "email": f"user{i}@example.com",
+            "password_hash": password_hash,
+            "role": "customer",
+            "created_at": now - HISTORY * random.Random(args.seed + i).random(),
+        }
+
+    await insert_batches(db.users, args.users, user, args.batch_size)
+
+    def cart(i):
+        rng = random.Random(args.seed * 7 + i)
+        return {
+            "id": str(uuid.uuid5(NAMESPACE, f"cart-{i}")),
+            "user_id": user_id(i),
+            "items": synthetic_items(rng, args.products, args.seed, now),
+            "updated_at": now - timedelta(days=30) * rng.random(),
+        }
+
+    # One cart per user, so carts are capped by the number of users
+    await insert_batches(db.carts, min(args.carts, args.users), cart, args.batch_size)
+
+    def order(i):
+        rng = random.Random(args.seed * 13 + i)
+        u = rng.randrange(args.users)
+        items = synthetic_items(rng, args.products, args.seed, now)
+        return {
+            "id": str(uuid.uuid5(NAMESPACE, f"order-{i}")),
+            "user_id": user_id(u),
+            "user_email": f"user{u}@example.com",
+            "items": items,
+            "total": round(sum(item["price"] * item["quantity"] for item in items), 2),
+            "status": rng.choice(ORDER_STATUSES),
+            "payment_method": "stripe",
+            "payment_id": None,
+            "created_at": now - HISTORY * rng.random(),
+        }
+
+    if args.orders and args.users:
+        await insert_batches(db.orders, args.orders, order, args.batch_size)
+        print("Run `python backend/rollups.py rebuild` to refresh the admin statistics")
+
+
 async def seed_products():
     client = AsyncIOMotorClient("mongodb://localhost:27017")
     db = client["ecommerce_db"]
@@ -180,5 +335,27 @@ async def seed_products():
     print(f"Successfully seeded {len(SAMPLE_PRODUCTS)} products!")
     client.close()
 
+
+async def generate_dataset(args):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    await generate(client[os.environ.get("DB_NAME", "ecommerce_db")], args)
+    client.close()
+
+
 if __name__ == "__main__":
-    asyncio.run(seed_products())
+    parser = argparse.ArgumentParser(description="Seed the sample catalog or generate a production-scale dataset")
+    parser.add_argument("--generate", action="store_true", help="generate synthetic data instead of the sample catalog")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--carts", type=int, default=5_000)
+    parser.add_argument("--orders", type=int, default=50_000)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="password123", help="password for every synthetic user")
+    parser.add_argument("--drop", action="store_true", help="drop products, users, carts and orders first")
+    args = parser.parse_args()
+
+    if args.generate:
+        asyncio.run(generate_dataset(args))
+    else:
+        asyncio.run(seed_products())
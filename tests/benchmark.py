@@ -0,0 +1,542 @@
+"""Endpoint benchmark for backend/server.py.
+
+Drives scripted user journeys (browse, search, cart, order, payment and webhook)
+against the app and reports throughput and p50/p95/p99 latency per route.
+Stripe is replaced by an in-process fake so payment journeys never leave the
+machine.
+
+    # in-process over the ASGI transport, against a local mongod
+    python tests/benchmark.py --mode asgi --concurrency 20 --duration 30
+
+    # real uvicorn workers
+    python tests/benchmark.py --mode uvicorn --workers 4 --concurrency 100
+
+    # in-memory Motor stand-in (pip install mongomock-motor), ASGI mode only;
+    # see use_memory_backend for the endpoints it covers
+    python tests/benchmark.py --backend memory --products 2000 --users 200
+
+    # record a baseline, then gate later runs on it
+    python tests/benchmark.py --save-baseline
+    python tests/benchmark.py --tolerance 0.2
+
+The dataset is generated with scripts/seed_products.py into a separate
+database (DB_NAME, default ecommerce_bench) and dropped first unless
+--no-seed is given.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "benchmark_baseline.json"
+sys.path[:0] = [str(ROOT_DIR / "backend"), str(ROOT_DIR / "scripts")]
+
+# Journey name -> relative weight in the default mix
+JOURNEYS = {"browse": 50, "search": 25, "cart": 15, "order": 5, "payment": 5}
+SEARCH_TERMS = ["wireless", "leather", "yoga", "lamp", "headphones", "smart", "ceramic", "jacket", "watch", "bench"]
+PAGE_SIZE = 24
+
+
+def configure_environment(args):
+    # server.py reads its configuration at import time and load_dotenv never
+    # overrides variables that are already set
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("WEBHOOK_WORKERS", "1")
+    # Every virtual user shares one IP; measure the app, not the limiter
+    os.environ.setdefault("RATE_LIMITS", "off")
+    os.environ.setdefault("SHED_MAX_IN_FLIGHT", "0")
+    os.environ.setdefault("SHED_MAX_LOOP_LAG_SECONDS", "0")
+    if args.backend == "memory":
+        os.environ["ORDER_TRANSACTIONS"] = "off"
+        os.environ["INDEX_SELF_CHECK"] = "false"
+        # mongomock doesn't evaluate update pipelines, which the mongo cart store relies on
+        os.environ["CART_STORE"] = "memory"
+
+
+# Fake Stripe checkout backend
+
+def _fake_models():
+    from pydantic import BaseModel
+
+    class FakeSession(BaseModel):
+        session_id: str
+        url: str
+
+    class FakeStatus(BaseModel):
+        status: str
+        payment_status: str
+        amount_total: int
+        currency: str
+        metadata: dict = {}
+
+    return FakeSession, FakeStatus
+
+
+def _fake_webhook_model():
+    from pydantic import BaseModel
+
+    class FakeWebhook(BaseModel):
+        event_type: str
+        event_id: str
+        session_id: str
+        payment_status: str = None
+        metadata: dict = {}
+
+    return FakeWebhook
+
+
+class FakeCheckout:
+    """Stands in for StripeCheckout with a fixed upstream latency.
+
+    A session reports "unpaid" on the first status poll and "paid" after
+    that, or as soon as a webhook for it arrives, so the payment journey
+    exercises both the pending and the terminal branch of the status
+    endpoint. Webhook bodies are Stripe-shaped checkout.session.completed
+    events signed with sign(); each uvicorn worker has its own session
+    store, so a webhook for a session another worker created is still
+    accepted.
+    """
+
+    SECRET = b"whsec_benchmark"
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.polls = defaultdict(int)
+        self.sessions = {}  # session_id -> {"amount_total", "metadata", "paid"}
+        self.session_model, self.status_model = _fake_models()
+        self.webhook_model = _fake_webhook_model()
+
+    @classmethod
+    def sign(cls, body: bytes) -> str:
+        return hmac.new(cls.SECRET, body, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def webhook_body(session_id: str) -> bytes:
+        return json.dumps({
+            "id": f"evt_{uuid.uuid4().hex}",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": session_id, "payment_status": "paid", "metadata": {}}},
+        }).encode()
+
+    async def create_checkout_session(self, checkout_request):
+        await asyncio.sleep(self.latency)
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            "amount_total": int(round(checkout_request.amount * 100)),
+            "metadata": dict(checkout_request.metadata or {}),
+            "paid": False,
+        }
+        return self.session_model(session_id=session_id, url=f"https://checkout.example.com/{session_id}")
+
+    async def get_checkout_status(self, session_id: str):
+        await asyncio.sleep(self.latency)
+        self.polls[session_id] += 1
+        session = self.sessions.get(session_id, {})
+        paid = session.get("paid") or self.polls[session_id] > 1
+        return self.status_model(
+            status="complete" if paid else "open",
+            payment_status="paid" if paid else "unpaid",
+            amount_total=session.get("amount_total", 0),
+            currency="usd",
+            metadata=session.get("metadata", {}),
+        )
+
+    async def handle_webhook(self, body: bytes, signature: str):
+        if not signature or not hmac.compare_digest(signature, self.sign(body)):
+            raise ValueError("Invalid webhook signature")
+        event = json.loads(body)
+        checkout = event["data"]["object"]
+        session = self.sessions.get(checkout["id"])
+        if session is not None and checkout.get("payment_status") == "paid":
+            session["paid"] = True
+        return self.webhook_model(
+            event_type=event["type"],
+            event_id=event["id"],
+            session_id=checkout["id"],
+            payment_status=checkout.get("payment_status"),
+            metadata=session["metadata"] if session else checkout.get("metadata", {}),
+        )
+
+
+def create_app():
+    """uvicorn factory: the real app with the fake Stripe backend installed."""
+    import server
+
+    server.payment_client.backend = FakeCheckout(float(os.environ.get("BENCH_STRIPE_LATENCY", "0.05")))
+    return server.app
+
+
+def use_memory_backend(server):
+    """Points the app at an in-memory mongomock database.
+
+    Covers every journey in JOURNEYS: catalog reads and search, the cart
+    endpoints (through CART_STORE=memory), order creation, checkout
+    sessions, status polls and webhooks. Admin product writes are not
+    covered, since set_on_hand() is an update pipeline mongomock can't run,
+    and neither is /api/admin/stats. The startup rollup and recommendation
+    rebuilds log a failure because mongomock has no $unionWith; the
+    journeys don't depend on them.
+    """
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("--backend memory needs mongomock-motor (pip install mongomock-motor)")
+    server.database = server.Database(AsyncMongoMockClient(), server.database.settings)
+    server.client, server.db = server.database.client, server.database.primary
+    # Components that were handed the database at import time
+    server.cart_store.collection = server.db.carts
+    server.lifecycle_sweeper.db = server.db
+    server.idempotency_store.collection = server.db[server.idempotency_store.collection.name]
+
+    # mongomock has no sessions; the order write is the same without one
+    async def insert_order_and_clear_cart(doc: dict, user_id: str):
+        await server.db.orders.insert_one(doc)
+        await server.db.carts.delete_one({"user_id": user_id})
+        await server.rollups.record_order(server.db, doc)
+
+    server.insert_order_and_clear_cart = insert_order_and_clear_cart
+    return server.db
+
+
+# Dataset
+
+async def seed(db, args):
+    import seed_products
+
+    options = argparse.Namespace(
+        products=args.products, users=args.users, carts=0, orders=args.orders,
+        batch_size=2000, seed=args.seed, password=args.password, drop=True,
+    )
+    await seed_products.generate(db, options)
+
+
+async def sample_product_ids(db, count: int) -> list:
+    cursor = db.products.find({"stock": {"$gt": 0}}, {"_id": 0, "id": 1, "price": 1, "category": 1}).limit(count)
+    return await cursor.to_list(count)
+
+
+# Load generation
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route: str, elapsed: float, ok: bool):
+        self.latencies[route].append(elapsed)
+        if not ok:
+            self.errors[route] += 1
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class VirtualUser:
+    def __init__(self, http, recorder: Recorder, rng: random.Random, token: str, products: list):
+        self.http = http
+        self.recorder = recorder
+        self.rng = rng
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.products = products
+
+    async def request(self, method: str, route: str, url: str, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            headers = {**self.headers, **kwargs.pop("headers", {})}
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+            ok = response.status_code in expected
+        except Exception:
+            response, ok = None, False
+        self.recorder.record(route, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    async def browse(self):
+        await self.request("GET", "GET /api/products", "/api/products", params={"limit": PAGE_SIZE})
+        product = self.rng.choice(self.products)
+        await self.request("GET", "GET /api/products?category", "/api/products",
+                           params={"category": product['category'], "limit": PAGE_SIZE})
+        await self.request("GET", "GET /api/products/{id}", f"/api/products/{product['id']}")
+
+    async def search(self):
+        await self.request("GET", "GET /api/products?search", "/api/products",
+                           params={"search": self.rng.choice(SEARCH_TERMS), "limit": PAGE_SIZE})
+
+    async def add_to_cart(self):
+        product = self.rng.choice(self.products)
+        await self.request("POST", "POST /api/cart/add", "/api/cart/add",
+                           json={"product_id": product['id'], "quantity": 1, "price": product['price']})
+
+    async def cart(self):
+        await self.add_to_cart()
+        await self.request("GET", "GET /api/cart", "/api/cart")
+
+    async def order(self):
+        await self.add_to_cart()
+        # 409 is a legitimate outcome once the generated stock runs out
+        await self.request("POST", "POST /api/orders/create", "/api/orders/create",
+                           expected=(200, 409), params={"payment_method": "stripe"})
+
+    async def payment(self):
+        await self.add_to_cart()
+        response = await self.request("POST", "POST /api/orders/create", "/api/orders/create",
+                                      expected=(200, 409), params={"payment_method": "stripe"})
+        if response is None or response.status_code != 200:
+            return
+        response = await self.request("POST", "POST /api/payments/stripe/create-session",
+                                      "/api/payments/stripe/create-session",
+                                      params={"order_id": response.json()['id'], "origin_url": "http://localhost:3000"})
+        if response is None:
+            return
+        session_id = response.json()['session_id']
+        # Half the sessions are settled by the webhook, the rest by polling
+        if self.rng.random() < 0.5:
+            body = FakeCheckout.webhook_body(session_id)
+            await self.request("POST", "POST /api/webhook/stripe", "/api/webhook/stripe", content=body,
+                               headers={"Stripe-Signature": FakeCheckout.sign(body)})
+        for _ in range(2):
+            await self.request("GET", "GET /api/payments/stripe/status/{id}", f"/api/payments/stripe/status/{session_id}")
+
+    async def run(self, journeys: list, weights: list, deadline: float, iterations: int):
+        done = 0
+        while time.monotonic() < deadline and (not iterations or done < iterations):
+            await getattr(self, self.rng.choices(journeys, weights)[0])()
+            done += 1
+
+
+async def login_all(http, count: int, password: str) -> list:
+    tokens = []
+    for i in range(count):
+        response = await http.post("/api/auth/login", json={"email": f"user{i}@example.com", "password": password})
+        response.raise_for_status()
+        tokens.append(response.json()['token'])
+    return tokens
+
+
+async def drive(http, args, products: list) -> dict:
+    journeys = [j for j in args.journeys.split(",") if j]
+    unknown = set(journeys) - set(JOURNEYS)
+    if unknown:
+        sys.exit(f"Unknown journeys: {', '.join(sorted(unknown))}")
+    weights = [JOURNEYS[j] for j in journeys]
+
+    tokens = await login_all(http, min(args.concurrency, args.users), args.password)
+    recorder = Recorder()
+    users = [
+        VirtualUser(http, recorder, random.Random(args.seed + i), tokens[i % len(tokens)], products)
+        for i in range(args.concurrency)
+    ]
+
+    if args.warmup:
+        warmup = time.monotonic() + args.warmup
+        await asyncio.gather(*(u.run(journeys, weights, warmup, 0) for u in users))
+        recorder.latencies.clear()
+        recorder.errors.clear()
+
+    started = time.monotonic()
+    await asyncio.gather(*(u.run(journeys, weights, started + args.duration, args.iterations) for u in users))
+    return summarize(recorder, time.monotonic() - started, args)
+
+
+def summarize(recorder: Recorder, elapsed: float, args) -> dict:
+    routes = {}
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        routes[route] = {
+            "requests": len(values),
+            "errors": recorder.errors[route],
+            "throughput": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "config": {
+            "mode": args.mode, "backend": args.backend, "workers": args.workers, "concurrency": args.concurrency,
+            "products": args.products, "users": args.users, "orders": args.orders, "journeys": args.journeys,
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(r["errors"] for r in routes.values()),
+        "throughput": round(total / elapsed, 2) if elapsed else 0,
+        "routes": routes,
+    }
+
+
+# Modes
+
+async def run_asgi(args) -> dict:
+    import httpx
+    import server
+
+    db = server.db if args.backend == "mongo" else use_memory_backend(server)
+    server.payment_client.backend = FakeCheckout(args.stripe_latency)
+    if not args.no_seed:
+        await seed(db, args)
+
+    # ASGITransport does not send lifespan events, so run startup/shutdown here
+    await server.app.router.startup()
+    try:
+        while not server.search_index.ready:
+            await asyncio.sleep(0.1)
+        products = await sample_product_ids(db, 1000)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as http:
+            return await drive(http, args, products)
+    finally:
+        await server.app.router.shutdown()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_until_up(http, process, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"uvicorn exited with code {process.returncode}")
+        try:
+            if (await http.get("/api/products", params={"limit": 1})).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    sys.exit("uvicorn did not become ready in time")
+
+
+async def run_uvicorn(args) -> dict:
+    import httpx
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = mongo[os.environ["DB_NAME"]]
+    if not args.no_seed:
+        await seed(db, args)
+    products = await sample_product_ids(db, 1000)
+    mongo.close()
+
+    port = _free_port()
+    env = {**os.environ, "BENCH_STRIPE_LATENCY": str(args.stripe_latency)}
+    process = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "benchmark:create_app", "--factory",
+        "--app-dir", str(Path(__file__).resolve().parent),
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning",
+    ], cwd=ROOT_DIR / "backend", env=env)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits) as http:
+            await _wait_until_up(http, process)
+            return await drive(http, args, products)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+# Reporting
+
+def print_report(result: dict):
+    print(f"\n{result['requests']} requests in {result['elapsed_seconds']}s "
+          f"({result['throughput']} req/s, {result['errors']} errors)\n")
+    print(f"{'route':<48}{'reqs':>8}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for route, r in result["routes"].items():
+        print(f"{route:<48}{r['requests']:>8}{r['errors']:>6}{r['throughput']:>9}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float, max_error_rate: float) -> list:
+    """Returns one message per regression against the baseline."""
+    regressions = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput']} req/s < baseline {baseline['throughput']} req/s")
+    for route, base in baseline["routes"].items():
+        current = result["routes"].get(route)
+        if current is None:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{route}: {key} {current[key]} > baseline {base[key]}")
+        if current["requests"] and current["errors"] / current["requests"] > max_error_rate:
+            regressions.append(f"{route}: {current['errors']}/{current['requests']} requests failed")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run")
+    parser.add_argument("--iterations", type=int, default=0, help="journeys per virtual user (0 = until --duration)")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unmeasured load first")
+    parser.add_argument("--journeys", default=",".join(JOURNEYS), help="comma separated subset of " + ", ".join(JOURNEYS))
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the dataset already in DB_NAME")
+    parser.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", "ecommerce_bench"))
+    parser.add_argument("--stripe-latency", type=float, default=0.05, help="seconds per fake Stripe call")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="write the JSON result here")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before failing")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    if args.backend == "memory" and args.mode != "asgi":
+        parser.error("--backend memory only works with --mode asgi (each uvicorn worker would get its own data)")
+    configure_environment(args)
+
+    result = asyncio.run(run_asgi(args) if args.mode == "asgi" else run_uvicorn(args))
+    print_report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"\nBaseline written to {baseline_path}")
+        return
+    if not baseline_path.exists():
+        print(f"\nNo baseline at {baseline_path}, run with --save-baseline to create one")
+        return
+
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get("config") != result["config"]:
+        print("\nWarning: baseline was recorded with a different configuration")
+    regressions = compare(result, baseline, args.tolerance, args.max_error_rate)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+import httpx
+import pytest
+
+# The backend modules import each other as top-level modules, as they do when
+# uvicorn runs server.py from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from tests.fake_mongo import FakeClient, FakeDatabase  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase()
+
+
+@pytest.fixture
+async def server(db, monkeypatch):
+    """backend/server.py with its Mongo handles on `db` and fresh per-worker state.
+
+    The startup hook is not run: no indexes, background loops or webhook
+    workers. Rate limiting and shedding are off.
+    """
+    pytest.importorskip("emergentintegrations")
+    # server.py reads its configuration at import time
+    for name, value in (("MONGO_URL", "mongodb://localhost:27017"), ("DB_NAME", "test_database")):
+        if name not in os.environ:
+            monkeypatch.setenv(name, value)
+    import server
+    from auth_cache import UserCache
+    from broadcast import create_broadcast
+    from cart_store import create_cart_store
+    from catalog_cache import CatalogCache
+    from database import Database, DatabaseSettings
+    from events import EventHub
+    from idempotency import IdempotencyStore
+    from pricing import PriceBook
+    from search import ProductSearchIndex
+    from webhooks import WebhookWorkerPool
+
+    database = Database(FakeClient(db), DatabaseSettings("mongodb://fake", "test_database"))
+    broadcast = create_broadcast("local")
+    broadcast.subscribe("catalog", server.on_catalog_change)
+    broadcast.subscribe("auth", server.on_auth_change)
+    broadcast.subscribe("events", server.on_event)
+    for name, value in {
+        "database": database, "client": database.client, "db": db, "broadcast": broadcast,
+        "catalog_cache": CatalogCache(), "user_cache": UserCache(), "price_book": PriceBook(),
+        "search_index": ProductSearchIndex(), "cart_store": create_cart_store("mongo", db.carts),
+        "idempotency_store": IdempotencyStore(db), "event_hub": EventHub(),
+        "webhook_workers": WebhookWorkerPool(db, server.apply_webhook_events), "transactions_enabled": False,
+    }.items():
+        monkeypatch.setattr(server, name, value)
+    monkeypatch.setattr(server.rate_limiter, "limits", {})
+    monkeypatch.setattr(server.rate_limiter, "max_in_flight", 0)
+    monkeypatch.setattr(server.rate_limiter, "max_loop_lag", 0)
+    yield server
+    await asyncio.gather(*server.background_tasks, return_exceptions=True)
+
+
+@pytest.fixture
+async def api(server):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def _sign_up(server, db, email: str, role: str) -> dict:
+    user = {"id": f"{role}-1", "email": email, "role": role, "password_hash": "x"}
+    await db.users.insert_one(dict(user))
+    token = server.create_access_token(server.token_claims(user))
+    return {**user, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+@pytest.fixture
+async def customer(server, db):
+    return await _sign_up(server, db, "customer@example.com", "customer")
+
+
+@pytest.fixture
+async def admin(server, db):
+    return await _sign_up(server, db, "admin@example.com", "admin")
@@ -0,0 +1,548 @@
+"""In-memory stand-in for the slice of the Motor API the backend modules use.
+
+Enough of MongoDB's query and update language to exercise inventory,
+idempotency, webhooks, pagination, lifecycle, cart and lock code without a
+mongod: equality and $in/$nin/$gt/$gte/$lt/$lte/$ne/$exists/$type/$or/$and
+filters on dotted paths, $set/$unset/$inc/$max/$min/$setOnInsert/$pull
+updates with upserts and arrayFilters, $set stages of update pipelines with
+the handful of expressions the cart code uses, sorting in BSON type order,
+and unique indexes (checked on insert, which covers upserts). Documents are deep-copied on the way in and out, as they
+would be over the wire. Sessions are accepted and ignored: every operation
+is applied immediately, and FakeClient hands out sessions whose
+transactions just run the callback.
+"""
+import copy
+from datetime import datetime
+from types import SimpleNamespace
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+
+def _set(doc: dict, path: str, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc: dict, path: str):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+def _type_order(value) -> int:
+    # BSON comparison order of the types the backend stores
+    if value is _MISSING or value is None:
+        return 0
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, datetime):
+        return 6
+    return 4
+
+
+def sort_key(value):
+    if value is _MISSING or value is None:
+        return (0, 0)
+    return (_type_order(value), value)
+
+
+def _type_name(value) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return "null" if value is None else "unknown"
+
+
+def _compare(value, op: str, operand) -> bool:
+    # Range operators only match values of the same BSON type
+    if value is _MISSING or _type_order(value) != _type_order(operand):
+        return False
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    if op == "$lt":
+        return value < operand
+    return value <= operand
+
+
+def _equals(value, operand) -> bool:
+    if value is _MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def _match_operators(value, spec: dict) -> bool:
+    for op, operand in spec.items():
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = _compare(value, op, operand)
+        elif op == "$in":
+            ok = any(_equals(value, o) for o in operand)
+        elif op == "$nin":
+            ok = not any(_equals(value, o) for o in operand)
+        elif op == "$ne":
+            ok = not _equals(value, operand)
+        elif op == "$eq":
+            ok = _equals(value, operand)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(operand)
+        elif op == "$type":
+            ok = value is not _MISSING and _type_name(value) == operand
+        else:
+            raise NotImplementedError(f"Query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, spec in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in spec):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in spec):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"Query operator {key}")
+        elif isinstance(spec, dict) and spec and all(k.startswith("$") for k in spec):
+            if not _match_operators(_get(doc, key), spec):
+                return False
+        elif not _equals(_get(doc, key), spec):
+            return False
+    return True
+
+
+def _project(doc: dict, projection) -> dict:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        projected = {}
+        for path in include:
+            value = _get(doc, path)
+            if value is not _MISSING:
+                _set(projected, path, value)
+        if projection.get("_id", 1) and "_id" in doc:
+            projected["_id"] = doc["_id"]
+        return projected
+    for path, keep in projection.items():
+        if not keep:
+            _unset(doc, path)
+    return doc
+
+
+def _path_value(value, path: str):
+    # Aggregation field paths reach through arrays: "$items.product_id" is every line's id
+    for part in path.split("."):
+        if isinstance(value, list):
+            value = [v[part] for v in value if isinstance(v, dict) and part in v]
+        elif isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _evaluate(expr, doc: dict, variables: dict):
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, path = expr[2:].partition(".")
+        return _path_value(variables[name], path) if path else variables[name]
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _path_value(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_evaluate(e, doc, variables) for e in expr]
+    if isinstance(expr, dict) and len(expr) == 1 and next(iter(expr)).startswith("$"):
+        op, args = next(iter(expr.items()))
+        return _operator(op, args, doc, variables)
+    if isinstance(expr, dict):
+        return {k: _evaluate(v, doc, variables) for k, v in expr.items()}
+    return expr
+
+
+def _operator(op: str, args, doc: dict, variables: dict):
+    if op == "$literal":
+        return args
+    if op == "$map":
+        items = _evaluate(args["input"], doc, variables)
+        name = args.get("as", "this")
+        return [_evaluate(args["in"], doc, {**variables, name: item}) for item in items]
+    values = [_evaluate(a, doc, variables) for a in (args if isinstance(args, list) else [args])]
+    if op == "$ifNull":
+        return next((v for v in values if v is not _MISSING and v is not None), None)
+    if op == "$cond":
+        return values[1] if values[0] else values[2]
+    if op == "$in":
+        return values[0] in values[1]
+    if op == "$eq":
+        return values[0] == values[1]
+    if op == "$add":
+        return sum(values)
+    if op == "$min":
+        return min((v for v in values if v is not _MISSING and v is not None), default=None)
+    if op == "$mergeObjects":
+        return {k: v for value in values for k, v in value.items()}
+    if op == "$concatArrays":
+        return [item for value in values for item in value]
+    raise NotImplementedError(f"Expression operator {op}")
+
+
+def _apply_pipeline(doc: dict, pipeline: list):
+    for stage in pipeline:
+        (op, fields), = stage.items()
+        if op not in ("$set", "$addFields"):
+            raise NotImplementedError(f"Pipeline stage {op}")
+        # Every expression in a stage sees the document as it was before it
+        values = {path: _evaluate(expr, doc, {}) for path, expr in fields.items()}
+        for path, value in values.items():
+            if value is _MISSING:
+                _unset(doc, path)
+            else:
+                _set(doc, path, copy.deepcopy(value))
+
+
+def _set_filtered(doc, parts: list, value, array_filters: list):
+    # $set through "$[name]" placeholders, e.g. items.$[line].quantity
+    part, rest = parts[0], parts[1:]
+    if part.startswith("$[") and part.endswith("]"):
+        prefix = part[2:-1] + "."
+        condition = {k[len(prefix):]: v for f in array_filters for k, v in f.items() if k.startswith(prefix)}
+        targets = [item for item in doc if matches(item, condition)]
+    else:
+        if not rest:
+            doc[part] = copy.deepcopy(value)
+            return
+        targets = [doc.setdefault(part, {})]
+    for target in targets:
+        if rest:
+            _set_filtered(target, rest, value, array_filters)
+
+
+def _pull(doc: dict, path: str, condition):
+    current = _get(doc, path)
+    if not isinstance(current, list):
+        return
+    if isinstance(condition, dict):
+        kept = [item for item in current if not (isinstance(item, dict) and matches(item, condition))]
+    else:
+        kept = [item for item in current if item != condition]
+    _set(doc, path, kept)
+
+
+def _apply_update(doc: dict, update, inserting: bool = False, array_filters: list = None):
+    if isinstance(update, list):
+        _apply_pipeline(doc, update)
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = _get(doc, path)
+            if op == "$set" and "$[" in path:
+                _set_filtered(doc, path.split("."), value, array_filters or [])
+            elif op == "$set":
+                _set(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$max":
+                if current is _MISSING or sort_key(value) > sort_key(current):
+                    _set(doc, path, value)
+            elif op == "$min":
+                if current is _MISSING or sort_key(value) < sort_key(current):
+                    _set(doc, path, value)
+            elif op == "$pull":
+                _pull(doc, path, value)
+            else:
+                raise NotImplementedError(f"Update operator {op}")
+
+
+def _upsert_seed(query: dict) -> dict:
+    # An upsert starts from the filter's equality fields
+    seed = {}
+    for key, spec in query.items():
+        if key.startswith("$") or (isinstance(spec, dict) and any(k.startswith("$") for k in spec)):
+            continue
+        _set(seed, key, copy.deepcopy(spec))
+    return seed
+
+
+class FakeCursor:
+    def __init__(self, docs: list, projection):
+        self._docs = docs
+        self._projection = projection
+        self._sort = []
+        self._limit = 0
+
+    def sort(self, key, direction=None):
+        self._sort = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def _results(self) -> list:
+        docs = list(self._docs)
+        for field, direction in reversed(self._sort):
+            docs.sort(key=lambda d: sort_key(_get(d, field)), reverse=direction < 0)
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    async def to_list(self, length=None):
+        docs = self._results()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self.docs = []
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self._next_id = 0
+
+    def _insert(self, doc: dict):
+        doc = copy.deepcopy(doc)
+        if "_id" not in doc:
+            self._next_id += 1
+            doc["_id"] = f"{self.name}-{self._next_id}"
+        for name, spec in self.indexes.items():
+            if name != "_id_" and not spec.get("unique"):
+                continue
+            key = [_get(doc, field) for field, _ in spec["key"]]
+            if any([_get(d, field) for field, _ in spec["key"]] == key for d in self.docs):
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}",
+                                        code=11000)
+        self.docs.append(doc)
+        return doc["_id"]
+
+    def _matching(self, query: dict) -> list:
+        return [d for d in self.docs if matches(d, query or {})]
+
+    def find(self, query: dict = None, projection: dict = None, session=None) -> FakeCursor:
+        return FakeCursor(self._matching(query), projection)
+
+    async def find_one(self, query: dict = None, projection: dict = None, session=None):
+        found = self._matching(query)
+        return _project(found[0], projection) if found else None
+
+    async def count_documents(self, query: dict, session=None) -> int:
+        return len(self._matching(query))
+
+    async def insert_one(self, doc: dict, session=None):
+        return SimpleNamespace(inserted_id=self._insert(doc))
+
+    async def insert_many(self, docs: list, ordered: bool = True, session=None):
+        return SimpleNamespace(inserted_ids=[self._insert(d) for d in docs])
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool):
+        found = self._matching(query)
+        if not many:
+            found = found[:1]
+        modified = 0
+        for doc in found:
+            before = copy.deepcopy(doc)
+            _apply_update(doc, update)
+            modified += doc != before
+        upserted_id = None
+        if not found and upsert:
+            doc = _upsert_seed(query)
+            _apply_update(doc, update, inserting=True)
+            upserted_id = self._insert(doc)
+        return SimpleNamespace(matched_count=len(found), modified_count=modified, upserted_id=upserted_id)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False, session=None):
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False, session=None):
+        return self._update(query, update, upsert, many=True)
+
+    def _replace(self, query: dict, replacement: dict, upsert: bool):
+        found = self._matching(query)[:1]
+        if found:
+            replacement = {**copy.deepcopy(replacement), "_id": found[0]["_id"]}
+            self.docs[self.docs.index(found[0])] = replacement
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0,
+                                   upserted_id=self._insert({**_upsert_seed(query), **replacement}))
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False, session=None):
+        return self._replace(query, replacement, upsert)
+
+    async def find_one_and_update(self, query: dict, update, projection: dict = None,
+                                  return_document: bool = False, upsert: bool = False, array_filters: list = None,
+                                  session=None):
+        found = self._matching(query)[:1]
+        if found:
+            before = _project(found[0], projection)
+            _apply_update(found[0], update, array_filters=array_filters)
+            return _project(found[0], projection) if return_document else before
+        if upsert:
+            doc = _upsert_seed(query)
+            _apply_update(doc, update, inserting=True)
+            self._insert(doc)
+            return _project(doc, projection) if return_document else None
+        return None
+
+    def _delete(self, query: dict, many: bool) -> int:
+        found = self._matching(query)
+        if not many:
+            found = found[:1]
+        self.docs = [d for d in self.docs if not any(d is f for f in found)]
+        return len(found)
+
+    async def delete_one(self, query: dict, session=None):
+        return SimpleNamespace(deleted_count=self._delete(query, many=False))
+
+    async def delete_many(self, query: dict, session=None):
+        return SimpleNamespace(deleted_count=self._delete(query, many=True))
+
+    async def bulk_write(self, requests: list, ordered: bool = True, session=None):
+        result = SimpleNamespace(matched_count=0, modified_count=0, upserted_count=0, inserted_count=0,
+                                 deleted_count=0)
+        write_errors = []
+        for index, request in enumerate(requests):
+            try:
+                self._bulk_op(request, result)
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        result.bulk_api_result = {
+            "writeErrors": write_errors, "nInserted": result.inserted_count, "nUpserted": result.upserted_count,
+            "nMatched": result.matched_count, "nModified": result.modified_count, "nRemoved": result.deleted_count,
+        }
+        if write_errors:
+            raise BulkWriteError(result.bulk_api_result)
+        return result
+
+    def _bulk_op(self, request, result):
+        # pymongo keeps the operation's arguments in private slots
+        if isinstance(request, InsertOne):
+            self._insert(request._doc)
+            result.inserted_count += 1
+            return
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            result.deleted_count += self._delete(request._filter, many=isinstance(request, DeleteMany))
+            return
+        if isinstance(request, ReplaceOne):
+            outcome = self._replace(request._filter, request._doc, request._upsert)
+        elif isinstance(request, (UpdateOne, UpdateMany)):
+            outcome = self._update(request._filter, request._doc, request._upsert, many=isinstance(request, UpdateMany))
+        else:
+            raise NotImplementedError(type(request).__name__)
+        result.matched_count += outcome.matched_count
+        result.modified_count += outcome.modified_count
+        result.upserted_count += outcome.upserted_id is not None
+
+    async def index_information(self) -> dict:
+        return copy.deepcopy(self.indexes)
+
+    async def create_index(self, keys: list, name: str, **options):
+        self.indexes[name] = {"key": list(keys), **options}
+        return name
+
+    async def drop_index(self, name: str):
+        del self.indexes[name]
+
+    async def rename(self, new_name: str, dropTarget: bool = False, session=None):
+        collections = self.database._collections
+        if new_name in collections and not dropTarget:
+            raise NotImplementedError("rename onto an existing collection")
+        collections.pop(self.name, None)
+        self.name = new_name
+        collections[new_name] = self
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name: str, collection: str, index: dict = None, **kwargs):
+        if name != "collMod" or index is None:
+            raise NotImplementedError(name)
+        self[collection].indexes[index["name"]]["expireAfterSeconds"] = index["expireAfterSeconds"]
+        return {"ok": 1}
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        return await callback(self)
+
+
+class FakeClient:
+    """A client whose every database name resolves to the same FakeDatabase."""
+
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        return self.database
+
+    def get_database(self, name: str, **options) -> FakeDatabase:
+        return self.database
+
+    async def start_session(self) -> FakeSession:
+        return FakeSession()
@@ -0,0 +1,37 @@
+import pytest
+import auth_cache
+from auth_cache import UserCache
+
+
+def test_users_expire_and_are_lru_bounded(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(auth_cache.time, "monotonic", lambda: clock[0])
+    cache = UserCache(ttl_seconds=10, max_entries=2)
+    for user_id in ("u1", "u2", "u3"):
+        cache.set(user_id, {"id": user_id})
+
+    assert cache.get("u1") is None
+    assert cache.get("u2") == {"id": "u2"}
+    clock[0] = 11
+    assert cache.get("u2") is None
+
+
+def test_revocation_drops_the_user_and_rejects_older_epochs():
+    cache = UserCache()
+    cache.set("u1", {"id": "u1"})
+
+    cache.revoke("u1", 3)
+    cache.revoke("u1", 2)  # a late, older bump never lowers the floor
+
+    assert cache.get("u1") is None
+    assert cache.is_revoked("u1", 2)
+    assert not cache.is_revoked("u1", 3)
+    assert not cache.is_revoked("u2", 0)
+    assert cache.stats()['revoked_users'] == 1
+
+
+@pytest.mark.parametrize("hits, misses, claims, ratio", [(0, 0, 0, 0.0), (1, 1, 2, 0.75)])
+def test_hit_ratio_counts_claims_as_hits(hits, misses, claims, ratio):
+    cache = UserCache()
+    cache.hits, cache.misses, cache.claims = hits, misses, claims
+    assert cache.stats()['hit_ratio'] == ratio
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from pymongo.errors import BulkWriteError
+from cart_store import MemoryCartStore, _flush_op, _new_cart
+
+pytestmark = pytest.mark.anyio
+
+
+def line(product_id: str, quantity: int = 1) -> dict:
+    return {"product_id": product_id, "quantity": quantity}
+
+
+async def test_mutations_are_coalesced_into_one_flush(db):
+    store = MemoryCartStore(db.carts)
+    await store.add_item("u1", line("p1"))
+    await store.add_item("u1", line("p1", 2))
+    await store.add_item("u2", line("p2"))
+    await store.set_item_quantity("u2", "p2", 0)
+    assert await db.carts.count_documents({}) == 0
+
+    await store.flush()
+
+    saved = {c['user_id']: c['items'] async for c in db.carts.find({})}
+    assert saved == {"u1": [line("p1", 3)], "u2": []}
+    assert store.stats()['flushes'] == 1
+    assert store.stats()['dirty'] == 0
+
+
+async def test_repeated_adds_are_capped_at_the_line_limit(db):
+    store = MemoryCartStore(db.carts, max_quantity=10)
+    for _ in range(3):
+        cart = await store.add_item("u1", line("p1", 4))
+
+    assert cart['items'] == [line("p1", 10)]
+
+
+async def test_carts_are_loaded_from_mongo_once(db):
+    await db.carts.insert_one({"id": "c1", "user_id": "u1", "items": [line("p1")]})
+    store = MemoryCartStore(db.carts)
+
+    first, second = await asyncio.gather(store.get("u1"), store.add_item("u1", line("p1")))
+
+    assert first is second
+    assert first['items'] == [line("p1", 2)]
+    assert await store.get("nobody") is None
+    assert await store.remove_item("nobody", "p1") is None
+
+
+async def test_discard_waits_for_an_in_flight_flush(db):
+    store = MemoryCartStore(db.carts)
+    await store.add_item("u1", line("p1"))
+    release = asyncio.Event()
+    bulk_write = db.carts.bulk_write
+
+    async def slow_bulk_write(*args, **kwargs):
+        await release.wait()
+        return await bulk_write(*args, **kwargs)
+
+    db.carts.bulk_write = slow_bulk_write
+    flushing = asyncio.create_task(store.flush())
+    await asyncio.sleep(0)
+    discarding = asyncio.create_task(store.discard("u1"))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(flushing, discarding)
+
+    # The flush landed first and the order's discard removed it
+    assert await db.carts.count_documents({}) == 0
+    assert await store.get("u1") is None
+
+
+async def test_clean_carts_are_evicted_first(db):
+    store = MemoryCartStore(db.carts, max_entries=1)
+    await store.add_item("u1", line("p1"))
+    # Over the limit with only dirty carts to spare: the new one is still served
+    assert await store.get("u2") is None
+    assert (await store.add_item("u2", line("p2")))['items'] == [line("p2")]
+    assert store.stats()['entries'] == 2
+
+    await store.flush()
+    await store.get("u3")
+    assert store.stats()['entries'] == 1
+    assert (await store.get("u1"))['items'] == [line("p1")]
+
+
+async def test_versioned_flush_never_overwrites_a_newer_snapshot(db):
+    await db.carts.create_index([("user_id", 1)], name="user_id_unique", unique=True)
+    cart = _new_cart("u1")
+    await db.carts.bulk_write([_flush_op({**cart, "items": [line("p1", 2)]}, version=2)])
+    # The stale snapshot misses the version guard and its upsert hits the unique user_id
+    with pytest.raises(BulkWriteError):
+        await db.carts.bulk_write([_flush_op({**cart, "items": [line("p1", 1)]}, version=1)], ordered=False)
+
+    assert await db.carts.count_documents({}) == 1
+    saved = await db.carts.find_one({"user_id": "u1"})
+    assert saved['items'] == [line("p1", 2)]
+    assert saved['store_version'] == 2
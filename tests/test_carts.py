@@ -0,0 +1,85 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+import carts
+
+pytestmark = pytest.mark.anyio
+
+
+def line(product_id: str, quantity: int = 1, price: float = 10.0) -> dict:
+    return {"product_id": product_id, "quantity": quantity, "price": price}
+
+
+async def test_first_add_creates_the_cart(db):
+    cart = await carts.add_item(db.carts, "u1", line("p1", 2))
+
+    assert cart['user_id'] == "u1"
+    assert cart['id']
+    assert cart['items'] == [line("p1", 2)]
+    assert "_id" not in cart
+    assert await db.carts.count_documents({}) == 1
+
+
+async def test_adds_merge_into_an_existing_line_or_append(db):
+    first = await carts.add_item(db.carts, "u1", line("p1"))
+    await carts.add_item(db.carts, "u1", line("p2"))
+    cart = await carts.add_item(db.carts, "u1", line("p1", 3))
+
+    assert cart['id'] == first['id']
+    assert cart['items'] == [line("p1", 4), line("p2")]
+
+
+async def test_repeated_adds_are_capped_at_the_line_limit(db):
+    for _ in range(3):
+        cart = await carts.add_item(db.carts, "u1", line("p1", 4), max_quantity=10)
+
+    assert cart['items'] == [line("p1", 10)]
+
+
+async def test_dollar_prefixed_ids_are_not_field_paths(db):
+    await carts.add_item(db.carts, "$user_id", line("$items"))
+    cart = await carts.add_item(db.carts, "$user_id", line("$items", 2))
+
+    assert cart['user_id'] == "$user_id"
+    assert cart['items'] == [line("$items", 3)]
+
+
+async def test_losing_the_create_race_updates_the_winning_cart(db, monkeypatch):
+    find_one_and_update = db.carts.find_one_and_update
+    raced = []
+
+    async def racing(*args, **kwargs):
+        if not raced:
+            # Another tab's first add created the cart between our match and insert
+            raced.append(True)
+            await db.carts.insert_one({"id": "winner", "user_id": "u1", "items": [line("p1")]})
+            raise DuplicateKeyError("E11000 duplicate key error", code=11000)
+        return await find_one_and_update(*args, **kwargs)
+
+    monkeypatch.setattr(db.carts, "find_one_and_update", racing)
+    cart = await carts.add_item(db.carts, "u1", line("p1"))
+
+    assert cart['id'] == "winner"
+    assert cart['items'] == [line("p1", 2)]
+
+
+async def test_set_quantity_changes_only_the_matching_line(db):
+    await carts.add_item(db.carts, "u1", line("p1"))
+    await carts.add_item(db.carts, "u1", line("p2"))
+
+    cart = await carts.set_item_quantity(db.carts, "u1", "p2", 5)
+    assert cart['items'] == [line("p1"), line("p2", 5)]
+
+    cart = await carts.set_item_quantity(db.carts, "u1", "p1", 0)
+    assert cart['items'] == [line("p2", 5)]
+    assert await carts.set_item_quantity(db.carts, "nobody", "p1", 2) is None
+
+
+async def test_remove_item(db):
+    await carts.add_item(db.carts, "u1", line("p1"))
+    await carts.add_item(db.carts, "u1", line("p2"))
+
+    cart = await carts.remove_item(db.carts, "u1", "p1")
+
+    assert cart['items'] == [line("p2")]
+    assert carts.cart_summary(cart) == {"items": [line("p2")], "total": 10.0}
+    assert await carts.remove_item(db.carts, "nobody", "p1") is None
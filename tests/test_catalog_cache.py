@@ -0,0 +1,99 @@
+import gzip
+import pytest
+from starlette.requests import Request
+import catalog_cache
+from broadcast import LocalBroadcast, create_broadcast
+from catalog_cache import CachedResponse, CatalogCache
+
+
+def request(**headers) -> Request:
+    raw = [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/api/products", "headers": raw})
+
+
+def test_entries_expire_and_are_lru_bounded(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(catalog_cache.time, "monotonic", lambda: clock[0])
+    cache = CatalogCache(max_entries=2, ttl_seconds=10)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper(), cache.version)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "B"
+    clock[0] = 11
+    assert cache.get("b") is None
+    assert cache.stats()['entries'] == 1
+
+
+def test_values_computed_before_an_invalidation_are_not_stored():
+    cache = CatalogCache()
+    version = cache.version
+    cache.set("a", "old", version)
+    cache.invalidate()
+    cache.set("b", "stale", version)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    cache.set("b", "fresh", cache.version)
+    assert cache.get("b") == "fresh"
+
+
+def test_small_bodies_are_served_uncompressed_with_a_strong_etag():
+    cached = CachedResponse(b'{"items":[]}')
+    response = cached.to_response(request(accept_encoding="gzip"), "public, max-age=60")
+
+    assert response.status_code == 200
+    assert response.body == b'{"items":[]}'
+    assert response.headers["etag"] == cached.etag
+    assert "content-encoding" not in response.headers
+
+
+def test_compressed_variant_is_built_once_and_has_its_own_etag():
+    body = b'{"items":[' + b'{"name":"lamp"},' * 200 + b'{}]}'
+    cached = CachedResponse(body)
+
+    first = cached.to_response(request(accept_encoding="gzip, deflate"), "no-cache")
+    second = cached.to_response(request(accept_encoding="gzip"), "no-cache")
+
+    assert first.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(first.body) == body
+    assert first.body is second.body
+    assert first.headers["etag"] == f'"{cached.digest}-gzip"'
+    assert first.headers["vary"] == "Accept-Encoding"
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (None, 200),
+    ('"other"', 200),
+    ("*", 304),
+    ('"{digest}"', 304),
+    ('W/"{digest}-gzip"', 304),
+    ('"other", "{digest}-br"', 304),
+])
+def test_any_variant_etag_means_not_modified(if_none_match, expected):
+    cached = CachedResponse(b"{}")
+    headers = {"if_none_match": if_none_match.format(digest=cached.digest)} if if_none_match else {}
+
+    assert cached.to_response(request(**headers), "no-cache").status_code == expected
+
+
+@pytest.mark.anyio
+async def test_local_broadcast_isolates_failing_handlers():
+    channel = create_broadcast("local")
+    received = []
+
+    async def failing(message):
+        raise RuntimeError("boom")
+
+    async def recording(message):
+        received.append(message)
+
+    channel.subscribe("catalog", failing)
+    channel.subscribe("catalog", recording)
+    await channel.publish("catalog", {"version": 1})
+    await channel.publish("other", {"version": 2})
+
+    assert isinstance(channel, LocalBroadcast)
+    assert received == [{"version": 1}]
+    with pytest.raises(ValueError):
+        create_broadcast("carrier-pigeon")
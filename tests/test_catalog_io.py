@@ -0,0 +1,89 @@
+import json
+import pytest
+from fastapi import HTTPException
+import catalog_io
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+async def collect(rows) -> list:
+    return [row async for row in rows]
+
+
+async def test_lines_are_split_across_chunks():
+    lines = await collect(catalog_io.iter_lines(chunks(b"\xef\xbb\xbfone\r\ntw", b"o\n", b"three")))
+    assert lines == ["one", "two", "three"]
+
+
+async def test_overlong_line_is_413_even_without_a_newline():
+    with pytest.raises(HTTPException) as raised:
+        await collect(catalog_io.iter_lines(chunks(b"ok\n", b"x" * 20, b"x" * 20), max_line_bytes=32))
+    assert raised.value.status_code == 413
+    assert "Line 2" in raised.value.detail
+
+
+async def test_undecodable_line_is_400_with_its_position():
+    with pytest.raises(HTTPException) as raised:
+        await collect(catalog_io.iter_lines(chunks(b"ok\nab\xffc\n")))
+    assert raised.value.status_code == 400
+    assert raised.value.detail == "Line 2 is not valid UTF-8 (byte 3)"
+
+
+async def test_ndjson_rows_report_bad_lines():
+    body = b'{"name": "a"}\n\nnot json\n[1]\n{"name": "b"}\n'
+    rows = await collect(catalog_io.iter_ndjson_rows(chunks(body)))
+
+    assert [(n, row) for n, row, error in rows if not error] == [(1, {"name": "a"}), (5, {"name": "b"})]
+    assert [n for n, _, error in rows if error] == [3, 4]
+
+
+async def test_csv_rows_handle_multiline_fields_and_blank_cells():
+    body = b'name,description,price\n"Lamp","Warm\nlight",10\nChair,,5\nBad,row\n'
+    rows = await collect(catalog_io.iter_csv_rows(chunks(body)))
+
+    assert rows == [
+        (1, {"name": "Lamp", "description": "Warm\nlight", "price": "10"}, None),
+        (2, {"name": "Chair", "price": "5"}, None),
+        (3, None, "Expected 3 columns, got 2"),
+    ]
+
+
+async def test_unbalanced_csv_quote_is_413():
+    body = b'name,price\n"never closed,1\n' + b"more,2\n" * 10
+    with pytest.raises(HTTPException) as raised:
+        await collect(catalog_io.iter_csv_rows(chunks(body), max_line_bytes=40))
+    assert raised.value.status_code == 413
+    assert "Line 2" in raised.value.detail
+
+
+async def test_import_error_carries_the_report(db):
+    rows = catalog_io.iter_ndjson_rows(chunks(b"not json\n", b"\xff\n"))
+    with pytest.raises(HTTPException) as raised:
+        await catalog_io.import_products(db, rows, dict)
+
+    assert raised.value.status_code == 400
+    assert raised.value.detail["processed"] == 1
+    assert raised.value.detail["failed"] == 1
+    assert raised.value.detail["message"].startswith("Line 2")
+
+
+async def test_export_adds_reserved_units_back(db):
+    await db.products.insert_many([
+        {"id": "p2", "name": "B", "price": 2.0, "stock": 1, "reservations": {"o1": 2, "o2": 1}},
+        {"id": "p1", "name": "A", "price": 1.0, "stock": 4},
+    ])
+
+    body = b"".join([chunk async for chunk in catalog_io.export_products(db, "ndjson")])
+    products = [json.loads(line) for line in body.decode().splitlines()]
+
+    assert [(p['id'], p['stock']) for p in products] == [("p1", 4), ("p2", 4)]
+    assert all("reservations" not in p for p in products)
+
+    csv_body = b"".join([chunk async for chunk in catalog_io.export_products(db, "csv")]).decode()
+    assert csv_body.splitlines()[0] == ",".join(catalog_io.EXPORT_FIELDS)
+    assert csv_body.splitlines()[2].startswith("p2,B,,2.0,,,4,")
@@ -0,0 +1,69 @@
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import Primary, SecondaryPreferred
+import database
+import run
+from database import Database, DatabaseSettings
+
+ENV = {"MONGO_URL": "mongodb://localhost:27017", "DB_NAME": "shop"}
+
+
+def test_settings_from_env_map_to_client_options():
+    settings = DatabaseSettings.from_env({**ENV, "MONGO_MAX_POOL_SIZE": "20", "MONGO_WAIT_QUEUE_TIMEOUT_MS": "500",
+                                          "MONGO_COMPRESSORS": "zstd"})
+
+    assert settings.client_options() == {
+        "maxPoolSize": 20, "minPoolSize": 0, "serverSelectionTimeoutMS": 30000,
+        "waitQueueTimeoutMS": 500, "compressors": "zstd",
+    }
+    assert isinstance(settings.read_preference_mode(), Primary)
+    with pytest.raises(ValueError):
+        DatabaseSettings.from_env({**ENV, "MONGO_READ_PREFERENCE": "secondary"})
+
+
+def test_routed_reads_are_pinned_to_the_primary_after_a_write(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(database.time, "monotonic", lambda: clock[0])
+    settings = DatabaseSettings.from_env({**ENV, "MONGO_READ_PREFERENCE": "secondaryPreferred"})
+    db = Database(AsyncIOMotorClient(settings.url, connect=False), settings)
+
+    assert db.reads() is db.secondary
+    assert db.secondary.read_preference == SecondaryPreferred(max_staleness=90)
+    db.pin_primary()
+    assert db.reads() is db.primary
+    assert db.stats()['reads_pinned_to_primary']
+    clock[0] = 91
+    assert db.reads() is db.secondary
+
+
+def test_primary_only_reads_never_route():
+    settings = DatabaseSettings.from_env(ENV)
+    db = Database(AsyncIOMotorClient(settings.url, connect=False), settings)
+    db.pin_primary()
+    assert db.reads() is db.primary
+    assert not db.stats()['reads_pinned_to_primary']
+
+
+@pytest.mark.parametrize("budget, min_pool, expected", [
+    ("100", "10", ("25", "10")),
+    ("100", "50", ("25", "25")),
+    ("2", None, ("1", "0")),
+])
+def test_connection_budget_is_split_across_workers(monkeypatch, budget, min_pool, expected):
+    # size_pools writes os.environ; setting the variables first makes monkeypatch restore them
+    monkeypatch.setenv("MONGO_MAX_CONNECTIONS", budget)
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "100")
+    monkeypatch.setenv("MONGO_MIN_POOL_SIZE", min_pool or "")
+    if min_pool is None:
+        monkeypatch.delenv("MONGO_MIN_POOL_SIZE")
+
+    run.size_pools(4)
+
+    assert (run.os.environ["MONGO_MAX_POOL_SIZE"], run.os.environ["MONGO_MIN_POOL_SIZE"]) == expected
+
+
+def test_default_workers_honours_web_concurrency(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    assert run.default_workers() == 3
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    assert run.default_workers() >= 1
@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from events import EventHub, new_event_id
+
+pytestmark = pytest.mark.anyio
+
+
+def event(status: str) -> dict:
+    return {"id": new_event_id(), "type": "status", "data": {"status": status}}
+
+
+def finished(e: dict) -> bool:
+    return e['data']['status'] == "paid"
+
+
+async def test_stream_sends_initial_then_live_events_and_closes():
+    hub = EventHub()
+    stream = hub.stream("session:cs_1", [event("pending")], done=finished)
+
+    assert await anext(stream) == "retry: 3000\n\n"
+    assert hub.connections == 1
+    assert '"pending"' in await anext(stream)
+
+    hub.deliver("session:cs_1", event("paid"))
+    assert '"paid"' in await anext(stream)
+    with pytest.raises(StopAsyncIteration):
+        await anext(stream)
+    assert hub.stats()['connections'] == 0
+    assert hub.stats()['channels'] == 0
+
+
+async def test_unstarted_stream_holds_no_slot():
+    hub = EventHub(max_connections=1)
+    stream = hub.stream("session:cs_1", [])
+    await stream.aclose()
+
+    assert hub.connections == 0
+    admitted = await hub.admit(hub.stream("session:cs_1", []))
+    assert await anext(admitted) == "retry: 3000\n\n"
+    assert hub.connections == 1
+
+
+async def test_admit_rejects_past_the_limit():
+    hub = EventHub(max_connections=1)
+    admitted = await hub.admit(hub.stream("session:cs_1", []))
+
+    with pytest.raises(HTTPException) as raised:
+        await hub.admit(hub.stream("session:cs_2", []))
+    assert raised.value.status_code == 503
+    assert hub.rejected == 1
+    assert hub.connections == 1
+    await admitted.aclose()
+    assert hub.connections == 0
+    assert hub.stats()['channels'] == 0
+
+
+async def test_concurrent_admits_stay_within_the_limit():
+    hub = EventHub(max_connections=2)
+
+    results = await asyncio.gather(*(hub.admit(hub.stream(f"c{i}", [])) for i in range(5)), return_exceptions=True)
+
+    assert sum(isinstance(r, HTTPException) for r in results) == 3
+    assert hub.connections == 2
+
+
+async def test_reconnect_replays_events_after_last_event_id():
+    hub = EventHub(replay_size=2)
+    seen = event("pending")
+    hub.deliver("c", seen)
+    for status in ("processing", "shipped"):
+        hub.deliver("c", event(status))
+        await asyncio.sleep(0.001)
+
+    replayed = hub.replay("c", seen['id'])
+    assert [e['data']['status'] for e in replayed] == ["processing", "shipped"]
+    assert hub.replay("other", seen['id']) == []
+
+
+async def test_slow_consumer_is_dropped():
+    hub = EventHub(queue_size=1)
+    stream = hub.stream("c", [])
+    await anext(stream)
+    hub.deliver("c", event("a"))
+    hub.deliver("c", event("b"))
+
+    with pytest.raises(StopAsyncIteration):
+        await anext(stream)
+    assert hub.connections == 0
+
+
+async def test_idle_stream_sends_heartbeats_and_refreshes():
+    hub = EventHub(heartbeat_seconds=0.01)
+    refreshed = []
+
+    async def refresh():
+        refreshed.append(True)
+
+    stream = hub.stream("c", [], refresh=refresh, refresh_seconds=0)
+    await anext(stream)
+    assert await anext(stream) == ": ping\n\n"
+    assert refreshed
+    await stream.aclose()
@@ -0,0 +1,40 @@
+from facets import PRICE_BOUNDARIES, facet_pipeline, format_facets
+
+
+def test_selected_category_narrows_price_and_stock_but_not_categories():
+    pipeline = facet_pipeline({"$text": {"$search": "lamp"}}, "Home")
+
+    assert pipeline[0] == {"$match": {"$text": {"$search": "lamp"}}}
+    facets = pipeline[1]["$facet"]
+    assert facets["categories"][0]["$group"]["_id"] == "$category"
+    assert facets["price"][0] == {"$match": {"category": "Home"}}
+    assert facets["stock"][0] == {"$match": {"category": "Home"}}
+    assert facet_pipeline({}, None)[0]["$facet"]["price"][0]["$bucket"]["boundaries"] == PRICE_BOUNDARIES
+
+
+def test_format_fills_empty_buckets_and_drops_uncategorized():
+    result = {
+        "categories": [{"_id": None, "count": 2}, {"_id": "Home", "count": 5}],
+        "price": [{"_id": 25, "count": 3}, {"_id": "over", "count": 1}],
+        "stock": [{"_id": None, "total": 7, "in_stock": 4}],
+    }
+
+    facets = format_facets(result, boundaries=[0, 25, 50])
+
+    assert facets == {
+        "categories": [{"category": "Home", "count": 5}],
+        "price": [
+            {"min": 0, "max": 25, "count": 0},
+            {"min": 25, "max": 50, "count": 3},
+            {"min": 50, "max": None, "count": 1},
+        ],
+        "total": 7,
+        "in_stock": 4,
+    }
+
+
+def test_format_handles_an_empty_catalog():
+    facets = format_facets({})
+    assert facets["categories"] == []
+    assert facets["total"] == facets["in_stock"] == 0
+    assert len(facets["price"]) == len(PRICE_BOUNDARIES)
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from fastapi import HTTPException
+from idempotency import COLLECTION, COMPLETED, IN_PROGRESS, IdempotencyStore, fingerprint
+from timestamps import utcnow
+
+pytestmark = pytest.mark.anyio
+
+
+class Handler:
+    def __init__(self, result=None, error=None, delay: float = 0):
+        self.result = result or {"id": "o1"}
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+async def test_repeat_replays_the_stored_result(db):
+    store = IdempotencyStore(db)
+    handler = Handler()
+
+    assert await store.run("u1:orders", "k1", {"a": 1}, handler) == ({"id": "o1"}, False)
+    assert await store.run("u1:orders", "k1", {"a": 1}, handler) == ({"id": "o1"}, True)
+    assert handler.calls == 1
+    assert (await db[COLLECTION].find_one({"_id": "u1:orders:k1"}))['status'] == COMPLETED
+
+
+async def test_another_worker_replays_from_mongo(db):
+    handler = Handler()
+    await IdempotencyStore(db).run("s", "k1", {"a": 1}, handler)
+
+    assert await IdempotencyStore(db).run("s", "k1", {"a": 1}, handler) == ({"id": "o1"}, True)
+    assert handler.calls == 1
+
+
+async def test_reused_key_with_other_params_is_422(db):
+    store = IdempotencyStore(db)
+    await store.run("s", "k1", {"a": 1}, Handler())
+
+    for other in (store, IdempotencyStore(db)):
+        with pytest.raises(HTTPException) as raised:
+            await other.run("s", "k1", {"a": 2}, Handler())
+        assert raised.value.status_code == 422
+
+
+async def test_scopes_keep_keys_apart(db):
+    store = IdempotencyStore(db)
+    await store.run("u1", "k1", {}, Handler({"id": "a"}))
+
+    assert await store.run("u2", "k1", {}, Handler({"id": "b"})) == ({"id": "b"}, False)
+
+
+@pytest.mark.parametrize("key", ["", "k" * 256])
+async def test_key_length_is_checked(db, key):
+    with pytest.raises(HTTPException) as raised:
+        await IdempotencyStore(db).run("s", key, {}, Handler())
+    assert raised.value.status_code == 400
+
+
+async def test_concurrent_repeats_on_one_worker_run_once(db):
+    store = IdempotencyStore(db)
+    handler = Handler(delay=0.01)
+
+    results = await asyncio.gather(*(store.run("s", "k1", {}, handler) for _ in range(5)))
+
+    assert handler.calls == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+    assert store.stats()['in_flight'] == 0
+
+
+async def test_failure_releases_the_key(db):
+    store = IdempotencyStore(db)
+    with pytest.raises(RuntimeError):
+        await store.run("s", "k1", {}, Handler(error=RuntimeError("stripe down")))
+    assert await db[COLLECTION].count_documents({}) == 0
+
+    assert await store.run("s", "k1", {}, Handler()) == ({"id": "o1"}, False)
+
+
+async def test_in_progress_claim_elsewhere_is_409_after_waiting(db):
+    now = utcnow()
+    await db[COLLECTION].insert_one({"_id": "s:k1", "status": IN_PROGRESS, "fingerprint": fingerprint({}),
+                                     "lease_until": now + timedelta(minutes=1), "expires_at": now + timedelta(days=1)})
+    handler = Handler()
+
+    with pytest.raises(HTTPException) as raised:
+        await IdempotencyStore(db, wait_seconds=0.1).run("s", "k1", {}, handler)
+    assert raised.value.status_code == 409
+    assert handler.calls == 0
+
+
+async def test_lapsed_claim_is_taken_over(db):
+    now = utcnow()
+    await db[COLLECTION].insert_one({"_id": "s:k1", "status": IN_PROGRESS, "fingerprint": fingerprint({}),
+                                     "lease_until": now - timedelta(seconds=1), "expires_at": now + timedelta(days=1)})
+
+    assert await IdempotencyStore(db).run("s", "k1", {}, Handler()) == ({"id": "o1"}, False)
@@ -0,0 +1,71 @@
+import pytest
+from pymongo.errors import OperationFailure
+import indexes
+
+
+def index_keys(collection: str) -> list:
+    return [list(index.document["key"]) for index in indexes.INDEXES.get(collection, [])]
+
+
+@pytest.mark.parametrize("collection, query, sort", indexes.QUERY_SHAPES)
+def test_every_query_shape_has_a_matching_index(collection, query, sort):
+    wanted = list(query) + [field for field, _ in sort or []]
+    assert any(keys[:len(wanted)] == wanted for keys in index_keys(collection)), (collection, wanted)
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {"stage": "FETCH", "inputStage": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN"}, {"stage": "COLLSCAN"},
+    ]}}
+    assert indexes._plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+class ExplainCursor:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def sort(self, sort):
+        return self
+
+    async def explain(self):
+        if isinstance(self.plan, Exception):
+            raise self.plan
+        return {"queryPlanner": {"winningPlan": {"queryPlan": self.plan}}}
+
+
+class ExplainCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.created = []
+
+    def find(self, query):
+        if self.name == "carts":
+            return ExplainCursor({"stage": "COLLSCAN"})
+        if self.name == "users":
+            return ExplainCursor(OperationFailure("explain not allowed"))
+        return ExplainCursor({"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}})
+
+    async def create_indexes(self, models):
+        if self.name == "orders":
+            raise OperationFailure("duplicate key")
+        self.created += models
+
+
+class ExplainDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = ExplainCollection(name)
+        return collection
+
+
+@pytest.mark.anyio
+async def test_verify_reports_collection_scans():
+    assert await indexes.verify_indexes(ExplainDatabase()) == [("carts", {"user_id": ""}, None)]
+
+
+@pytest.mark.anyio
+async def test_ensure_indexes_carries_on_past_a_failing_collection(caplog):
+    db = ExplainDatabase()
+    await indexes.ensure_indexes(db)
+
+    assert "Failed to create indexes on orders" in caplog.text
+    assert len(db["products"].created) == len(indexes.INDEXES["products"])
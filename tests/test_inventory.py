@@ -0,0 +1,98 @@
+from datetime import timedelta
+import pytest
+import inventory
+from timestamps import utcnow
+
+pytestmark = pytest.mark.anyio
+
+TTL = timedelta(minutes=15)
+
+
+@pytest.fixture
+async def products(db):
+    await db.products.insert_many([
+        {"id": "p1", "stock": 5},
+        {"id": "p2", "stock": 1},
+    ])
+    return db.products
+
+
+async def stock(db) -> dict:
+    return {p['id']: p['stock'] async for p in db.products.find({})}
+
+
+async def test_reserve_takes_stock_and_records_the_marker(db, products):
+    await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": 2}, {"product_id": "p1", "quantity": 1}], TTL)
+
+    assert await stock(db) == {"p1": 2, "p2": 1}
+    product = await db.products.find_one({"id": "p1"})
+    assert product['reservations'] == {"o1": 3}
+    assert inventory.on_hand(product) == 5
+    ledger = await db[inventory.RESERVATIONS].find_one({"_id": "o1"})
+    assert ledger['status'] == inventory.HELD
+    assert ledger['lines'] == [{"product_id": "p1", "quantity": 3}]
+
+
+async def test_reserve_rolls_back_when_a_line_is_short(db, products):
+    with pytest.raises(inventory.InsufficientStock) as raised:
+        await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": 2}, {"product_id": "p2", "quantity": 2}], TTL)
+
+    assert raised.value.product_ids == ["p2"]
+    assert await stock(db) == {"p1": 5, "p2": 1}
+    assert await db.products.count_documents({"reservations.o1": {"$exists": True}}) == 0
+    assert await db[inventory.RESERVATIONS].find_one({"_id": "o1"}) is None
+
+
+@pytest.mark.parametrize("quantity", [0, -1, 1.5, "2"])
+async def test_reserve_rejects_invalid_quantities(db, products, quantity):
+    with pytest.raises(ValueError):
+        await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": quantity}], TTL)
+    assert await stock(db) == {"p1": 5, "p2": 1}
+
+
+async def test_release_returns_stock_once(db, products):
+    await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": 2}], TTL)
+
+    assert await inventory.release(db, "o1") is True
+    assert await inventory.release(db, "o1") is False
+    assert await stock(db) == {"p1": 5, "p2": 1}
+    assert await db.products.count_documents({"reservations.o1": {"$exists": True}}) == 0
+
+
+async def test_commit_keeps_stock_and_blocks_release(db, products):
+    await inventory.reserve(db, "o1", [{"product_id": "p2", "quantity": 1}], TTL)
+
+    assert await inventory.commit(db, "o1") is True
+    assert await inventory.release(db, "o1") is False
+    assert await stock(db) == {"p1": 5, "p2": 0}
+    assert await db[inventory.RESERVATIONS].count_documents({}) == 0
+
+
+async def test_release_resumes_an_interrupted_release(db, products):
+    await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": 2}], TTL)
+    await db[inventory.RESERVATIONS].update_one({"_id": "o1"}, {"$set": {"status": inventory.RELEASING}})
+
+    assert await inventory.commit(db, "o1") is False
+    assert await inventory.release(db, "o1") is True
+    assert await stock(db) == {"p1": 5, "p2": 1}
+
+
+async def test_extend_only_moves_a_held_expiry_forward(db, products):
+    await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": 1}], TTL)
+    ledger = await db[inventory.RESERVATIONS].find_one({"_id": "o1"})
+
+    assert await inventory.extend(db, "o1", ledger['expires_at'] - timedelta(minutes=5)) is True
+    assert (await db[inventory.RESERVATIONS].find_one({"_id": "o1"}))['expires_at'] == ledger['expires_at']
+    later = utcnow() + timedelta(hours=24)
+    assert await inventory.extend(db, "o1", later) is True
+    assert (await db[inventory.RESERVATIONS].find_one({"_id": "o1"}))['expires_at'] == later
+
+    await inventory.release(db, "o1")
+    assert await inventory.extend(db, "o1", later) is False
+
+
+async def test_expired_lists_lapsed_reservations(db, products):
+    await inventory.reserve(db, "o1", [{"product_id": "p1", "quantity": 1}], TTL)
+    await inventory.reserve(db, "o2", [{"product_id": "p1", "quantity": 1}], -TTL)
+
+    assert await inventory.expired(db) == [("o2", inventory.HELD)]
@@ -0,0 +1,92 @@
+from datetime import timedelta
+import pytest
+import lifecycle
+from timestamps import utcnow
+
+pytestmark = pytest.mark.anyio
+
+DAY = timedelta(days=1)
+
+
+def sweeper(db, **options):
+    return lifecycle.LifecycleSweeper(db, cart_ttl_seconds=30 * 86400, transaction_ttl_seconds=86400,
+                                      archive_after_days=180, batch_size=2, pause_seconds=0, **options)
+
+
+async def test_legacy_string_carts_past_the_ttl_are_deleted(db):
+    now = utcnow()
+    await db.carts.insert_many([
+        {"user_id": "old", "updated_at": (now - 31 * DAY).isoformat()},
+        {"user_id": "recent", "updated_at": (now - DAY).isoformat()},
+        # BSON dates are left to the TTL index
+        {"user_id": "dated", "updated_at": now - 31 * DAY},
+    ])
+
+    assert await sweeper(db).expire_legacy_carts(now - 30 * DAY) == 1
+    assert sorted([c['user_id'] async for c in db.carts.find({})]) == ["dated", "recent"]
+
+
+async def test_stale_pending_transactions_expire(db):
+    now = utcnow()
+    await db.payment_transactions.insert_many([
+        {"session_id": "old", "payment_status": "pending", "created_at": now - 2 * DAY},
+        {"session_id": "legacy", "payment_status": "pending", "created_at": (now - 2 * DAY).isoformat()},
+        {"session_id": "paid", "payment_status": "paid", "created_at": now - 2 * DAY},
+        {"session_id": "fresh", "payment_status": "pending", "created_at": now},
+    ])
+
+    assert await sweeper(db).expire_transactions(now - DAY) == 2
+    statuses = {t['session_id']: t['payment_status'] async for t in db.payment_transactions.find({})}
+    assert statuses == {"old": "expired", "legacy": "expired", "paid": "paid", "fresh": "pending"}
+
+
+async def test_finished_orders_move_to_the_archive(db):
+    now = utcnow()
+    await db.orders.insert_many([
+        {"id": f"d{i}", "status": "delivered", "created_at": now - 200 * DAY} for i in range(3)
+    ] + [
+        {"id": "c1", "status": "cancelled", "created_at": now - 200 * DAY},
+        {"id": "p1", "status": "processing", "created_at": now - 200 * DAY},
+        {"id": "d9", "status": "delivered", "created_at": now - DAY},
+    ])
+
+    result = await sweeper(db).run_once()
+
+    assert result == {"carts": 0, "payment_transactions": 0, "orders": 4}
+    assert sorted([o['id'] async for o in db.orders.find({})]) == ["d9", "p1"]
+    archived = await db[lifecycle.ORDERS_ARCHIVE].find({}).to_list(None)
+    assert sorted(o['id'] for o in archived) == ["c1", "d0", "d1", "d2"]
+    assert all(o['archived_at'] for o in archived)
+
+
+async def test_archiving_a_copied_batch_again_does_not_duplicate(db):
+    now = utcnow()
+    await db.orders.insert_one({"id": "d1", "status": "delivered", "created_at": now - 200 * DAY})
+    order = await db.orders.find_one({"id": "d1"})
+    # A previous run copied the order but died before deleting it
+    await db[lifecycle.ORDERS_ARCHIVE].insert_one({**order, "archived_at": now - DAY})
+
+    assert await sweeper(db).archive_orders(now - 180 * DAY) == 1
+    assert await db[lifecycle.ORDERS_ARCHIVE].count_documents({}) == 1
+    assert await db.orders.count_documents({}) == 0
+
+
+async def test_disabled_steps_are_skipped(db):
+    now = utcnow()
+    await db.orders.insert_one({"id": "d1", "status": "delivered", "created_at": now - 200 * DAY})
+    quiet = lifecycle.LifecycleSweeper(db, cart_ttl_seconds=0, transaction_ttl_seconds=0, archive_after_days=0)
+
+    assert await quiet.run_once() == {"carts": 0, "payment_transactions": 0, "orders": 0}
+    assert await db.orders.count_documents({}) == 1
+    assert quiet.stats()['runs'] == 1
+
+
+async def test_ttl_index_is_created_retuned_and_dropped(db):
+    await lifecycle.ensure_ttl_index(db.carts, "updated_at", 60, lifecycle.CART_TTL_INDEX)
+    assert (await db.carts.index_information())[lifecycle.CART_TTL_INDEX]['expireAfterSeconds'] == 60
+
+    await lifecycle.ensure_ttl_index(db.carts, "updated_at", 120, lifecycle.CART_TTL_INDEX)
+    assert (await db.carts.index_information())[lifecycle.CART_TTL_INDEX]['expireAfterSeconds'] == 120
+
+    await lifecycle.ensure_ttl_index(db.carts, "updated_at", 0, lifecycle.CART_TTL_INDEX)
+    assert lifecycle.CART_TTL_INDEX not in await db.carts.index_information()
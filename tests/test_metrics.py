@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import pytest
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsMiddleware, MongoCommandListener, Registry
+
+
+def test_counter_and_gauge_render_with_escaped_labels():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests", ("route",)))
+    in_flight = registry.register(Gauge("in_flight", "In flight"))
+    requests.inc(route='/api/"x"')
+    requests.inc(2, route='/api/"x"')
+    in_flight.inc()
+    in_flight.dec()
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{route="/api/\\"x\\""} 3',
+        "# HELP in_flight In flight",
+        "# TYPE in_flight gauge",
+        "in_flight 0",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.5, 0.1))
+    for value in (0.05, 0.2, 3):
+        histogram.observe(value)
+
+    lines = histogram.render()[2:]
+    assert lines == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="0.5"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 3.25",
+        "latency_seconds_count 3",
+    ]
+
+
+def command_event(name: str, command: dict, request_id: int = 1, duration_micros: int = 2000):
+    return SimpleNamespace(command_name=name, command=command, connection_id=("localhost", 27017),
+                           request_id=request_id, duration_micros=duration_micros)
+
+
+def test_mongo_listener_labels_commands_by_collection(monkeypatch):
+    duration = Histogram("mongo", "Mongo", ("command", "collection"))
+    failures = Counter("failures", "Failures", ("command", "collection"))
+    monkeypatch.setattr(metrics, "MONGO_DURATION", duration)
+    monkeypatch.setattr(metrics, "MONGO_FAILURES", failures)
+    listener = MongoCommandListener()
+
+    listener.started(command_event("find", {"find": "products"}, 1))
+    listener.started(command_event("getMore", {"getMore": 42, "collection": "orders"}, 2))
+    listener.started(command_event("ping", {"ping": 1}, 3))
+    listener.succeeded(command_event("find", {}, 1))
+    listener.failed(command_event("getMore", {}, 2))
+    listener.succeeded(command_event("ping", {}, 3))
+
+    assert sorted(duration._values) == [("find", "products"), ("getMore", "orders"), ("ping", "")]
+    assert list(failures._values) == [("getMore", "orders")]
+
+
+@pytest.mark.anyio
+async def test_middleware_records_route_template_and_breakdown(monkeypatch, caplog):
+    requests = Counter("requests", "Requests", ("method", "route", "status"))
+    monkeypatch.setattr(metrics, "HTTP_REQUESTS", requests)
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path="/api/products/{product_id}")
+        metrics.add_time("mongo", 0.004)
+        await asyncio.sleep(0.01)
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    transport = httpx.ASGITransport(app=MetricsMiddleware(app, slow_request_seconds=0.001))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        await http.get("/api/products/p1")
+
+    assert requests._values == {("GET", "/api/products/{product_id}", 404): 1}
+    assert "Slow request GET /api/products/{product_id} 404" in caplog.text
+    assert "mongo=4.0ms" in caplog.text
+    metrics.add_time("mongo", 1)  # outside a request: no breakdown to add to
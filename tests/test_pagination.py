@@ -0,0 +1,104 @@
+import base64
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+from pagination import (
+    decode_cursor, decode_offset, encode_cursor, fetch_merged_page, fetch_page, keyset_filter, parse_fields,
+    parse_sort,
+)
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trips_dates():
+    values = [START, "p1"]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize("raw", [
+    b"not json",
+    b'{"a":1}',
+    b'[{"$gt":1},"p1"]',
+    b'[{"$date":"not a date"},"p1"]',
+    b'[{"$date":"2024-01-01","$ne":1},"p1"]',
+])
+def test_malformed_cursors_are_400(raw):
+    cursor = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    with pytest.raises(HTTPException) as raised:
+        keyset_filter("created_at", DESCENDING, cursor)
+    assert raised.value.status_code == 400
+
+
+@pytest.mark.parametrize("values", [
+    ["p1"],
+    [1, "p1"],  # a number for a date key
+    [START, None],
+    [START, 5],
+    [True, "p1"],
+])
+def test_cursor_values_must_fit_the_sort_key(values):
+    with pytest.raises(HTTPException):
+        keyset_filter("created_at", ASCENDING, encode_cursor(values))
+
+
+def test_price_cursor_rejects_bools():
+    with pytest.raises(HTTPException):
+        keyset_filter("price", ASCENDING, encode_cursor([True, "p1"]))
+    assert keyset_filter("price", ASCENDING, encode_cursor([9.5, "p1"]))
+
+
+@pytest.mark.parametrize("values", [[-1], [True], ["3"], [1, 2]])
+def test_offsets_must_be_one_non_negative_int(values):
+    with pytest.raises(HTTPException):
+        decode_offset(encode_cursor(values))
+    assert decode_offset(encode_cursor([3])) == 3
+    assert decode_offset(None) == 0
+
+
+def test_parse_sort_and_fields():
+    assert parse_sort("-price", {"price"}) == ("price", DESCENDING)
+    with pytest.raises(HTTPException):
+        parse_sort("stock", {"price"})
+    assert parse_fields("name", {"name", "price"}, {"id"}) == {"_id": 0, "name": 1, "id": 1}
+    assert parse_fields(None, {"name"}, {"id"}, hidden=("archived_at",)) == {"_id": 0, "archived_at": 0}
+    with pytest.raises(HTTPException):
+        parse_fields("password", {"name"}, {"id"})
+
+
+def orders(prefix: str, count: int, offset: int = 0) -> list:
+    return [{"id": f"{prefix}{i:02d}", "user_id": "u1", "created_at": START + timedelta(hours=offset + i)}
+            for i in range(count)]
+
+
+async def walk(fetch, *args, limit: int) -> list:
+    seen, after = [], None
+    while True:
+        items, after = await fetch(*args, "created_at", DESCENDING, limit, after)
+        seen += [item['id'] for item in items]
+        if not after:
+            return seen
+
+
+@pytest.mark.anyio
+async def test_fetch_page_walks_ties_and_legacy_strings_once(db):
+    docs = orders("a", 5) + [{"id": "t1", "created_at": START}, {"id": "t2", "created_at": START.isoformat()}]
+    await db.orders.insert_many(docs)
+
+    seen = await walk(fetch_page, db.orders, {}, limit=2)
+
+    # Dates sort above every legacy string, ties break on id
+    assert seen == ["a04", "a03", "a02", "a01", "t1", "a00", "t2"]
+
+
+
+@pytest.mark.anyio
+async def test_fetch_merged_page_interleaves_collections(db):
+    await db.orders.insert_many(orders("n", 4, offset=1))
+    await db.orders_archive.insert_many(orders("a", 4) + [{"id": "x", "user_id": "other", "created_at": START}])
+
+    seen = await walk(fetch_merged_page, [db.orders, db.orders_archive], {"user_id": "u1"}, limit=3)
+
+    assert seen == ["n03", "n02", "a03", "n01", "a02", "n00", "a01", "a00"]
+    items, after = await fetch_merged_page([db.orders, db.orders_archive], {}, "created_at", DESCENDING, 20)
+    assert len(items) == 9 and after is None
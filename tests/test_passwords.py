@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from passwords import PasswordHasher, create_crypt_context
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(create_crypt_context(4), max_workers=2, max_pending=2)
+    yield hasher
+    hasher.shutdown()
+
+
+async def test_hash_and_verify_off_the_event_loop(hasher):
+    hashed = await hasher.hash("hunter2")
+
+    assert await hasher.verify_and_update("hunter2", hashed) == (True, None)
+    assert (await hasher.verify_and_update("wrong", hashed))[0] is False
+    assert hasher.stats()['pending'] == 0
+
+
+async def test_hash_with_another_cost_is_upgraded(hasher):
+    old = create_crypt_context(5).hash("hunter2")
+
+    valid, new_hash = await hasher.verify_and_update("hunter2", old)
+
+    assert valid
+    assert new_hash.startswith("$2b$04$")
+
+
+async def test_calls_past_max_pending_are_refused(hasher):
+    hashes = [asyncio.create_task(hasher.hash("pw")) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as raised:
+        await hasher.hash("pw")
+    assert raised.value.status_code == 503
+    assert raised.value.headers["Retry-After"] == "1"
+    assert hasher.rejected == 1
+    await asyncio.gather(*hashes)
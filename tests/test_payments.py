@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import stripe
+import payments
+from payments import PaymentClient
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyBackend:
+    """Checkout backend that fails with `errors` in turn before answering."""
+
+    def __init__(self, errors=(), payment_status: str = "unpaid", delay: float = 0):
+        self.errors = list(errors)
+        self.payment_status = payment_status
+        self.delay = delay
+        self.calls = 0
+
+    async def _answer(self, result):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return result
+
+    async def create_checkout_session(self, checkout_request):
+        return await self._answer(SimpleNamespace(session_id="cs_1", url="https://checkout"))
+
+    async def get_checkout_status(self, session_id):
+        return await self._answer(SimpleNamespace(status="open", payment_status=self.payment_status))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(payments.random, "uniform", lambda a, b: 0)
+
+
+def client(backend, **options) -> PaymentClient:
+    return PaymentClient(lambda base_url: backend, **options)
+
+
+async def test_transient_status_errors_are_retried():
+    backend = FlakyBackend([stripe.APIConnectionError("reset"), stripe.APIError("oops", http_status=502)])
+
+    status = await client(backend).get_checkout_status("cs_1", "http://test")
+
+    assert status.payment_status == "unpaid"
+    assert backend.calls == 3
+
+
+async def test_client_errors_and_exhausted_retries_are_raised():
+    with pytest.raises(stripe.InvalidRequestError):
+        await client(FlakyBackend([stripe.InvalidRequestError("no such session", "id")])).get_checkout_status(
+            "cs_1", "http://test")
+
+    backend = FlakyBackend([stripe.APIConnectionError("reset")] * 3)
+    with pytest.raises(stripe.APIConnectionError):
+        await client(backend, max_retries=2).get_checkout_status("cs_1", "http://test")
+    assert backend.calls == 3
+
+
+async def test_create_is_only_retried_when_rate_limited():
+    backend = FlakyBackend([stripe.RateLimitError("slow down")])
+    assert (await client(backend).create_checkout_session({}, "http://test")).session_id == "cs_1"
+    assert backend.calls == 2
+
+    backend = FlakyBackend(delay=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await client(backend, timeout=0.01).create_checkout_session({}, "http://test")
+    assert backend.calls == 1
+
+
+async def test_paid_status_is_cached_for_good_and_pending_briefly(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(payments.time, "monotonic", lambda: clock[0])
+    backend = FlakyBackend()
+    payment_client = client(backend, pending_ttl=2)
+
+    await payment_client.get_checkout_status("cs_1", "http://test")
+    await payment_client.get_checkout_status("cs_1", "http://test")
+    assert backend.calls == 1
+    clock[0] = 3
+    backend.payment_status = "paid"
+    await payment_client.get_checkout_status("cs_1", "http://test")
+    clock[0] = 1000
+    assert (await payment_client.get_checkout_status("cs_1", "http://test")).payment_status == "paid"
+
+    assert backend.calls == 2
+    assert payment_client.stats()['terminal_cached'] == 1
+    assert payment_client.stats()['pending_cached'] == 0
+
+
+async def test_concurrent_polls_share_one_upstream_call():
+    backend = FlakyBackend(delay=0.01)
+    payment_client = client(backend)
+
+    results = await asyncio.gather(*(payment_client.get_checkout_status("cs_1", "http://test") for _ in range(4)))
+
+    assert backend.calls == 1
+    assert all(r is results[0] for r in results)
+    assert payment_client.stats()['coalesced_polls'] == 3
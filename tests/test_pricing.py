@@ -0,0 +1,62 @@
+import pytest
+from pricing import PriceBook, price_lines
+
+
+class CountingProducts:
+    def __init__(self, collection):
+        self.collection = collection
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append(sorted(query["id"]["$in"]))
+        return self.collection.find(query, projection)
+
+
+@pytest.fixture
+async def db(db):
+    await db.products.insert_many([
+        {"id": "p1", "name": "Lamp", "price": 20.0, "stock": 3, "description": "not needed"},
+        {"id": "p2", "name": "Desk", "price": 100.0, "stock": 0},
+    ])
+    return db
+
+
+@pytest.mark.anyio
+async def test_resolve_batches_misses_and_caches_absent_products(db):
+    products = CountingProducts(db.products)
+    view = type("DB", (), {"products": products})()
+    book = PriceBook()
+
+    first = await book.resolve(view, ["p1", "gone", "p1"])
+    second = await book.resolve(view, ["p1", "gone", "p2"])
+
+    assert first == {"p1": {"id": "p1", "name": "Lamp", "price": 20.0, "stock": 3}}
+    assert set(second) == {"p1", "p2"}
+    assert products.queries == [["gone", "p1"], ["p2"]]
+
+    book.invalidate("p1")
+    await book.resolve(view, ["p1", "p2"])
+    await book.resolve(view, ["p2"], fresh=True)
+    assert products.queries[2:] == [["p1"], ["p2"]]
+
+
+def test_lines_are_priced_at_the_current_price():
+    snapshots = {
+        "p1": {"id": "p1", "name": "Lamp", "price": 20.0, "stock": 3},
+        "p2": {"id": "p2", "name": "Desk", "price": 100.0, "stock": 0},
+    }
+    items = [
+        {"product_id": "p1", "quantity": 2, "price": 19.99},
+        {"product_id": "p2", "quantity": 1, "price": 100.001},
+        {"product_id": "gone", "quantity": 1, "price": 5.0},
+    ]
+
+    priced = price_lines(items, snapshots)
+
+    p1, p2, gone = priced["items"]
+    assert p1["line_total"] == 40.0 and p1["price_changed"] and p1["previous_price"] == 19.99
+    assert not p2["price_changed"] and not p2["available"]
+    assert gone["available"] is False and gone["line_total"] == 0.0
+    assert priced["total"] == 140.0
+    assert priced["price_changed"] is True
+    assert priced["all_available"] is False
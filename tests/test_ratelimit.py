@@ -0,0 +1,164 @@
+import asyncio
+import httpx
+import pytest
+import metrics
+import ratelimit
+from ratelimit import MemoryBuckets, RateLimiter, RateLimitMiddleware, classify, parse_limits
+
+
+@pytest.mark.parametrize("method, path, route_class", [
+    ("POST", "/api/webhook/stripe", "webhook"),
+    ("GET", "/api/payments/stripe/events/cs_1", "stream"),
+    ("GET", "/api/orders/o1/events", "stream"),
+    ("POST", "/api/orders/create", "checkout"),
+    ("GET", "/api/payments/stripe/status/cs_1", "checkout"),
+    ("POST", "/api/auth/login", "auth"),
+    ("GET", "/api/auth/me", "default"),
+    ("DELETE", "/api/admin/products/p1", "admin"),
+    ("GET", "/api/products?category=x", "browse"),
+    ("POST", "/api/products", "default"),
+])
+def test_classify(method, path, route_class):
+    assert classify(method, path) == route_class
+
+
+def test_parse_limits():
+    limits = parse_limits("auth=1:5, browse=off, search=3", trusted_proxy_hops=1)
+    assert limits["auth"] == (1.0, 5.0)
+    assert "browse" not in limits
+    assert limits["search"] == (3.0, 3.0)
+    assert limits["checkout"] == ratelimit.DEFAULT_LIMITS["checkout"]
+    assert parse_limits("on", trusted_proxy_hops=1) == ratelimit.DEFAULT_LIMITS
+    assert parse_limits(" OFF ") == {}
+    assert parse_limits("") == {}
+
+
+def test_ip_keyed_classes_need_proxy_hops_or_an_explicit_limit():
+    limits = parse_limits("on")
+    assert not set(ratelimit.IP_KEYED_CLASSES) & set(limits)
+    assert limits["checkout"] == ratelimit.DEFAULT_LIMITS["checkout"]
+    assert parse_limits("auth=1:5")["auth"] == (1.0, 5.0)
+
+
+@pytest.mark.anyio
+async def test_bucket_allows_the_burst_then_refills(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: clock[0])
+    buckets = MemoryBuckets()
+
+    results = [await buckets.take("k", rate=2, burst=3) for _ in range(4)]
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+    assert results[-1][2] == pytest.approx(0.5)
+
+    clock[0] += 0.5
+    assert (await buckets.take("k", rate=2, burst=3))[0] is True
+    assert (await buckets.take("other", rate=2, burst=3))[0] is True
+
+
+@pytest.mark.anyio
+async def test_buckets_are_lru_bounded():
+    buckets = MemoryBuckets(max_keys=2)
+    for key in ("a", "b", "a", "c"):
+        await buckets.take(key, rate=0.001, burst=1)
+    assert len(buckets) == 2
+    # "b" was least recently used, so it starts with a full bucket again
+    assert (await buckets.take("b", rate=0.001, burst=1))[0] is True
+    assert (await buckets.take("c", rate=0.001, burst=1))[0] is False
+
+
+def test_client_ip_trusts_only_proxy_appended_entries():
+    scope = {"client": ("10.0.0.1", 1234)}
+    headers = {b"x-forwarded-for": b"6.6.6.6, 1.2.3.4"}
+
+    assert RateLimiter({}, None).client_ip(scope, headers) == "10.0.0.1"
+    assert RateLimiter({}, None, trusted_proxy_hops=1).client_ip(scope, headers) == "1.2.3.4"
+    assert RateLimiter({}, None, trusted_proxy_hops=5).client_ip(scope, headers) == "6.6.6.6"
+
+
+def test_client_key_uses_the_user_except_for_auth():
+    limiter = RateLimiter({}, None, identify=lambda token: "u1" if token == "good" else None)
+    scope = {"client": ("10.0.0.1", 1234)}
+
+    assert limiter.client_key("browse", scope, {b"authorization": b"Bearer good"}) == "browse:u:u1"
+    assert limiter.client_key("browse", scope, {b"authorization": b"Bearer bad"}) == "browse:ip:10.0.0.1"
+    assert limiter.client_key("auth", scope, {b"authorization": b"Bearer good"}) == "auth:ip:10.0.0.1"
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def client(limiter: RateLimiter, app=ok_app) -> httpx.AsyncClient:
+    transport = httpx.ASGITransport(app=RateLimitMiddleware(app, limiter))
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+@pytest.mark.anyio
+async def test_middleware_returns_429_past_the_burst():
+    limiter = RateLimiter({"auth": (0.01, 2)}, MemoryBuckets())
+    async with client(limiter) as http:
+        codes = [(await http.post("/api/auth/login")).status_code for _ in range(3)]
+        rejected = await http.post("/api/auth/login")
+        unlimited = await http.get("/api/auth/me")
+        outside = await http.get("/health")
+
+    assert codes == [200, 200, 429]
+    assert rejected.headers["X-RateLimit-Limit"] == "2"
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert unlimited.status_code == 200
+    assert outside.status_code == 200
+    assert limiter.limited == 2
+
+
+@pytest.mark.anyio
+async def test_forwarded_clients_get_their_own_buckets_behind_trusted_proxies():
+    limiter = RateLimiter({"browse": (0.01, 1)}, MemoryBuckets(), trusted_proxy_hops=1)
+    async with client(limiter) as http:
+        first, second, again = [
+            (await http.get("/api/products", headers={"X-Forwarded-For": ip})).status_code
+            for ip in ("1.2.3.4", "5.6.7.8", "1.2.3.4")
+        ]
+
+    assert (first, second, again) == (200, 200, 429)
+
+
+@pytest.mark.anyio
+async def test_overload_sheds_low_lanes_first():
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await release.wait()
+        await ok_app(scope, receive, send)
+
+    limiter = RateLimiter({}, MemoryBuckets(), max_in_flight=4)
+    async with client(limiter, slow_app) as http:
+        held = [asyncio.create_task(http.get("/api/auth/me")) for _ in range(3)]
+        while limiter.in_flight < 3:
+            await asyncio.sleep(0)
+
+        browse = await http.get("/api/products")  # low lane: shed at 3
+        release.set()
+        webhook = await http.post("/api/webhook/stripe")  # critical lane: never shed
+        await asyncio.gather(*held)
+
+    assert browse.status_code == 503
+    assert browse.headers["Retry-After"] == "1"
+    assert webhook.status_code == 200
+    assert limiter.shed == 1
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_loop_lag_sheds_normal_lanes_but_not_checkout():
+    limiter = RateLimiter({}, MemoryBuckets(), max_loop_lag=0.2)
+    metrics.LOOP_LAG_LAST.set(0.25)
+    try:
+        async with client(limiter) as http:
+            normal = await http.get("/api/auth/me")
+            checkout = await http.post("/api/orders/create")
+    finally:
+        metrics.LOOP_LAG_LAST.set(0)
+
+    assert normal.status_code == 503
+    assert checkout.status_code == 200
@@ -0,0 +1,34 @@
+import pytest
+import locks
+import recommendations
+
+pytestmark = pytest.mark.anyio
+
+
+def items(*product_ids) -> list:
+    return [{"product_id": pid, "quantity": 1} for pid in product_ids]
+
+
+async def test_orders_build_ranked_neighbors(db):
+    await recommendations.record_order(db, items("lamp", "bulb", "lamp"))
+    await recommendations.record_order(db, items("lamp", "bulb", "shade"))
+    await recommendations.record_order(db, items("lamp", "desk"))
+    await recommendations.record_order(db, items("lamp"))
+
+    assert await recommendations.get_neighbors(db, "lamp") == ["bulb", "desk", "shade"]
+    assert await recommendations.get_neighbors(db, "shade") == ["bulb", "lamp"]
+    assert await recommendations.get_neighbors(db, "unknown") == []
+    pair = await db[recommendations.PAIRS].find_one({"_id": "lamp|bulb"})
+    assert (pair['product_id'], pair['other_id'], pair['count']) == ("lamp", "bulb", 2)
+
+
+async def test_neighbors_are_capped_at_k(db):
+    await recommendations.record_order(db, items("a", "b", "c", "d"), k=2)
+
+    assert await recommendations.get_neighbors(db, "a") == ["b", "c"]
+
+
+async def test_rebuild_yields_to_another_worker(db):
+    assert await locks.acquire(db, recommendations.REBUILD_LOCK, "other-worker", lease_seconds=60)
+
+    assert await recommendations.rebuild(db) is False
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+import pytest
+import locks
+import rollups
+from timestamps import utcnow
+
+pytestmark = pytest.mark.anyio
+
+
+def order(order_id: str, day: int, total: float, status: str = "pending") -> dict:
+    return {
+        "id": order_id,
+        "created_at": datetime(2024, 3, day, 12, tzinfo=timezone.utc),
+        "status": status,
+        "total": total,
+        "items": [{"product_id": "p1", "price": total, "quantity": 1}],
+    }
+
+
+async def test_orders_and_status_changes_roll_up(db):
+    await db.products.insert_one({"id": "p1", "category": "Audio"})
+    await rollups.record_order(db, order("o1", 4, 10.0))
+    await rollups.record_order(db, order("o2", 5, 5.0), categories={})
+    await rollups.record_status_change(db, "pending", "processing")
+    await rollups.record_status_change(db, "processing", "processing")
+
+    assert await rollups.get_totals(db) == {
+        "orders": 2, "revenue": 15.0, "status_counts": {"pending": 1, "processing": 1},
+    }
+    week = await rollups.get_series(db, date(2024, 3, 1), date(2024, 3, 31), "week")
+    assert week["series"] == [{"bucket": "2024-03-04", "orders": 2, "revenue": 15.0}]
+    assert week["categories"] == [
+        {"category": "Audio", "revenue": 10.0, "units": 1},
+        {"category": rollups.UNCATEGORIZED, "revenue": 5.0, "units": 1},
+    ]
+
+
+async def test_lease_is_exclusive_until_released(db):
+    async with locks.lease(db, "job") as first:
+        async with locks.lease(db, "job") as second:
+            assert (first, second) == (True, False)
+    async with locks.lease(db, "job") as again:
+        assert again is True
+    assert await db[locks.COLLECTION].count_documents({}) == 0
+
+
+async def test_lapsed_lease_can_be_taken_over(db):
+    assert await locks.acquire(db, "job", "a", lease_seconds=60) is True
+    assert await locks.acquire(db, "job", "b", lease_seconds=60) is False
+    assert await locks.acquire(db, "job", "a", lease_seconds=60) is True
+
+    await db[locks.COLLECTION].update_one({"_id": "job"}, {"$set": {"expires_at": utcnow() - timedelta(seconds=1)}})
+    assert await locks.acquire(db, "job", "b", lease_seconds=60) is True
+    # The old holder's release no longer touches the new lease
+    await locks.release(db, "job", "a")
+    assert (await db[locks.COLLECTION].find_one({"_id": "job"}))['owner'] == "b"
+
+
+async def test_lease_is_renewed_while_held(db):
+    async with locks.lease(db, "job", lease_seconds=0.06) as held:
+        assert held
+        first = (await db[locks.COLLECTION].find_one({"_id": "job"}))['expires_at']
+        await asyncio.sleep(0.05)
+        assert (await db[locks.COLLECTION].find_one({"_id": "job"}))['expires_at'] > first
+
+
+async def test_an_order_is_counted_once(db):
+    assert await rollups.record_order(db, order("o1", 4, 10.0), categories={}) is True
+    assert await rollups.record_order(db, order("o1", 4, 10.0), categories={}) is False
+
+    assert await rollups.get_totals(db) == {"orders": 1, "revenue": 10.0, "status_counts": {"pending": 1}}
+    day = await db[rollups.ROLLUPS].find_one({"_id": "day:2024-03-04"})
+    assert (day['orders'], day['revenue']) == (1, 10.0)
+
+
+async def test_rebuild_replay_skips_orders_counted_after_the_swap(db, monkeypatch):
+    placed = {}
+
+    async def build_staging(db, high_water):
+        # An order is placed while the rebuild runs...
+        placed.update(order("o1", 4, 10.0), created_at=utcnow())
+        await db.orders.insert_one(dict(placed))
+        await db[rollups.STAGING].insert_one({"_id": rollups.TOTALS_ID, "orders": 0, "revenue": 0.0})
+
+    staging = db[rollups.STAGING]
+    rename = staging.rename
+
+    async def rename_then_record(*args, **kwargs):
+        await rename(*args, **kwargs)
+        # ...and its live rollup write lands in the freshly swapped collection
+        await rollups.record_order(db, placed, categories={})
+
+    class Statuses:
+        async def to_list(self, length):
+            return [{"_id": "pending", "orders": 1}]
+
+    monkeypatch.setattr(rollups, "_build_staging", build_staging)
+    monkeypatch.setattr(staging, "rename", rename_then_record)
+    monkeypatch.setattr(db.orders, "aggregate", lambda pipeline: Statuses(), raising=False)
+
+    assert await rollups.rebuild_rollups(db) is True
+    assert await rollups.get_totals(db) == {"orders": 1, "revenue": 10.0, "status_counts": {"pending": 1}}
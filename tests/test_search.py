@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from search import ProductSearchIndex
+
+PRODUCTS = [
+    {"id": "p1", "name": "Wireless Headphones", "description": "Over-ear, noise cancelling", "category": "Audio"},
+    {"id": "p2", "name": "Head Strap", "description": "Fits most headphones", "category": "Accessories"},
+    {"id": "p3", "name": "Desk Lamp", "description": "Warm light", "category": "Home"},
+]
+
+
+@pytest.fixture
+def index():
+    index = ProductSearchIndex()
+    index.build(PRODUCTS)
+    return index
+
+
+def test_name_matches_rank_above_description_matches(index):
+    assert index.search("headphones") == ["p1", "p2"]
+    assert index.search("headphones", category="Accessories") == ["p2"]
+
+
+def test_last_token_is_prefix_matched_and_exact_terms_win(index):
+    assert index.search("lam") == ["p3"]
+    assert index.search("head")[0] == "p2"
+    assert index.search("desk lam") == ["p3"]
+    assert index.search("lam desk") == []
+
+
+def test_typos_are_forgiven(index):
+    assert index.search("wireles") == ["p1"]
+    assert index.search("headphnes") == ["p1", "p2"]
+
+
+def test_upsert_and_remove_keep_postings_consistent(index):
+    index.upsert({"id": "p3", "name": "Floor Lamp", "category": "Home"})
+    assert index.search("desk") == []
+    assert index.search("floor") == ["p3"]
+
+    index.remove("p3")
+    assert index.search("lamp") == []
+    assert "lamp" not in index.vocabulary
+    assert len(index) == 2
+
+
+class SlowCollection:
+    """Yields products one at a time so changes can land mid-reload."""
+
+    def __init__(self, products: list, gate: asyncio.Event):
+        self.products = products
+        self.gate = gate
+
+    def find(self, *args):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, product in enumerate(self.products):
+            if i == 1:
+                await self.gate.wait()
+            yield product
+
+
+@pytest.mark.anyio
+async def test_changes_during_a_reload_survive_the_swap(index):
+    gate = asyncio.Event()
+    # The reload reads p1 and p2's old text; p3 was deleted before the read got to it
+    db = type("DB", (), {"products": SlowCollection(PRODUCTS[:2], gate)})()
+    reload = asyncio.create_task(index.load(db))
+    await asyncio.sleep(0)
+
+    index.upsert({"id": "p2", "name": "Cable Organiser", "category": "Accessories"})
+    index.remove("p3")
+    index.upsert({"id": "p4", "name": "Floor Lamp", "category": "Home"})
+    gate.set()
+    await reload
+
+    assert index.search("strap") == []
+    assert index.search("cable") == ["p2"]
+    assert index.search("lamp") == ["p4"]
+    assert index.ready and len(index) == 3
+    assert index._reloads == []
@@ -0,0 +1,86 @@
+import gzip
+from datetime import datetime, timezone
+from decimal import Decimal
+import httpx
+import pytest
+from pydantic import BaseModel
+from starlette.responses import PlainTextResponse, StreamingResponse
+import serialization
+from serialization import CompressionMiddleware, accepted_encoding, dumps, json_response
+
+
+class Item(BaseModel):
+    name: str
+
+
+def test_dumps_handles_dates_models_and_unknown_types():
+    when = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    body = dumps({"when": when, "item": Item(name="lamp"), "amount": Decimal("1.50")})
+
+    assert body == b'{"when":"2024-01-01T00:00:00+00:00","item":{"name":"lamp"},"amount":"1.50"}'
+    assert json_response([1], headers={"X-Next-Cursor": "c"}).headers["x-next-cursor"] == "c"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", None),
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("identity, gzip;q=bogus", None),
+])
+def test_accepted_encoding(header, expected, monkeypatch):
+    monkeypatch.setattr(serialization, "brotli", None)
+    assert accepted_encoding(header) == expected
+
+
+def client(app) -> httpx.AsyncClient:
+    transport = httpx.ASGITransport(app=CompressionMiddleware(app, minimum_size=100))
+    return httpx.AsyncClient(transport=transport, base_url="http://test", headers={"Accept-Encoding": "gzip"})
+
+
+@pytest.mark.anyio
+async def test_large_bodies_are_compressed_and_small_ones_left_alone(monkeypatch):
+    monkeypatch.setattr(serialization, "brotli", None)
+    body = "x" * 500
+
+    async def app(scope, receive, send):
+        size = 500 if scope["path"] == "/big" else 10
+        await PlainTextResponse(body[:size])(scope, receive, send)
+
+    async with client(app) as http:
+        big = await http.get("/big")
+        small = await http.get("/small")
+
+    assert big.headers["content-encoding"] == "gzip"
+    assert big.headers["vary"] == "Accept-Encoding"
+    assert big.text == body  # httpx decodes it
+    assert "content-encoding" not in small.headers
+
+
+@pytest.mark.anyio
+async def test_streams_are_compressed_and_event_streams_and_encoded_bodies_skipped(monkeypatch):
+    monkeypatch.setattr(serialization, "brotli", None)
+
+    async def chunks():
+        for i in range(3):
+            yield f"line {i}\n".encode() * 20
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/ndjson":
+            response = StreamingResponse(chunks(), media_type="application/x-ndjson")
+        elif scope["path"] == "/events":
+            response = StreamingResponse(chunks(), media_type="text/event-stream")
+        else:
+            response = PlainTextResponse(gzip.compress(b"y" * 500), headers={"Content-Encoding": "gzip"})
+        await response(scope, receive, send)
+
+    async with client(app) as http:
+        ndjson = await http.get("/ndjson")
+        events = await http.get("/events")
+        precompressed = await http.get("/cached")
+
+    assert ndjson.headers["content-encoding"] == "gzip"
+    assert "content-length" not in ndjson.headers
+    assert ndjson.text.count("line") == 60
+    assert "content-encoding" not in events.headers
+    assert precompressed.content == b"y" * 500
@@ -0,0 +1,236 @@
+from datetime import datetime, timezone
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+CREATED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def product(product_id: str, stock: int = 5, price: float = 10.0) -> dict:
+    return {"id": product_id, "name": f"Product {product_id}", "description": "", "price": price,
+            "category": "Home", "image": "", "stock": stock, "created_at": CREATED}
+
+
+def line(product_id: str, quantity: int = 1, price: float = 10.0) -> dict:
+    return {"product_id": product_id, "quantity": quantity, "price": price}
+
+
+async def place_order(api, user: dict, **headers):
+    return await api.post("/api/orders/create", params={"payment_method": "stripe"},
+                          headers={**user['headers'], **headers})
+
+
+async def start_payment(api, user: dict, order_id: str) -> str:
+    response = await api.post("/api/payments/stripe/create-session",
+                              params={"order_id": order_id, "origin_url": "https://shop.test"}, headers=user['headers'])
+    return response.json()['session_id']
+
+
+class Checkout:
+    """Stands in for StripeCheckout; a session reports paid once its id is in `paid`."""
+
+    def __init__(self, server):
+        self.server = server
+        self.paid = set()
+        self.sessions = 0
+
+    async def create_checkout_session(self, checkout_request):
+        self.sessions += 1
+        session_id = f"cs_test_{self.sessions}"
+        return self.server.CheckoutSessionResponse(url=f"https://checkout.test/{session_id}", session_id=session_id)
+
+    async def get_checkout_status(self, session_id: str):
+        paid = session_id in self.paid
+        return self.server.CheckoutStatusResponse(
+            status="complete" if paid else "open", payment_status="paid" if paid else "unpaid",
+            amount_total=0, currency="usd", metadata={},
+        )
+
+
+@pytest.fixture
+def checkout(server, monkeypatch):
+    from payments import PaymentClient
+
+    backend = Checkout(server)
+    monkeypatch.setattr(server, "payment_client", PaymentClient(lambda base_url: backend, max_retries=0))
+    return backend
+
+
+async def test_catalog_responses_revalidate_with_their_etag(server, api, db):
+    await db.products.insert_one(product("p1"))
+
+    first = await api.get("/api/products/p1")
+    again = await api.get("/api/products/p1", headers={"If-None-Match": first.headers["etag"]})
+
+    assert first.status_code == 200 and first.json()['stock'] == 5
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+    assert server.catalog_cache.hits == 1
+
+
+async def test_reserved_and_released_stock_invalidates_cached_pages(api, db, customer, admin):
+    await db.products.insert_one(product("p1"))
+    etag = (await api.get("/api/products/p1")).headers["etag"]
+    await db.carts.insert_one({"id": "c1", "user_id": customer['id'], "items": [line("p1", 2)]})
+
+    order = (await place_order(api, customer)).json()
+    reserved = await api.get("/api/products/p1", headers={"If-None-Match": etag})
+    await api.put(f"/api/admin/orders/{order['id']}/status", params={"status": "cancelled"}, headers=admin['headers'])
+    released = await api.get("/api/products/p1", headers={"If-None-Match": reserved.headers["etag"]})
+
+    assert reserved.status_code == 200 and reserved.json()['stock'] == 3
+    assert released.status_code == 200 and released.json()['stock'] == 5
+    assert released.headers["etag"] == etag
+
+
+async def test_placed_orders_are_counted_with_the_order_write(server, api, db, customer):
+    await db.products.insert_one(product("p1"))
+    await db.carts.insert_one({"id": "c1", "user_id": customer['id'], "items": [line("p1", 2)]})
+
+    order = (await place_order(api, customer)).json()
+
+    totals = await server.rollups.get_totals(db)
+    assert (totals['orders'], totals['revenue']) == (1, order['total'])
+    assert await server.rollups.record_order(db, order) is False
+
+
+async def test_repeated_cart_adds_stay_within_the_line_limit(server, api, db, customer):
+    await db.products.insert_one(product("p1", stock=500))
+
+    for _ in range(3):
+        response = await api.post("/api/cart/add", json={"product_id": "p1", "quantity": 40},
+                                  headers=customer['headers'])
+
+    assert response.status_code == 200
+    assert [item['quantity'] for item in response.json()['items']] == [server.MAX_LINE_QUANTITY]
+    assert (await place_order(api, customer)).status_code == 200
+
+
+async def test_orders_are_placed_from_the_flushed_cart_at_current_prices(server, api, db, customer, monkeypatch):
+    from cart_store import create_cart_store
+
+    monkeypatch.setattr(server, "cart_store", create_cart_store("memory", db.carts))
+    await db.products.insert_one(product("p1", price=10.0))
+    await api.post("/api/cart/add", json={"product_id": "p1", "quantity": 2}, headers=customer['headers'])
+    await db.products.update_one({"id": "p1"}, {"$set": {"price": 12.0}})
+
+    response = await place_order(api, customer)
+
+    order = response.json()
+    assert response.status_code == 200
+    assert order['items'] == [line("p1", 2, 12.0)] and order['total'] == 24.0
+    assert (await db.products.find_one({"id": "p1"}))['stock'] == 3
+    assert (await db.stock_reservations.find_one({"_id": order['id']}))['status'] == "held"
+    assert await db.carts.count_documents({}) == 0
+    assert (await api.get("/api/cart", headers=customer['headers'])).json()['items'] == []
+
+
+async def test_a_failed_order_write_releases_the_reserved_stock(server, api, db, customer, monkeypatch):
+    async def fail(doc, user_id):
+        raise RuntimeError("write failed")
+
+    await db.products.insert_one(product("p1"))
+    await db.carts.insert_one({"id": "c1", "user_id": customer['id'], "items": [line("p1", 2)]})
+    monkeypatch.setattr(server, "insert_order_and_clear_cart", fail)
+
+    with pytest.raises(RuntimeError):
+        await place_order(api, customer)
+
+    assert (await db.products.find_one({"id": "p1"}))['stock'] == 5
+    assert await db.stock_reservations.count_documents({}) == 0
+    assert await db.orders.count_documents({}) == 0
+    assert await db.carts.count_documents({"user_id": customer['id']}) == 1
+
+
+async def test_paid_sessions_move_the_order_to_processing(server, api, db, customer, checkout):
+    await db.products.insert_one(product("p1"))
+    await db.carts.insert_one({"id": "c1", "user_id": customer['id'], "items": [line("p1", 2)]})
+    order = (await place_order(api, customer)).json()
+    session_id = await start_payment(api, customer, order['id'])
+
+    checkout.paid.add(session_id)
+    status = await api.get(f"/api/payments/stripe/status/{session_id}", headers=customer['headers'])
+
+    assert status.json()['payment_status'] == "paid"
+    stored = await db.orders.find_one({"id": order['id']})
+    assert (stored['status'], stored['payment_id']) == ("processing", session_id)
+    assert (await db.payment_transactions.find_one({"session_id": session_id}))['payment_status'] == "paid"
+    # The reservation is committed: the units stay sold and the ledger is gone
+    assert await db.stock_reservations.count_documents({}) == 0
+    assert (await api.get("/api/products/p1")).json()['stock'] == 3
+    assert (await server.rollups.get_totals(db))['status_counts'] == {"processing": 1}
+
+
+async def test_payment_for_a_cancelled_order_is_flagged_for_refund(server, api, db, customer, admin, checkout):
+    await db.products.insert_one(product("p1"))
+    await db.carts.insert_one({"id": "c1", "user_id": customer['id'], "items": [line("p1", 2)]})
+    order = (await place_order(api, customer)).json()
+    session_id = await start_payment(api, customer, order['id'])
+    await api.put(f"/api/admin/orders/{order['id']}/status", params={"status": "cancelled"}, headers=admin['headers'])
+
+    checkout.paid.add(session_id)
+    await api.get(f"/api/payments/stripe/status/{session_id}", headers=customer['headers'])
+
+    stored = await db.orders.find_one({"id": order['id']})
+    assert (stored['status'], stored.get('payment_id')) == ("cancelled", None)
+    transaction = await db.payment_transactions.find_one({"session_id": session_id})
+    assert (transaction['payment_status'], transaction['refund_required']) == ("paid", True)
+    assert (await api.get("/api/products/p1")).json()['stock'] == 5
+
+
+async def test_order_event_streams_take_a_connection_slot(server, api, db, customer, monkeypatch):
+    await db.orders.insert_one({"id": "o1", "user_id": customer['id'], "status": "delivered"})
+
+    streamed = await api.get("/api/orders/o1/events", headers=customer['headers'])
+    monkeypatch.setattr(server.event_hub, "max_connections", 0)
+    rejected = await api.get("/api/orders/o1/events", headers=customer['headers'])
+
+    assert streamed.status_code == 200 and '"delivered"' in streamed.text
+    assert rejected.status_code == 503 and rejected.headers["retry-after"] == "5"
+    assert server.event_hub.connections == 0
+
+
+async def test_order_creation_replays_under_the_same_idempotency_key(server, api, db, customer, monkeypatch):
+    await db.products.insert_one(product("p1"))
+    await db.carts.insert_one({"id": "c1", "user_id": customer['id'], "items": [line("p1", 2)]})
+
+    first = await place_order(api, customer, **{"Idempotency-Key": "k1"})
+    again = await place_order(api, customer, **{"Idempotency-Key": "k1"})
+    # A fresh worker replays from the stored record
+    monkeypatch.setattr(server, "idempotency_store", server.IdempotencyStore(db))
+    restarted = await place_order(api, customer, **{"Idempotency-Key": "k1"})
+    changed = await api.post("/api/orders/create", params={"payment_method": "paypal"},
+                             headers={**customer['headers'], "Idempotency-Key": "k1"})
+
+    assert first.headers["idempotent-replayed"] == "false"
+    assert again.headers["idempotent-replayed"] == restarted.headers["idempotent-replayed"] == "true"
+    assert again.json() == restarted.json() == first.json()
+    assert changed.status_code == 422
+    assert await db.orders.count_documents({}) == 1
+    assert (await db.products.find_one({"id": "p1"}))['stock'] == 3
+
+
+@pytest.mark.parametrize("mode, accepted", [("db", False), ("cached", True), ("claims", True)])
+async def test_auth_modes_trade_freshness_for_lookups(server, api, db, customer, monkeypatch, mode, accepted):
+    monkeypatch.setattr(server, "AUTH_MODE", mode)
+    assert (await api.get("/api/cart", headers=customer['headers'])).status_code == 200
+
+    # Revoked by a write this worker never heard about over the broadcast
+    await db.users.update_one({"id": customer['id']}, {"$inc": {"auth_epoch": 1}})
+    stale = await api.get("/api/cart", headers=customer['headers'])
+
+    assert stale.status_code == (200 if accepted else 401)
+
+
+@pytest.mark.parametrize("mode", ["db", "cached", "claims"])
+async def test_revoked_sessions_are_rejected_in_every_auth_mode(server, api, db, customer, admin, monkeypatch, mode):
+    monkeypatch.setattr(server, "AUTH_MODE", mode)
+    assert (await api.get("/api/cart", headers=customer['headers'])).status_code == 200
+
+    await api.post(f"/api/admin/users/{customer['id']}/revoke-sessions", headers=admin['headers'])
+    revoked = await api.get("/api/cart", headers=customer['headers'])
+    token = server.create_access_token(server.token_claims(await db.users.find_one({"id": customer['id']})))
+    renewed = await api.get("/api/cart", headers={"Authorization": f"Bearer {token}"})
+
+    assert revoked.status_code == 401 and revoked.json()['detail'] == "Token revoked"
+    assert renewed.status_code == 200
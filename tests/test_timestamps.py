@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import migrate_timestamps
+from timestamps import for_storage, parse, range_filter
+
+UTC = timezone.utc
+START = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+@pytest.mark.parametrize("value", [
+    "2024-01-01T00:00:00+00:00",
+    "2024-01-01T00:00:00Z",
+    "2024-01-01T01:00:00+01:00",
+    datetime(2024, 1, 1),
+    datetime(2024, 1, 1, tzinfo=UTC),
+])
+def test_parse_normalises_to_aware_utc(value):
+    assert parse(value) == START
+    assert parse(value).tzinfo == UTC
+
+
+def test_for_storage_converts_only_present_fields():
+    doc = for_storage({"created_at": "2024-01-01T00:00:00Z", "updated_at": None, "name": "x"})
+    assert doc == {"created_at": START, "updated_at": None, "name": "x"}
+
+
+def test_range_filter_matches_both_stored_formats():
+    end = START + timedelta(days=1)
+    assert range_filter("created_at", START, end) == {"$or": [
+        {"created_at": {"$gte": START, "$lt": end}},
+        {"created_at": {"$gte": START.isoformat(), "$lt": end.isoformat()}},
+    ]}
+    assert range_filter("created_at") == {}
+
+
+@pytest.mark.anyio
+async def test_migration_converts_strings_and_resumes(db):
+    await db.orders.insert_many([
+        {"_id": f"o{i}", "created_at": (START + timedelta(hours=i)).isoformat()} for i in range(5)
+    ] + [
+        {"_id": "o5", "created_at": START},
+        {"_id": "o6", "created_at": "yesterday"},
+    ])
+    # An earlier run stopped after o1
+    await db[migrate_timestamps.MIGRATIONS].insert_one({"_id": "timestamps:orders", "last_id": "o1", "scanned": 2})
+
+    await migrate_timestamps.migrate(db, ["orders"], batch_size=2)
+
+    stored = {o['_id']: o['created_at'] async for o in db.orders.find({})}
+    assert isinstance(stored["o0"], str) and isinstance(stored["o1"], str)
+    assert [stored[f"o{i}"] for i in (2, 3, 4)] == [START + timedelta(hours=i) for i in (2, 3, 4)]
+    assert stored["o6"] == "yesterday"
+    progress = await db[migrate_timestamps.MIGRATIONS].find_one({"_id": "timestamps:orders"})
+    assert progress['done'] and progress['converted'] == 3 and progress['scanned'] == 6
+
+    # A finished migration is skipped until it is reset
+    await migrate_timestamps.migrate(db, ["orders"])
+    assert isinstance((await db.orders.find_one({"_id": "o0"}))['created_at'], str)
+    await migrate_timestamps.migrate(db, ["orders"], reset=True)
+    assert (await db.orders.find_one({"_id": "o0"}))['created_at'] == START
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from types import SimpleNamespace
+import pytest
+import webhooks
+from timestamps import utcnow
+
+pytestmark = pytest.mark.anyio
+
+
+def event(event_id: str, session_id: str = "cs_1", payment_status: str = "paid"):
+    return SimpleNamespace(event_id=event_id, event_type="checkout.session.completed", session_id=session_id,
+                           payment_status=payment_status, metadata={"order_id": "o1"})
+
+
+async def test_enqueue_ignores_redeliveries(db):
+    assert await webhooks.enqueue(db, event("evt_1"), b"{}") is True
+    assert await webhooks.enqueue(db, event("evt_1"), b"{}") is False
+
+    stored = await db[webhooks.QUEUE].find_one({"_id": "evt_1"})
+    assert stored['status'] == webhooks.QUEUED
+    assert stored['metadata'] == {"order_id": "o1"}
+
+
+async def test_enqueue_keys_events_without_an_id_by_body(db):
+    assert await webhooks.enqueue(db, event(None), b'{"a": 1}') is True
+    assert await webhooks.enqueue(db, event(None), b'{"a": 1}') is False
+    assert await webhooks.enqueue(db, event(None), b'{"a": 2}') is True
+
+
+async def test_batch_is_applied_and_marked_done(db):
+    applied = []
+
+    async def apply_batch(batch):
+        applied.append([e['_id'] for e in batch])
+
+    for event_id in ("evt_1", "evt_2"):
+        await webhooks.enqueue(db, event(event_id), b"{}")
+    pool = webhooks.WebhookWorkerPool(db, apply_batch)
+
+    await pool._process(await pool._claim())
+
+    assert applied == [["evt_1", "evt_2"]]
+    assert await db[webhooks.QUEUE].count_documents({"status": webhooks.DONE}) == 2
+    assert await pool._claim() == []
+    assert pool.stats()['processed'] == 2
+
+
+async def test_poison_event_is_isolated_then_dead_lettered(db):
+    async def apply_batch(batch):
+        if any(e['_id'] == "evt_bad" for e in batch):
+            raise RuntimeError("boom")
+
+    for event_id in ("evt_1", "evt_bad", "evt_2"):
+        await webhooks.enqueue(db, event(event_id), b"{}")
+    pool = webhooks.WebhookWorkerPool(db, apply_batch, max_attempts=2, backoff_seconds=0)
+
+    await pool._process(await pool._claim())
+    statuses = {e['_id']: e['status'] async for e in db[webhooks.QUEUE].find({})}
+    assert statuses == {"evt_1": webhooks.DONE, "evt_bad": webhooks.QUEUED, "evt_2": webhooks.DONE}
+
+    await pool._process(await pool._claim())
+    bad = await db[webhooks.QUEUE].find_one({"_id": "evt_bad"})
+    assert bad['status'] == webhooks.DEAD
+    assert bad['attempts'] == 2
+    assert "claim" not in bad
+    assert await pool._claim() == []
+    assert pool.stats() == {"workers": 2, "processed": 2, "retried": 1, "dead_lettered": 1}
+
+
+async def test_lapsed_lease_is_claimed_again(db):
+    await webhooks.enqueue(db, event("evt_1"), b"{}")
+    pool = webhooks.WebhookWorkerPool(db, None)
+    assert [e['_id'] for e in await pool._claim()] == ["evt_1"]
+    assert await pool._claim() == []
+
+    await db[webhooks.QUEUE].update_one({"_id": "evt_1"}, {"$set": {"lease_until": utcnow() - timedelta(seconds=1)}})
+
+    assert [e['_id'] for e in await pool._claim()] == ["evt_1"]
+
+
+def test_paid_sessions_dedupes_and_skips_unpaid():
+    events = [
+        {"session_id": "cs_2", "payment_status": "paid"},
+        {"session_id": "cs_1", "payment_status": "paid"},
+        {"session_id": "cs_2", "payment_status": "paid"},
+        {"session_id": "cs_3", "payment_status": "unpaid"},
+        {"session_id": None, "payment_status": "paid"},
+    ]
+    assert webhooks.paid_sessions(events) == ["cs_1", "cs_2"]